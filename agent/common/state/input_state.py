@@ -20,3 +20,8 @@ class InputState:
     """
     The context for the video
     """
+
+    partial_context: bool = False
+    """
+    True while the video is still being ingested and video_context only covers the segments processed so far
+    """
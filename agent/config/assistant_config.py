@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from typing import Dict
+from typing import Dict, Optional
 from dotenv import load_dotenv
 
 from agent.config import constants
@@ -21,6 +21,27 @@ class AssistantConfiguration(BaseConfiguration):
             "description": "The language model used by default in the operator"
         },
     )
+    deadline: Optional[float] = field(
+        default=None,
+        metadata={
+            "description": "Absolute time (time.time()) by which every LLM request of the run must complete, "
+                           "see request_executor.with_deadline"
+        },
+    )
+    request_timeout_seconds: float = field(
+        default=constants.REQUEST_TIMEOUT_SECONDS,
+        metadata={
+            "description": "Timeout of a single LLM request in seconds, 0 for none; within the deadline of the "
+                           "run, the request is sent again after the timeout"
+        },
+    )
+    hedge_requests: bool = field(
+        default=constants.HEDGE_REQUESTS,
+        metadata={
+            "description": "Send a duplicate of an LLM request running longer than the usual latency, "
+                           "the first response wins"
+        },
+    )
 
 
 if __name__ == "__main__":
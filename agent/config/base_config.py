@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import os
 from dataclasses import dataclass, fields
-from typing import Optional, Type, TypeVar
+from typing import List, Optional, Type, TypeVar
 
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
@@ -11,6 +11,12 @@ from langchain_core.runnables import RunnableConfig, ensure_config
 
 from agent.config import constants
 from agent.config.initialize_logger import logger
+from agent.config.llm_cache import get_llm_cache
+from agent.config.model_registry import get_or_create_model, warmup_models
+from agent.config.offline_models import FakeChatModel, ReplayChatModel
+from agent.utils.cancellation import CancellationCallbackHandler
+from agent.utils.rate_limiter import ConcurrencyCallbackHandler
+from agent.utils.token_utils import TokenAccountingCallbackHandler, get_max_input_tokens
 
 load_dotenv()
 
@@ -28,27 +34,69 @@ class BaseConfiguration:
         return cls(**{k: v for k, v in configurable.items() if k in _fields})
 
     @classmethod
-    def get_model(cls: Type[T], model: dict) -> BaseChatModel:
-        """Load a chat model from the specified dict.
+    def get_model(cls: Type[T], model: dict, bypass_cache: bool = False) -> BaseChatModel:
+        """Get the chat model of the specified dict.
+        The model is created on first use and shared by every later call in the process (see model_registry).
         Args:
             dict(str,str): Dictionary with name and provider for the model'.
+            bypass_cache (bool): If True, requests of the model never read or write the LLM response cache.
+        """
+        return get_or_create_model(model, bypass_cache, cls._create_model)
+
+    @classmethod
+    def warmup_models(cls: Type[T], models: List[dict], mode: Optional[str] = None) -> None:
+        """Create the specified models ahead of the first request (see model_registry.warmup_models).
+        Args:
+            models (list[dict]): Dictionaries with name and provider of the models.
+            mode (str): "off", "init" or "request", defaults to constants.MODEL_WARMUP.
+        """
+        warmup_models(models, cls._create_model, mode)
+
+    @classmethod
+    def _create_model(cls: Type[T], model: dict, bypass_cache: bool = False) -> BaseChatModel:
+        """Load a new chat model from the specified dict.
+        Args:
+            dict(str,str): Dictionary with name and provider for the model'.
+            bypass_cache (bool): If True, requests of the model never read or write the LLM response cache.
         """
         provider = model['provider']
         model_name = model['model_name']
         max_tokens = model['max_tokens'] if 'max_tokens' in model else constants.MAX_OUTPUT_TOKENS
         logger.info(f"Loading model {model['model_name']} from provider {provider}")
 
+        # Offline providers never use the response cache, replay reads the recordings of REPLAY_CACHE_PATH itself
+        offline = provider in ("fake", "replay")
+        llm_cache = None if bypass_cache or offline else get_llm_cache(model)
+        # False explicitly disables any globally configured langchain cache
+        common_kwargs = {"cache": llm_cache if llm_cache is not None else False}
+        # Every request is estimated before dispatch, rejected over budget and accounted in the token usage report,
+        # rejected once the operation that makes it is cancelled, and held until the adaptive concurrency limit of
+        # the provider/model lets it start. The hold is the rate limiter of the model, which LangChain only calls
+        # on a cache miss, after every callback (none can reject a request holding a slot)
+        concurrency = ConcurrencyCallbackHandler(model)
+        common_kwargs["callbacks"] = [CancellationCallbackHandler(),
+                                      TokenAccountingCallbackHandler(provider, get_max_input_tokens(provider, model_name)),
+                                      concurrency]
+        common_kwargs["rate_limiter"] = concurrency
+        # The SDKs must not retry 429s themselves while holding the concurrency slot: the overloads reach the
+        # ConcurrencyCallbackHandler and request_executor.invoke_with_retries backs off
+        provider_kwargs = {"max_retries": 0}
         model_instance = None
         match provider:
             case "openai":
-                model_kwargs = {}
-                model_instance = init_chat_model(model_name, model_provider=provider, **model_kwargs)
+                model_kwargs = {**provider_kwargs, **get_http_client_kwargs()}
+                model_instance = init_chat_model(model_name, model_provider=provider, **model_kwargs, **common_kwargs)
             case "azure_openai":
-                model_kwargs = {"api_version": os.environ["AZURE_OPENAI_API_VERSION"]}
-                model_instance = init_chat_model(model_name, model_provider=provider, **model_kwargs)
+                model_kwargs = {"api_version": os.environ["AZURE_OPENAI_API_VERSION"], **provider_kwargs,
+                                **get_http_client_kwargs()}
+                model_instance = init_chat_model(model_name, model_provider=provider, **model_kwargs, **common_kwargs)
             case "google_genai":
-                model_kwargs = {"max_tokens": max_tokens}
-                model_instance = init_chat_model(model_name, model_provider=provider, **model_kwargs)
+                model_kwargs = {"max_tokens": max_tokens, **provider_kwargs}
+                model_instance = init_chat_model(model_name, model_provider=provider, **model_kwargs, **common_kwargs)
+            case "fake":
+                model_instance = FakeChatModel(model_name=model_name, **common_kwargs)
+            case "replay":
+                model_instance = ReplayChatModel(model_name=model_name, **common_kwargs)
             case _:
                 raise ValueError(f"Unsupported: {provider}")
 
@@ -56,4 +104,15 @@ class BaseConfiguration:
         return model_instance
 
 
+def get_http_client_kwargs() -> dict:
+    """
+    Keep-alive connection pools for the sync and async HTTP clients of an openai/azure_openai model.
+    """
+    import httpx
+
+    limits = httpx.Limits(max_connections=constants.HTTP_MAX_CONNECTIONS,
+                          max_keepalive_connections=constants.HTTP_MAX_KEEPALIVE_CONNECTIONS)
+    return {"http_client": httpx.Client(limits=limits), "http_async_client": httpx.AsyncClient(limits=limits)}
+
+
 T = TypeVar("T", bound=BaseConfiguration)
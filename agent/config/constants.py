@@ -3,3 +3,106 @@ import os
 PROVIDER = os.getenv('MODEL_PROVIDER', 'google_genai')
 MODEL_NAME = os.getenv('MODEL_NAME', 'gemini-2.0-flash')
 MAX_OUTPUT_TOKENS= int(os.getenv('MAX_OUTPUT_TOKENS', 1000000))
+
+# Provider rate limits shared by every LLM request of the process (per provider/model): ceiling of the adaptive
+# concurrency limit, and optional static cap on the requests started per minute (0 for none)
+MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', 16))
+REQUESTS_PER_MINUTE = int(os.getenv('REQUESTS_PER_MINUTE', 0))
+# AIMD concurrency control: the in-flight limit starts at AIMD_INITIAL_CONCURRENCY, grows additively while
+# requests succeed with a healthy latency, and is multiplied by AIMD_DECREASE_FACTOR on a 429/503 response or
+# a request slower than AIMD_LATENCY_SPIKE_FACTOR times the usual latency of its stage
+ADAPTIVE_CONCURRENCY = os.getenv('ADAPTIVE_CONCURRENCY', 'true').lower() in ('1', 'true', 'yes')
+AIMD_INITIAL_CONCURRENCY = int(os.getenv('AIMD_INITIAL_CONCURRENCY', 4))
+AIMD_DECREASE_FACTOR = float(os.getenv('AIMD_DECREASE_FACTOR', 0.5))
+AIMD_LATENCY_SPIKE_FACTOR = float(os.getenv('AIMD_LATENCY_SPIKE_FACTOR', 3.0))
+# Smoothing of the usual latency of a stage, and latencies needed before a latency spike is detected
+AIMD_LATENCY_EWMA_WEIGHT = 0.1
+AIMD_LATENCY_MIN_SAMPLES = 10
+# Retries of a request rejected by the provider as overloaded (429/503) or failed on a transient error (5xx,
+# connection), after REQUEST_RETRY_SECONDS doubled at every retry. The provider SDKs do not retry themselves, so
+# that every overload reaches the adaptive concurrency limit
+REQUEST_RETRIES = int(os.getenv('REQUEST_RETRIES', 5))
+REQUEST_RETRY_SECONDS = float(os.getenv('REQUEST_RETRY_SECONDS', 1.0))
+
+# Execution of a single LLM request (see request_executor.invoke_llm): timeout of a request in seconds, 0 for none.
+# Within the deadline of a graph run, an unanswered request is sent again after the timeout instead of failing
+REQUEST_TIMEOUT_SECONDS = float(os.getenv('REQUEST_TIMEOUT_SECONDS', 300))
+# Hedging: a duplicate of a request is sent once it runs longer than the HEDGE_QUANTILE latency of the previous
+# requests of its model and stage, the first response wins
+HEDGE_REQUESTS = os.getenv('HEDGE_REQUESTS', 'false').lower() in ('1', 'true', 'yes')
+HEDGE_QUANTILE = float(os.getenv('HEDGE_QUANTILE', 0.95))
+# Latencies kept per model and stage, and latencies needed before any request is hedged
+HEDGE_LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+# Deadline of an agent graph run started from the UI, no request of the run outlives it
+GRAPH_DEADLINE_SECONDS = float(os.getenv('GRAPH_DEADLINE_SECONDS', 600))
+
+# On-disk LLM response cache, opt-in: "off" by default, "read_write" serves and stores responses (and records them
+# for the replay provider), "read_only" only serves them, "write_only" only stores them
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join('..', 'docs', 'llm_cache.sqlite'))
+LLM_CACHE_MAX_MB = int(os.getenv('LLM_CACHE_MAX_MB', 2048))
+LLM_CACHE_MODE = os.getenv('LLM_CACHE_MODE', 'off')
+LLM_CACHE_BYPASS = os.getenv('LLM_CACHE_BYPASS', 'false').lower() in ('1', 'true', 'yes')
+
+# Pre-flight token accounting
+# Maximum estimated input tokens of a single request, larger requests are rejected before dispatch; 0 for the
+# context window of the model (see token_utils.get_max_input_tokens)
+MAX_INPUT_TOKENS = int(os.getenv('MAX_INPUT_TOKENS', 0))
+# Context window in tokens of the known models, matched on the longest model name prefix, and of the other models
+# of each provider
+MODEL_CONTEXT_WINDOWS = {
+    'gemini-1.5-pro': 2097152,
+    'gemini-1.5-flash': 1048576,
+    'gemini-2.0-flash': 1048576,
+    'gemini-2.5': 1048576,
+    'gpt-4o': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4.1': 1047576,
+    'o1': 200000,
+    'o3': 200000,
+    'o4-mini': 200000,
+}
+PROVIDER_CONTEXT_WINDOWS = {
+    'google_genai': 1048576,
+    'openai': 128000,
+    'azure_openai': 128000,
+    # The offline providers stand in for any model
+    'fake': 1048576,
+    'replay': 1048576,
+}
+DEFAULT_CONTEXT_WINDOW = 128000
+# Rough number of characters per text token
+CHARS_PER_TOKEN = 4
+# Gemini: images are billed per 768px tile, images with both sides within 384px count as a single tile
+IMAGE_TOKENS_PER_TILE = 258
+IMAGE_TILE_SIZE = 768
+IMAGE_SMALL_SIDE = 384
+# OpenAI: high detail images are billed a base cost plus a cost per 512px tile
+OPENAI_IMAGE_BASE_TOKENS = 85
+OPENAI_IMAGE_TOKENS_PER_TILE = 170
+OPENAI_IMAGE_TILE_SIZE = 512
+# Audio tokens per second of audio
+AUDIO_TOKENS_PER_SECOND = 32
+# Name of the per-video token usage report written in the ingestion output folder
+TOKEN_USAGE_FILE = 'token_usage.json'
+
+# Chat model registry: models are created once per process and shared
+# Warmup at startup: "off", "init" (create the clients) or "request" (also open the connections)
+MODEL_WARMUP = os.getenv('MODEL_WARMUP', 'init')
+# Connection pool of the HTTP clients shared by the openai/azure_openai models
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 20))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 10))
+
+# Offline providers, "fake" returns canned responses and "replay" serves responses recorded in the LLM cache
+# Simulated latency of the fake provider: "fixed", "uniform", "normal" or "lognormal" distribution
+FAKE_LATENCY_DISTRIBUTION = os.getenv('FAKE_LATENCY_DISTRIBUTION', 'fixed')
+FAKE_LATENCY_MS = float(os.getenv('FAKE_LATENCY_MS', 0))
+FAKE_LATENCY_JITTER_MS = float(os.getenv('FAKE_LATENCY_JITTER_MS', 0))
+# Probability of a simulated provider error per request
+FAKE_ERROR_RATE = float(os.getenv('FAKE_ERROR_RATE', 0))
+# Simulated provider capacity: requests beyond this many in flight are rejected with a 429, 0 for unlimited
+FAKE_MAX_CONCURRENCY = int(os.getenv('FAKE_MAX_CONCURRENCY', 0))
+FAKE_SEED = int(os.getenv('FAKE_SEED', 0))
+# LLM cache file the replay provider serves recorded responses from, recorded by runs with LLM_CACHE_MODE read_write
+# or write_only
+REPLAY_CACHE_PATH = os.getenv('REPLAY_CACHE_PATH', LLM_CACHE_PATH)
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from enum import Enum
+from typing import Iterator, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+from agent.config import constants
+from agent.config.initialize_logger import logger
+from agent.utils.token_utils import record_cached_request
+
+
+class LLMCacheMode(Enum):
+    """
+    Enumeration of the available LLM cache modes.
+
+    Attributes:
+        READ_WRITE: Serve cached responses and store new ones (read-through/write-through).
+        READ_ONLY: Serve cached responses but never store new ones.
+        WRITE_ONLY: Always call the provider and store (refresh) the response.
+        OFF: Neither read nor write the cache.
+    """
+    READ_WRITE = "read_write"
+    READ_ONLY = "read_only"
+    WRITE_ONLY = "write_only"
+    OFF = "off"
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    Content-addressed LLM response cache stored in a local SQLite file with size-based LRU eviction.
+
+    Entries are keyed on a hash of the provider, model name, max tokens, invocation parameters and the
+    serialized messages, which include any media (images, audio) sent with the request.
+    Each entry also stores the request hash (a hash of the messages only), used by the replay provider to serve
+    recorded responses whatever the model that recorded them.
+    """
+
+    def __init__(self, model: dict, path: str = constants.LLM_CACHE_PATH,
+                 max_bytes: int = constants.LLM_CACHE_MAX_MB * 1024 * 1024,
+                 mode: LLMCacheMode = LLMCacheMode.READ_WRITE):
+        """
+        Initializes the SQLiteLLMCache.
+        :param model: Dictionary with provider, model_name and max_tokens of the cached model.
+        :param path: Path of the SQLite file.
+        :param max_bytes: Maximum total size of the cached responses, least recently used entries are evicted beyond it.
+        :param mode: LLMCacheMode of the cache.
+        """
+        self.provider = model['provider']
+        self.model_name = model['model_name']
+        self.max_tokens = model.get('max_tokens', constants.MAX_OUTPUT_TOKENS)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(llm_cache)")]
+            if 'request_hash' not in columns:
+                conn.execute("ALTER TABLE llm_cache ADD COLUMN request_hash TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_request_hash ON llm_cache (request_hash)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Connection to the SQLite file for one transaction, committed (or rolled back) and closed on exit.
+        """
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn, conn:
+            yield conn
+
+    def cache_key(self, prompt: str, llm_string: str) -> str:
+        """
+        Computes the content address of a request.
+        :param prompt: Serialized messages of the request.
+        :param llm_string: Serialized invocation parameters of the model.
+        :return: SHA-256 hex digest identifying the request.
+        """
+        payload = json.dumps([self.provider, self.model_name, self.max_tokens, llm_string, prompt])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def lookup_request(self, request_hash: str) -> Optional[RETURN_VAL_TYPE]:
+        """
+        Returns the most recently recorded response of a request, whatever the model that recorded it.
+        :param request_hash: hash of the serialized messages of the request (see get_request_hash)
+        :return: the recorded generations, or None if the request was never recorded
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value FROM llm_cache WHERE request_hash = ? ORDER BY last_access DESC LIMIT 1",
+                               (request_hash,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return loads(row[0])
+        except Exception as e:
+            logger.warning(f"Discarding unreadable LLM cache entry of request {request_hash}: {e}")
+            return None
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if self.mode not in (LLMCacheMode.READ_WRITE, LLMCacheMode.READ_ONLY):
+            return None
+        key = self.cache_key(prompt, llm_string)
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+        logger.debug(f"LLM cache hit for {self.provider}/{self.model_name}: {key}")
+        try:
+            value = loads(row[0])
+            record_cached_request()
+            return value
+        except Exception as e:
+            logger.warning(f"Discarding unreadable LLM cache entry {key}: {e}")
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if self.mode not in (LLMCacheMode.READ_WRITE, LLMCacheMode.WRITE_ONLY):
+            return
+        key = self.cache_key(prompt, llm_string)
+        value = dumps(list(return_val))
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, last_access, request_hash) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), time.time(), get_request_hash(prompt))
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """
+        Deletes the least recently used entries until the cache fits in max_bytes.
+        """
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        while total > self.max_bytes:
+            rows = conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access LIMIT 100").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+            logger.info(f"Evicted least recently used LLM cache entries, cache size is now {total} bytes")
+
+    def clear(self, **kwargs) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+
+def get_request_hash(prompt: str) -> str:
+    """
+    Hash of the serialized messages of a request, independent of the model they are sent to.
+    """
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+_llm_caches: dict[tuple, SQLiteLLMCache] = {}
+_llm_caches_lock = threading.Lock()
+
+
+def get_llm_cache(model: dict) -> Optional[SQLiteLLMCache]:
+    """
+    Returns the process-wide response cache of the model described by the model dict.
+    :param model: Dictionary with provider, model_name and max_tokens of the model.
+    :return: SQLiteLLMCache, or None if caching is bypassed or turned off.
+    """
+    if constants.LLM_CACHE_BYPASS or LLMCacheMode(constants.LLM_CACHE_MODE) == LLMCacheMode.OFF:
+        return None
+    key = (model['provider'], model['model_name'], model.get('max_tokens', constants.MAX_OUTPUT_TOKENS))
+    with _llm_caches_lock:
+        if key not in _llm_caches:
+            _llm_caches[key] = SQLiteLLMCache(model, path=constants.LLM_CACHE_PATH,
+                                              mode=LLMCacheMode(constants.LLM_CACHE_MODE))
+        return _llm_caches[key]
@@ -0,0 +1,74 @@
+import threading
+from typing import Callable, Dict, Hashable, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+
+from agent.config import constants
+from agent.config.initialize_logger import logger
+from agent.utils.token_utils import token_stage_config
+
+_models: Dict[Hashable, BaseChatModel] = {}
+_models_lock = threading.Lock()
+_warmed_up = False
+
+
+def get_model_key(model: dict, bypass_cache: bool = False) -> tuple:
+    """
+    Key of a model in the registry: every field of the model dict, plus the cache bypass flag.
+    """
+    return tuple(sorted((name, str(value)) for name, value in model.items())) + (('bypass_cache', bypass_cache),)
+
+
+def get_or_create_model(model: dict, bypass_cache: bool, factory: Callable[[dict, bool], BaseChatModel]) -> BaseChatModel:
+    """
+    Returns the process-wide chat model instance of the model dict, creating it with factory on first use.
+    Chat models are safe to share between threads, sharing them reuses their clients and keep-alive connections
+    instead of rebuilding them for every graph node or generator call.
+    :param model: Dictionary with provider, model_name and max_tokens of the model.
+    :param bypass_cache: whether the model bypasses the LLM response cache
+    :param factory: creates the model when it is not in the registry yet
+    :return: BaseChatModel shared by every caller asking for the same model
+    """
+    key = get_model_key(model, bypass_cache)
+    chat_model = _models.get(key)
+    if chat_model is not None:
+        return chat_model
+    with _models_lock:
+        if key not in _models:
+            _models[key] = factory(model, bypass_cache)
+        return _models[key]
+
+
+def clear_models() -> None:
+    """
+    Drop every registered model, the next get_model call creates them again.
+    """
+    global _warmed_up
+    with _models_lock:
+        _models.clear()
+        _warmed_up = False
+
+
+def warmup_models(models: List[dict], factory: Callable[[dict, bool], BaseChatModel],
+                  mode: Optional[str] = None) -> None:
+    """
+    Create the given models ahead of the first request, once per process.
+    :param models: model dicts to warm up
+    :param factory: creates a model missing from the registry
+    :param mode: "off", "init" (create the clients) or "request" (also send a tiny request to open the
+        connections), defaults to constants.MODEL_WARMUP
+    """
+    global _warmed_up
+    mode = mode or constants.MODEL_WARMUP
+    if mode == "off" or _warmed_up:
+        return
+    _warmed_up = True
+    for model in models:
+        try:
+            chat_model = get_or_create_model(model, False, factory)
+            if mode == "request":
+                chat_model.invoke("ping", config=token_stage_config("warmup"))
+            logger.info(f"Warmed up model {model['provider']}/{model['model_name']}")
+        except Exception as e:
+            # A failed warmup only costs the latency it was meant to save
+            logger.warning(f"Could not warm up model {model.get('model_name')}: {e}")
@@ -0,0 +1,227 @@
+import json
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+from agent.config import constants
+from agent.config.initialize_logger import logger
+from agent.config.llm_cache import SQLiteLLMCache, get_request_hash
+from agent.utils.token_utils import estimate_message_tokens, estimate_text_tokens
+
+
+class FakeProviderError(RuntimeError):
+    """
+    Simulated provider error of the fake provider.
+    """
+
+
+class FakeRateLimitError(FakeProviderError):
+    """
+    Simulated 429 of the fake provider, for a request beyond its simulated capacity.
+    """
+    status_code = 429
+
+
+class ReplayMissError(LookupError):
+    """
+    Raised by the replay provider for a request that was never recorded.
+    """
+
+
+def _message_text(messages: List[BaseMessage]) -> str:
+    """
+    Concatenated text of the messages, ignoring media blocks.
+    """
+    parts = []
+    for message in messages:
+        if isinstance(message.content, str):
+            parts.append(message.content)
+            continue
+        for block in message.content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif block.get('type') == 'text':
+                parts.append(block.get('text', ''))
+    return '\n'.join(parts)
+
+
+def _has_block(messages: List[BaseMessage], *block_types: str) -> bool:
+    return any(isinstance(block, dict) and block.get('type') in block_types
+               for message in messages if not isinstance(message.content, str) for block in message.content)
+
+
+def _fake_value(schema: dict, name: str = '') -> Any:
+    """
+    Schema-valid placeholder value of a JSON schema.
+    """
+    if 'default' in schema:
+        return schema['default']
+    schema_type = schema.get('type')
+    if schema_type == 'object':
+        return {key: _fake_value(value, key) for key, value in schema.get('properties', {}).items()}
+    if schema_type == 'array':
+        return []
+    if schema_type == 'boolean':
+        return False
+    if schema_type in ('integer', 'number'):
+        return 0
+    return f"fake {name}".strip()
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline chat model returning schema-valid canned responses, for benchmarks without a live provider.
+    The response is chosen from the shape of the request: audio transcripts for audio requests, frame
+    transcripts for image requests (a JSON array keyed by frame for batched frames), combined transcripts,
+    MCQs and study summaries for the matching prompts, tool calls for structured outputs and plain text
+    otherwise. Latency, error rate and capacity are simulated with the FAKE_* constants.
+    """
+    model_name: str = "fake"
+    latency_distribution: str = constants.FAKE_LATENCY_DISTRIBUTION
+    latency_ms: float = constants.FAKE_LATENCY_MS
+    latency_jitter_ms: float = constants.FAKE_LATENCY_JITTER_MS
+    error_rate: float = constants.FAKE_ERROR_RATE
+    max_concurrency: int = constants.FAKE_MAX_CONCURRENCY
+    seed: int = constants.FAKE_SEED
+    _random: random.Random = PrivateAttr()
+    _random_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _in_flight: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._random = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _sample_latency(self) -> float:
+        """
+        Simulated latency of a request in seconds.
+        """
+        with self._random_lock:
+            match self.latency_distribution:
+                case "uniform":
+                    latency = self._random.uniform(self.latency_ms - self.latency_jitter_ms,
+                                                   self.latency_ms + self.latency_jitter_ms)
+                case "normal":
+                    latency = self._random.gauss(self.latency_ms, self.latency_jitter_ms)
+                case "lognormal":
+                    # latency_ms is the median, latency_jitter_ms the spread
+                    sigma = self.latency_jitter_ms / self.latency_ms if self.latency_ms > 0 else 0.0
+                    latency = self.latency_ms * self._random.lognormvariate(0.0, sigma)
+                case _:
+                    latency = self.latency_ms
+            failed = self._random.random() < self.error_rate
+        if failed:
+            raise FakeProviderError("Simulated provider error")
+        return max(0.0, latency) / 1000.0
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        with self._random_lock:
+            if 0 < self.max_concurrency <= self._in_flight:
+                raise FakeRateLimitError(f"Simulated rate limit: {self._in_flight} requests in flight")
+            self._in_flight += 1
+        try:
+            time.sleep(self._sample_latency())
+        finally:
+            with self._random_lock:
+                self._in_flight -= 1
+        tools = kwargs.get('tools')
+        if tools:
+            function = tools[0]['function']
+            message = AIMessage(content="", tool_calls=[{
+                "name": function['name'],
+                "args": _fake_value(function.get('parameters', {})),
+                "id": f"call_{uuid.uuid4().hex}",
+            }])
+        else:
+            message = AIMessage(content=self._fake_content(messages))
+        message.usage_metadata = {
+            "input_tokens": estimate_message_tokens(messages),
+            "output_tokens": estimate_text_tokens(message.content if isinstance(message.content, str) else ""),
+        }
+        message.usage_metadata["total_tokens"] = (message.usage_metadata["input_tokens"]
+                                                  + message.usage_metadata["output_tokens"])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _fake_content(self, messages: List[BaseMessage]) -> str:
+        text = _message_text(messages)
+        if _has_block(messages, 'media', 'audio'):
+            if "cut off" in text:
+                return json.dumps({"transcript": []})
+            return json.dumps({"transcript": [{"speaker": "Speaker 1", "text": "Fake audio transcript."}]})
+        frame_names = [line[len("Frame: "):] for line in text.split('\n') if line.startswith("Frame: ")]
+        if frame_names:
+            return json.dumps([{"frame": name, "raw_text": "fake raw text", "explanation": "Fake frame explanation.",
+                                "transcript": "Fake frame transcript."} for name in frame_names])
+        if _has_block(messages, 'image_url', 'image'):
+            return json.dumps({"raw_text": "fake raw text", "explanation": "Fake frame explanation.",
+                               "transcript": "Fake frame transcript."})
+        if "combined_transcript" in text:
+            return json.dumps({"combined_transcript": "Fake combined transcript of the video."})
+        if '"questions"' in text:
+            return json.dumps({"topics": ["Fake topic"], "questions": [{
+                "question": "Fake question?",
+                "options": ["Option A", "Option B", "Option C", "Option D"],
+                "correct_option": "Option A",
+                "topics_covered": ["Fake topic"],
+            }]})
+        if '"study_plan"' in text:
+            return json.dumps({"topics": ["Fake topic"], "summary": "Fake summary.",
+                               "study_plan": [{"day": 1, "focus": "Fake topic", "activities": ["Fake activity"]}],
+                               "prerequisites": []})
+        return "Fake response."
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Offline chat model serving the responses recorded in an LLM cache file by real runs, keyed by the hash of
+    the request messages (see SQLiteLLMCache.lookup_request). Requests that were never recorded raise
+    ReplayMissError.
+    """
+    model_name: str = "replay"
+    cache_path: str = constants.REPLAY_CACHE_PATH
+    _recordings: SQLiteLLMCache = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        self._recordings = SQLiteLLMCache({"provider": "replay", "model_name": self.model_name},
+                                          path=self.cache_path)
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "cache_path": self.cache_path}
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        # Recorded responses already contain the tool calls of the recorded run
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        request_hash = get_request_hash(dumps(messages))
+        generations = self._recordings.lookup_request(request_hash)
+        if not generations:
+            raise ReplayMissError(f"No recorded response for request {request_hash} in {self.cache_path}")
+        logger.debug(f"Replaying recorded response of request {request_hash}")
+        return ChatResult(generations=list(generations))
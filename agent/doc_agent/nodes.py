@@ -13,6 +13,8 @@ from agent.config.assistant_config import AssistantConfiguration
 from agent.config.initialize_logger import logger
 from agent.doc_agent import prompts, constants
 from agent.doc_agent.state.agent_state import AgentState
+from agent.utils.misc_utils import with_partial_context_note
+from agent.utils.request_executor import invoke_llm
 
 
 def initialize_context(state: AgentState, *, config: RunnableConfig) -> Dict[str, str]:
@@ -96,11 +98,11 @@ def generate_product_document(state: AgentState, *, config: RunnableConfig) -> D
         #         SystemMessage(content=prompts.PRODUCT_DOCUMENT_PROMPTS.format(context=state.raw_transcript)),
         #     ] + state.messages
         messages = [
-            SystemMessage(content=prompts.PRODUCT_DOCUMENT_PROMPTS),
+            SystemMessage(content=with_partial_context_note(prompts.PRODUCT_DOCUMENT_PROMPTS, state)),
             HumanMessage(content=state.video_context)
         ] + state.messages
         logger.debug(f"Messages for product document: {messages}")
-        product_doc = chat_model.invoke(messages)
+        product_doc = invoke_llm(chat_model, messages, config=config)
         logger.debug(f"Generated product document: {product_doc.content}")
         return {
             "product_document": product_doc.content,
@@ -140,13 +142,13 @@ def generate_executive_summary(state: AgentState, *, config: RunnableConfig) ->
         #     ] + state.messages
         # if len(state.messages) == 1:
         messages = [
-            SystemMessage(content=prompts.EXECUTIVE_SUMMARY_PROMPT),
+            SystemMessage(content=with_partial_context_note(prompts.EXECUTIVE_SUMMARY_PROMPT, state)),
             HumanMessage(content=state.video_context)
         ] + state.messages
         # else:
         #     messages = state.messages
         logger.debug(f"Messages for executive summary: {messages}")
-        exec_summary = chat_model.invoke(messages)
+        exec_summary = invoke_llm(chat_model, messages, config=config)
         logger.debug(f"Generated executive summary: {exec_summary}")
         return {
             "exec_summary": exec_summary.content,
@@ -222,11 +224,11 @@ def chat(state: AgentState, *, config: RunnableConfig) -> Dict[str, Union[str, L
             """ + state.product_document
         else:
             context = state.video_context
-        messages = [SystemMessage(content=prompts.CHAT_SYSTEM_PROMPT.format(context=context)),
+        messages = [SystemMessage(content=with_partial_context_note(prompts.CHAT_SYSTEM_PROMPT.format(context=context), state)),
                      HumanMessage(content=context)
                            ] + state.messages
         logger.debug(f"Messages for chat: {messages}")
-        response = chat_model.invoke(messages)
+        response = invoke_llm(chat_model, messages, config=config)
         logger.debug(f"Chat response: {response.content if hasattr(response, 'content') else response}")
         return {
             "messages": response.content if hasattr(response, 'content') else response,
@@ -266,7 +268,7 @@ def evaluate(state: AgentState, *, config: RunnableConfig) -> Dict[str, str]:
         messages = [
             SystemMessage(content=prompts.EVALUATOR_PROMPT.format(context=evaluation_data))
         ] + state.messages
-        response = chat_model_with_structure.invoke(messages)
+        response = invoke_llm(chat_model_with_structure, messages, config=config)
         evaluation_result = "Evaluation completed successfully."
         logger.debug(f"Evaluation result: {evaluation_result}")
         return {
@@ -8,7 +8,8 @@ from agent.config.assistant_config import AssistantConfiguration
 from agent.config.initialize_logger import logger
 from agent.state.agent_state import AgentState
 from agent import constants, prompts
-from agent.utils.misc_utils import _remove_agent_choice
+from agent.utils.misc_utils import _remove_agent_choice, with_partial_context_note
+from agent.utils.request_executor import invoke_llm
 
 from agent.constants import AgentType
 
@@ -98,7 +99,7 @@ def format_response(state: AgentState, *, config: RunnableConfig) -> Dict[str, A
             HumanMessage(content=state.answer)
         ]
         logger.info("Formatting response with chat model")
-        response = chat_model_with_structure.invoke(messages)
+        response = invoke_llm(chat_model_with_structure, messages, config=config)
         logger.info("Formatted response with chat model")
         logger.info("Chat content: %s", response.chat_content)
         logger.info("Doc content: %s", response.doc_content)
@@ -125,10 +126,10 @@ def chat(state: AgentState, *, config: RunnableConfig) -> Dict[str, str]:
         configuration = AssistantConfiguration.from_runnable_config(config)
         chat_model = configuration.get_model(configuration.default_llm_model)
         messages = [
-            SystemMessage(content=prompts.CHAT_PROMPT.format(context=state.video_context)),
+            SystemMessage(content=with_partial_context_note(prompts.CHAT_PROMPT.format(context=state.video_context), state)),
         ] + state.messages
         logger.info("Invoking chat model")
-        response = chat_model.invoke(messages)
+        response = invoke_llm(chat_model, messages, config=config)
         return {'answer': response.content}
     except Exception as e:
         logger.exception(f"Exception in chat: {e}")
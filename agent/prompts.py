@@ -108,3 +108,9 @@ CHAT_PROMPT = """
     
 """
 
+PARTIAL_CONTEXT_NOTE = """
+
+Note: The video is still being processed. The provided video context only covers the beginning of the video,
+later parts are not available yet. Base your answer only on the available context and, when relevant, mention
+that the answer may be incomplete because the rest of the video is still being processed.
+"""
@@ -9,6 +9,8 @@ from agent.student_agent.constants import MCQResponseModel, SummaryResponseModel
 from agent.student_agent.states.agent_state import AgentState
 from agent.student_agent import prompts, constants
 from agent.config.initialize_logger import logger
+from agent.utils.misc_utils import with_partial_context_note
+from agent.utils.request_executor import invoke_llm
 
 from dotenv import load_dotenv
 
@@ -90,12 +92,12 @@ def generate_mcq(state: AgentState, *, config: RunnableConfig) -> dict[str, str]
     cleaned_transcript = state.video_context.replace("\n", "").replace(" ", "")
     cleaned_transcript = " ".join(cleaned_transcript.split())
     messages = [
-        SystemMessage(content=prompts.MCQ_GENERATOR_PROMPTS.replace("{context}", cleaned_transcript)),
+        SystemMessage(content=with_partial_context_note(prompts.MCQ_GENERATOR_PROMPTS.replace("{context}", cleaned_transcript), state)),
         HumanMessage(
             content=f"Generate multiple-choice questions based on the provided transcript and on the following custom message {additional_messages}")
     ]
 
-    mcq_doc = chat_model.invoke(messages)
+    mcq_doc = invoke_llm(chat_model, messages, config=config)
 
     return {
         "mcq": mcq_doc.content,
@@ -120,10 +122,10 @@ def generate_summary(state: AgentState, *, config: RunnableConfig) -> dict[str,
     cleaned_transcript = " ".join(cleaned_transcript.split())
     additional_messages = state.messages if state.messages[-1] else ''
     messages = [
-        SystemMessage(content=prompts.STUDENT_SUMMARY_PLAN.replace("{context}", cleaned_transcript)),
+        SystemMessage(content=with_partial_context_note(prompts.STUDENT_SUMMARY_PLAN.replace("{context}", cleaned_transcript), state)),
         HumanMessage(content="Generate a student summary and plan on the provided transcript")
     ]
-    summary_plan = chat_model.invoke(messages)
+    summary_plan = invoke_llm(chat_model, messages, config=config)
 
     return {
         "summary": summary_plan.content,
@@ -188,11 +190,11 @@ def chat(state: AgentState, *, config: RunnableConfig) -> dict[str, BaseMessage
     #                        content=prompts.CHAT_SYSTEM_PROMPT.replace("{context}", cleaned_transcript)
     #                    )
     #                ] + state.messages
-    messages = [SystemMessage(content=prompts.CHAT_SYSTEM_PROMPT),
+    messages = [SystemMessage(content=with_partial_context_note(prompts.CHAT_SYSTEM_PROMPT, state)),
                 HumanMessage(content=context)
                 ] + state.messages
 
-    response = chat_model.invoke(messages)
+    response = invoke_llm(chat_model, messages, config=config)
 
     return {
         "messages": response.content,
@@ -217,7 +219,7 @@ def evaluate(state: AgentState, *, config: RunnableConfig) -> Dict[str, str | in
             raise ValueError(f"Unsupported intent for evaluation: {state.intent}")
 
         messages = [SystemMessage(content=prompts.EVALUATOR_PROMPT.replace("{context}", data))] + state.messages
-        response = chat_model.invoke(messages)
+        response = invoke_llm(chat_model, messages, config=config)
 
         return {
             "is_modification_required": response.is_modification_required,
@@ -2,19 +2,27 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
-import hashlib
-
 import streamlit as st
 import os
 import asyncio
 import json
+import time
 from agent.vid2_insight_graph import app
 from streamlit.runtime.scriptrunner import get_script_run_ctx
-from ingestion.combined_text_transcriptor import create_ingestion_data
+from ingestion import constants as ingestion_constants
+from ingestion.job_manager import JobStatus, get_job_manager
+from ingestion.predictor import estimate_ingestion, format_estimate
+from ingestion.transcript_store import load_transcript_document
+from ingestion.video_utils import compute_video_id, get_output_id, persist_upload, promote_upload
 from agent.student_agent.constants import Intent as StudIntent
 from agent.doc_agent.constants import Intent as DocIntent
 from agent.constants import AgentType
+from agent.config import constants as agent_constants
+from agent.config.assistant_config import AssistantConfiguration
+from agent.utils.request_executor import with_deadline
 
+# Uploads are persisted in this folder under their video id
+INPUT_PATH = '../docs/input'
 
 
 class Facilitator:
@@ -22,52 +30,90 @@ class Facilitator:
     @staticmethod
     def compute_video_id(video_hash: str, length: int) -> str:
         """
-        Compute a unique fingerprint for a video by hashing together:
-          1. The video's content hash (SHA-256 hex digest)
-          2. The video's length in bytes
+        Compute a unique fingerprint for a video (see ingestion.video_utils.compute_video_id).
+        """
+        return compute_video_id(video_hash, length)
+
+    @staticmethod
+    def stage_upload(video_input) -> tuple[str, str]:
+        """
+        Hash and persist the selected upload, once per selection, in the pending folder of the session: the estimate
+        probes it there, Submit moves it to the input folder (see submit_upload) and any other selection deletes it.
+        :return: the video id and the path of the video
+        """
+        staged = st.session_state.get("staged_upload")
+        if staged is not None and staged["file_id"] == video_input.file_id:
+            return staged["video_id"], staged["video_path"]
+        Facilitator.discard_staged_upload()
+        pending_path = os.path.join(INPUT_PATH, 'pending', st.session_state.session_id)
+        # Hashed and written in a single streaming pass
+        video_input.seek(0)
+        video_id, video_path = persist_upload(video_input, pending_path)
+        st.session_state.staged_upload = {"file_id": video_input.file_id, "video_id": video_id,
+                                          "video_path": video_path, "pending": True}
+        return video_id, video_path
 
-        Args:
-            video_hash (str): SHA-256 hex digest of the video content.
-            length (int): Length of the video file in bytes.
+    @staticmethod
+    def submit_upload(video_input) -> tuple[str, str]:
+        """
+        Move the staged upload to the input folder, without reading it again.
+        :return: the video id and the path of the video in the input folder
+        """
+        video_id, video_path = Facilitator.stage_upload(video_input)
+        staged = st.session_state.staged_upload
+        if staged["pending"]:
+            video_path = promote_upload(video_path, INPUT_PATH)
+            staged.update(video_path=video_path, pending=False)
+        return video_id, video_path
 
-        Returns:
-            str: SHA-256 hex digest of the concatenated input.
+    @staticmethod
+    def discard_staged_upload() -> None:
+        """
+        Delete the pending upload of the session, a selection that was never submitted.
         """
-        # Combine the two pieces of data in a canonical way
-        payload = f"{video_hash}:{length}"
-        # Compute and return the SHA-256 of that payload
-        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        staged = st.session_state.pop("staged_upload", None)
+        if staged is not None and staged["pending"] and os.path.isfile(staged["video_path"]):
+            os.remove(staged["video_path"])
+
+    @staticmethod
+    def estimate_video(video_input, consider_audio, consider_video, interval) -> str:
+        """
+        Predicted ingestion time and cost of an upload, shown before it is submitted.
+        """
+        _, video_path = Facilitator.stage_upload(video_input)
+        return format_estimate(estimate_ingestion(video_path, interval, consider_audio, consider_video))
 
     @staticmethod
     def process_video(video_input, consider_audio, consider_video, interval):
-        uuid = Facilitator.compute_video_id(
-            hashlib.sha256(video_input.read()).hexdigest(),
-            video_input.size
-        )
-        video_input.seek(0)
-        input_path = '../docs/input'
-        output_path = os.path.join('../docs/', uuid)
+        """
+        Load the transcript of an already ingested video, or submit its ingestion as a background job.
+        :return: True if the transcript is loaded, the job id of the ingestion otherwise
+        """
         if video_input is not None:
-            if os.path.exists(os.path.join(output_path, 'transcript.json')):
+            # The upload staged for the estimate is moved, not hashed and written again
+            uuid, video_path = Facilitator.submit_upload(video_input)
+            output_path = os.path.join('../docs/', get_output_id(uuid, consider_audio, consider_video))
+            # Only the combined transcript is loaded, not the segments
+            document = load_transcript_document(output_path)
+            # A partial transcript means an interrupted ingestion, which resumes in the job
+            if document is not None and not document['metadata'].get('partial', False):
                 st.info('Video already processed. Loading existing data...')
-                transcript = json.load(open(os.path.join(output_path, 'transcript.json')))
-                st.session_state.context = transcript
+                st.session_state.context = document
                 return True
-            os.makedirs(input_path, exist_ok=True)
-            os.makedirs(output_path, exist_ok=True)
-            with open(os.path.join(input_path,f'{uuid}.mp4'), 'wb') as f:
-                f.write(video_input.read())
-            pload, output_dir = create_ingestion_data(os.path.join(input_path,f'{uuid}.mp4'), output_path, interval)
-            st.session_state.context = json.loads(pload)
+            # A video already being ingested by another session is not submitted twice
+            return get_job_manager().submit(video_path, output_path, interval, consider_audio=consider_audio,
+                                            consider_video=consider_video, watcher=st.session_state.session_id)
         return True
 
     @staticmethod
     def generate_mcqs(session_id:str = '1'):
-        config = {"configurable": {"thread_id": session_id, 'agent_choice': AgentType.student_agent.value}}
+        config = with_deadline({"configurable": {"thread_id": session_id, 'agent_choice': AgentType.student_agent.value}},
+                               agent_constants.GRAPH_DEADLINE_SECONDS)
         payload = {
             "messages": [{"role": "human", "content": 'generate a set of mcq questions covering all key concepts for the video content.'}],
             'expert_preference': AgentType.student_agent.value,
             'video_context': st.session_state.context['combined_transcript'][0]['combined_transcript'],
+            'partial_context': st.session_state.context.get('metadata', {}).get('partial', False),
             'intent': StudIntent.GENERATE_MCQ.value,
         }
         raw = asyncio.run(app.ainvoke(payload, config))
@@ -76,11 +122,13 @@ class Facilitator:
     @staticmethod
     def generate_study_summary(session_id:str = '1') -> tuple[str, str]:
         # invoke student_agent graph for Summary
-        config = {"configurable": {"thread_id": session_id, 'agent_choice': AgentType.student_agent.value}}
+        config = with_deadline({"configurable": {"thread_id": session_id, 'agent_choice': AgentType.student_agent.value}},
+                               agent_constants.GRAPH_DEADLINE_SECONDS)
         payload = {
             "messages": [{"role": "human", "content": 'generate a comprehensive study summary for the video content.'}],
             'expert_preference': AgentType.student_agent.value,
             'video_context': st.session_state.context['combined_transcript'][0]['combined_transcript'],
+            'partial_context': st.session_state.context.get('metadata', {}).get('partial', False),
             'intent': StudIntent.GENERATE_SUMMARY.value
         }
         raw = asyncio.run(app.ainvoke(payload, config))
@@ -94,12 +142,14 @@ class Facilitator:
         if chat_input.strip() == '':
             st.warning("Please enter a message to send.")
             return '', ''
-        config = {"configurable": {"thread_id": session_id, 'agent_choice': AgentType.student_agent.value}}
+        config = with_deadline({"configurable": {"thread_id": session_id, 'agent_choice': AgentType.student_agent.value}},
+                               agent_constants.GRAPH_DEADLINE_SECONDS)
         messages = f"Answer my query: {chat_input}" + (f"And some additional context if necessary: {json.dumps(results)}" if results else '')
         payload = {
             "messages": [{"role": "human", "content": messages}],
             'expert_preference': AgentType.student_agent.value,
             'video_context': st.session_state.context['combined_transcript'][0]['combined_transcript'],
+            'partial_context': st.session_state.context.get('metadata', {}).get('partial', False),
             'intent': StudIntent.DOC_CHAT.value,
         }
         raw = asyncio.run(app.ainvoke(payload, config))
@@ -112,11 +162,13 @@ class Facilitator:
         """
         intent = DocIntent.GENERATE_DOCS.value if doc_choice == "Product Doc" else DocIntent.GENERATE_EXEC_SUMMARY.value
 
-        config = {"configurable": {"thread_id": session_id, 'agent_choice': AgentType.doc_agent.value}}
+        config = with_deadline({"configurable": {"thread_id": session_id, 'agent_choice': AgentType.doc_agent.value}},
+                               agent_constants.GRAPH_DEADLINE_SECONDS)
         payload = {
             "messages": [{"role": "human", "content": f'generate a {doc_choice} for the video content.'}],
             'expert_preference': AgentType.doc_agent.value,
             'video_context': st.session_state.context['combined_transcript'][0]['combined_transcript'],
+            'partial_context': st.session_state.context.get('metadata', {}).get('partial', False),
             'intent': intent
         }
         raw = asyncio.run(app.ainvoke(payload, config))
@@ -129,13 +181,15 @@ class Facilitator:
         """
         if not chat_input:
             return '', ''
-        config = {"configurable": {"thread_id": session_id, 'agent_choice': AgentType.doc_agent.value}}
+        config = with_deadline({"configurable": {"thread_id": session_id, 'agent_choice': AgentType.doc_agent.value}},
+                               agent_constants.GRAPH_DEADLINE_SECONDS)
         messages = f"Answer my query: {chat_input}" + (
             f"with reference to my current version of document: {results}" if results else '')
         payload = {
             "messages": [{"role": "human", "content": messages}],
             'expert_preference': AgentType.doc_agent.value,
             'video_context': st.session_state.context['combined_transcript'][0]['combined_transcript'],
+            'partial_context': st.session_state.context.get('metadata', {}).get('partial', False),
             'intent': DocIntent.DOC_CHAT.value,
         }
         raw = asyncio.run(app.ainvoke(payload, config))
@@ -147,11 +201,13 @@ class Facilitator:
         """
         if not chat_input:
             return ''
-        config = {"configurable": {"thread_id": session_id, 'agent_choice': AgentType.chat.value}}
+        config = with_deadline({"configurable": {"thread_id": session_id, 'agent_choice': AgentType.chat.value}},
+                               agent_constants.GRAPH_DEADLINE_SECONDS)
         payload = {
             "messages": [{"role": "human", "content": chat_input}],
             'expert_preference': AgentType.chat.value,
             'video_context': st.session_state.context['combined_transcript'][0]['combined_transcript'],
+            'partial_context': st.session_state.context.get('metadata', {}).get('partial', False),
             'intent': DocIntent.DOC_CHAT.value,
         }
         raw = asyncio.run(app.ainvoke(payload, config))
@@ -184,25 +240,103 @@ class MultiScreenApp:
 
         st.checkbox("Consider Audio", value=True, key="consider_audio")
         st.checkbox("Consider Video", value=True, key="consider_video")
-        st.slider("Process every X seconds", 1, 60, 15, key="interval")
-
-        if st.button("Submit"):
+        st.checkbox("Auto segment duration", value=False, key="auto_interval",
+                    help="Longest segments within the model limits, aligned on scene cuts and silences")
+        st.slider("Process every X seconds", 1, 60, 15, key="interval",
+                  disabled=st.session_state.get("auto_interval", False))
+        interval = ingestion_constants.SEGMENT_DURATION_AUTO if st.session_state.get("auto_interval") \
+            else st.session_state.get("interval")
+        no_modality = not st.session_state.get("consider_audio") and not st.session_state.get("consider_video")
+        if st.session_state.get("video_file") is None:
+            Facilitator.discard_staged_upload()
+        if no_modality:
+            st.warning("Select at least one of audio and video.")
+        elif st.session_state.get("video_file") is not None:
+            try:
+                st.caption("Estimated processing: " + Facilitator.estimate_video(
+                    st.session_state.get("video_file"), st.session_state.get("consider_audio"),
+                    st.session_state.get("consider_video"), interval))
+            except Exception as e:
+                st.caption(f"Processing time could not be estimated: {e}")
+
+        if st.button("Submit", disabled=no_modality):
             result = ()
-            with st.spinner("Processing video… Please do not refresh the page."):
-                st.info('This process can take upto 20min depending on the video length and your system performance.')
+            with st.spinner("Processing video…"):
                 result = st.session_state.video_name = Facilitator.process_video(
                     st.session_state.get("video_file"),
                     st.session_state.get("consider_audio"),
                     st.session_state.get("consider_video"),
-                    st.session_state.get("interval")
+                    interval
                 )
-            if result:
+            if result is True:
                 st.session_state.screen = 2
                 st.rerun()
+            elif result:
+                # Kept in the URL, so that a refreshed page keeps following the job
+                st.query_params["job_id"] = result
+                st.rerun()
             else:
                 st.session_state = 1
                 st.rerun()
 
+        job_id = st.query_params.get("job_id")
+        if job_id:
+            self.show_job_progress(job_id)
+
+    def show_job_progress(self, job_id: str):
+        job_manager = get_job_manager()
+        job = job_manager.get_job(job_id)
+        if job is None:
+            del st.query_params["job_id"]
+            return
+        # A job no session polls anymore (closed tab) is cancelled
+        if job.is_active:
+            job_manager.watch(job_id, st.session_state.session_id)
+        progress = job_manager.get_progress(job_id)
+        if progress.status == JobStatus.DONE.value:
+            st.session_state.context = load_transcript_document(job.output_dir)
+            del st.query_params["job_id"]
+            st.session_state.screen = 2
+            st.rerun()
+        if progress.status == JobStatus.FAILED.value:
+            st.error(f"Processing failed: {progress.error}")
+            del st.query_params["job_id"]
+            return
+        if progress.status == JobStatus.CANCELLED.value:
+            st.warning("Processing cancelled, submit the video again to resume it.")
+            del st.query_params["job_id"]
+            return
+
+        predicted = '' if progress.predicted_seconds is None else \
+            f' (predicted ~{max(1, round(progress.predicted_seconds / 60))} min)'
+        st.info(f'Processing the video in the background{predicted}. You can refresh the page or come back later.')
+        if progress.segments_total:
+            st.progress(min(1.0, progress.segments_transcribed / progress.segments_total),
+                        text=f"{progress.segments_transcribed}/{progress.segments_total} segments transcribed")
+        else:
+            st.progress(0.0, text=f"{progress.status.capitalize()}...")
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Stage", progress.stage.replace('_', ' ') or progress.status)
+        col2.metric("Frames extracted / transcribed", f"{progress.frames_extracted} / {progress.frames_transcribed}")
+        col3.metric("Tokens used", f"{progress.tokens_used:,}")
+        col4.metric("ETA", "-" if progress.eta_seconds is None else f"{int(progress.eta_seconds // 60)}m "
+                                                                     f"{int(progress.eta_seconds % 60)}s")
+        if progress.partial_available and st.button("Start with partial transcript"):
+            st.session_state.context = load_transcript_document(job.output_dir)
+            # The job keeps running for this session, until Reset
+            job_manager.watch(job_id, st.session_state.session_id, polling=False)
+            st.session_state.job_id = job_id
+            del st.query_params["job_id"]
+            st.session_state.screen = 2
+            st.rerun()
+        if st.button("Cancel"):
+            # Only cancelled if no other session follows the same video
+            job_manager.unwatch(job_id, st.session_state.session_id)
+            del st.query_params["job_id"]
+            st.rerun()
+        time.sleep(ingestion_constants.JOB_POLL_SECONDS)
+        st.rerun()
+
     def show_screen_2(self):
         st.title(f"Choose your preferred Agent for")
         st.write(f'{st.session_state.get('video_name', '')}')
@@ -222,6 +356,9 @@ class MultiScreenApp:
 
         with col2:
             if st.button("Reset"):
+                if st.session_state.get("job_id"):
+                    # Stops the ingestion still running for the partial transcript
+                    get_job_manager().unwatch(st.session_state.job_id, st.session_state.session_id)
                 st.session_state.clear()
                 st.session_state.screen = 1
                 st.rerun()
@@ -458,6 +595,8 @@ class MultiScreenApp:
 if __name__ == "__main__":
     if "screen" not in st.session_state:
         st.session_state.screen = 1
+    # Only the first run of the process creates the models, later reruns reuse them
+    AssistantConfiguration.warmup_models([AssistantConfiguration().default_llm_model])
     ui_app = MultiScreenApp()
     ui_app.run()
 
@@ -0,0 +1,162 @@
+import contextvars
+import subprocess
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+
+from agent.config.initialize_logger import logger
+
+
+class OperationCancelledError(Exception):
+    """
+    Raised in a cancelled operation at its next cancellation point.
+    """
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation of a long running operation (e.g. an ingestion), safe to share between threads.
+    The operation checks the token at its cancellation points (before every frame, every LLM request...) and
+    registers callbacks aborting its blocking calls (e.g. killing an ffmpeg subprocess) while they run.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason = ""
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """
+        Cancel the operation, calling the registered abort callbacks.
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks)
+        logger.info(f"Cancellation requested: {reason}")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancellation callback failed: {e}")
+
+    def raise_if_cancelled(self) -> None:
+        """
+        :raises OperationCancelledError: if the token is cancelled
+        """
+        if self._event.is_set():
+            raise OperationCancelledError(self.reason)
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]) -> Iterator[None]:
+        """
+        Call callback if the token is cancelled while in the context, immediately if it already is.
+        """
+        with self._lock:
+            cancelled = self._event.is_set()
+            if not cancelled:
+                self._callbacks.append(callback)
+        if cancelled:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+
+_current_token: contextvars.ContextVar[Optional[CancellationToken]] = contextvars.ContextVar(
+    'cancellation_token', default=None)
+
+
+@contextmanager
+def cancellation_scope(token: CancellationToken) -> Iterator[CancellationToken]:
+    """
+    Make token the cancellation token of the current context; threads started with contextvars.copy_context
+    inside the scope see it too.
+    """
+    reset_token = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset_token)
+
+
+def get_cancellation_token() -> Optional[CancellationToken]:
+    return _current_token.get()
+
+
+def check_cancelled() -> None:
+    """
+    Cancellation point: raises OperationCancelledError if the token of the current context is cancelled.
+    """
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+class CancellationCallbackHandler(BaseCallbackHandler):
+    """
+    Rejects every chat model request started after the token of the current context is cancelled, whichever
+    code path makes it.
+    """
+    raise_error = True
+    run_inline = True
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID,
+                            **kwargs: Any) -> None:
+        check_cancelled()
+
+
+@contextmanager
+def open_subprocess(cmd: List[str], **kwargs: Any) -> Iterator[subprocess.Popen]:
+    """
+    subprocess.Popen(cmd, **kwargs) for reading its output as it is produced. The process is killed as soon as the
+    token of the current context is cancelled, or if it is still running when the context exits.
+    :raises OperationCancelledError: if the token is cancelled before the context exits
+    """
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+    process = subprocess.Popen(cmd, **kwargs)
+    try:
+        with token.on_cancel(process.kill) if token is not None else nullcontext():
+            yield process
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if token is not None and token.is_cancelled:
+        logger.info(f"Killed {cmd[0]} on cancellation")
+        token.raise_if_cancelled()
+
+
+def run_subprocess(cmd: List[str], text: bool = False) -> subprocess.CompletedProcess:
+    """
+    subprocess.run(cmd, capture_output=True), the process is killed as soon as the token of the current context
+    is cancelled.
+    :raises OperationCancelledError: if the token is cancelled before the process exits
+    """
+    token = _current_token.get()
+    if token is None:
+        return subprocess.run(cmd, capture_output=True, text=text)
+    token.raise_if_cancelled()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text)
+    with token.on_cancel(process.kill):
+        stdout, stderr = process.communicate()
+    if token.is_cancelled:
+        logger.info(f"Killed {cmd[0]} on cancellation")
+        token.raise_if_cancelled()
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
@@ -1,5 +1,6 @@
 from typing import Union
 
+from agent import prompts
 from agent.config.initialize_logger import logger
 from agent.state.agent_state import AgentState as MainAgentState
 from agent.student_agent.states.agent_state import AgentState as StudentAgentState
@@ -7,6 +8,15 @@ from agent.doc_agent.state.agent_state import AgentState as DocAgentState
 from dataclasses import asdict
 
 
+def with_partial_context_note(system_prompt: str, state) -> str:
+    """
+    Appends a note to the system prompt telling the model that the video context is partial, when it is.
+    """
+    if getattr(state, 'partial_context', False):
+        return system_prompt + prompts.PARTIAL_CONTEXT_NOTE
+    return system_prompt
+
+
 def _remove_agent_choice(state: Union[MainAgentState, StudentAgentState, DocAgentState, dict]) -> Union[StudentAgentState, DocAgentState]:
     """
     Returns a copy of the state with agent_choice removed.
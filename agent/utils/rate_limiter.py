@@ -0,0 +1,330 @@
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from agent.config import constants
+from agent.config.initialize_logger import logger
+from agent.utils.cancellation import check_cancelled
+from agent.utils.token_utils import get_request_stage
+
+# A provider rejecting a request because it is over its rate limit or overloaded: HTTP status codes, exception
+# class names and message markers of the provider SDKs
+OVERLOAD_STATUS_CODES = (429, 503, 529)
+OVERLOAD_ERROR_NAMES = ('RateLimitError', 'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable',
+                        'OverloadedError')
+OVERLOAD_ERROR_MARKERS = ('resource_exhausted', 'rate limit', 'error code: 429', 'overloaded')
+# Other provider errors worth retrying: server errors, connection errors and timeouts of the SDKs
+TRANSIENT_STATUS_CODES = (500, 502, 504)
+TRANSIENT_ERROR_NAMES = ('APIConnectionError', 'APITimeoutError', 'InternalServerError', 'ServerError',
+                         'DeadlineExceeded', 'ConnectError', 'ConnectTimeout', 'ReadTimeout', 'RemoteProtocolError')
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """
+    Whether error is a provider rejecting the request as over its rate limit or overloaded (429/503).
+    """
+    for candidate in (error, getattr(error, 'response', None)):
+        for attribute in ('status_code', 'code'):
+            status = getattr(candidate, attribute, None)
+            if isinstance(status, int) and status in OVERLOAD_STATUS_CODES:
+                return True
+    if type(error).__name__ in OVERLOAD_ERROR_NAMES:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in OVERLOAD_ERROR_MARKERS)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Whether a request failed with error may succeed if sent again: an overload (see is_overload_error), a server
+    error or a connection error.
+    """
+    if is_overload_error(error):
+        return True
+    for candidate in (error, getattr(error, 'response', None)):
+        for attribute in ('status_code', 'code'):
+            status = getattr(candidate, attribute, None)
+            if isinstance(status, int) and status in TRANSIENT_STATUS_CODES:
+                return True
+    return type(error).__name__ in TRANSIENT_ERROR_NAMES
+
+
+class RequestDeadlineExceededError(TimeoutError):
+    """
+    Raised when an LLM request is still running (or waiting for a slot) at its deadline, the request is abandoned.
+    """
+
+
+@dataclass
+class RequestBudget:
+    """
+    Time left to the request made in the current context (see request_executor.invoke_llm).
+
+    Attributes:
+        deadline: time.monotonic() after which the request is abandoned, None for none.
+        abandoned: set once the caller stopped waiting for the request (deadline, cancellation, lost hedge).
+    """
+    deadline: Optional[float] = None
+    abandoned: threading.Event = field(default_factory=threading.Event)
+
+    def check(self) -> None:
+        """
+        :raises RequestDeadlineExceededError: if the request is abandoned or its deadline passed
+        """
+        if self.abandoned.is_set():
+            raise RequestDeadlineExceededError("Request abandoned by its caller before it started")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise RequestDeadlineExceededError("Deadline of the request passed before it started")
+
+
+_request_budget: contextvars.ContextVar[Optional[RequestBudget]] = contextvars.ContextVar(
+    'request_budget', default=None)
+
+
+@contextmanager
+def request_budget(budget: RequestBudget) -> Iterator[RequestBudget]:
+    """
+    Make budget the budget of the requests made in the current context, which give up waiting for a slot of the
+    rate limiter once it is exhausted.
+    """
+    reset_budget = _request_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _request_budget.reset(reset_budget)
+
+
+@dataclass
+class RequestSlot:
+    """
+    A request in flight, acquired from a RateLimiter.
+    """
+    started: float
+    # The request filled the limit when it started
+    saturated: bool
+
+
+class RateLimiter:
+    """
+    Adaptive (AIMD) limit of the requests in flight to a provider/model, and optional static cap on the rate at which
+    new requests are started. It is safe to share between threads.
+    The limit grows by one per success until the first cut (slow start), then by one per limit's worth of successes,
+    as long as the requests fill it. It is multiplied by AIMD_DECREASE_FACTOR on an overload response (429/503) or on
+    a request slower than AIMD_LATENCY_SPIKE_FACTOR times the usual latency of its stage, at most once per window:
+    the requests started before a cut do not cut it again.
+    """
+
+    def __init__(self, max_concurrency: int = constants.MAX_CONCURRENT_REQUESTS,
+                 requests_per_minute: int = constants.REQUESTS_PER_MINUTE,
+                 adaptive: bool = constants.ADAPTIVE_CONCURRENCY):
+        """
+        Initializes the RateLimiter.
+        :param max_concurrency: Maximum number of requests in flight at the same time, ceiling of the adaptive limit.
+        :param requests_per_minute: Maximum number of requests started per minute, 0 disables the rate limit.
+        :param adaptive: False for a static limit of max_concurrency requests in flight.
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self.adaptive = adaptive
+        self._limit = float(min(self.max_concurrency, max(1, constants.AIMD_INITIAL_CONCURRENCY))
+                            if adaptive else self.max_concurrency)
+        self._slow_start_threshold = float(self.max_concurrency)
+        self._in_flight = 0
+        self._waiting = 0
+        self._last_decrease = 0.0
+        # Usual latency of the requests of each stage: moving average and number of samples
+        self._latencies: Dict[str, tuple[float, int]] = {}
+        self._condition = threading.Condition()
+        self._next_start = 0.0
+
+    @property
+    def limit(self) -> int:
+        """
+        Current number of requests allowed in flight.
+        """
+        return max(1, min(self.max_concurrency, int(self._limit)))
+
+    def acquire(self, budget: Optional[RequestBudget] = None) -> RequestSlot:
+        """
+        Blocks until a request slot is free and the rate limit allows a new request to start.
+        :param budget: budget of the request, the wait is given up once it is exhausted
+        :raises OperationCancelledError: if the token of the current context is cancelled while waiting
+        :raises RequestDeadlineExceededError: if the budget is exhausted before the request can start
+        :return: the slot of the request, to be given back to release
+        """
+        with self._condition:
+            while True:
+                check_cancelled()
+                if budget is not None:
+                    budget.check()
+                if self._in_flight < self.limit:
+                    break
+                timeout = 1.0
+                if budget is not None and budget.deadline is not None:
+                    timeout = min(timeout, budget.deadline - time.monotonic())
+                self._waiting += 1
+                try:
+                    self._condition.wait(timeout=timeout)
+                finally:
+                    self._waiting -= 1
+            now = time.monotonic()
+            start_at = max(now, self._next_start)
+            if budget is not None and budget.deadline is not None and start_at >= budget.deadline:
+                raise RequestDeadlineExceededError("Deadline of the request passes before the rate limit lets "
+                                                   "it start")
+            self._in_flight += 1
+            saturated = self._in_flight >= self.limit
+            self._next_start = start_at + self.min_interval
+        if start_at > now:
+            time.sleep(start_at - now)
+        return RequestSlot(started=start_at, saturated=saturated)
+
+    def release(self, slot: RequestSlot, stage: str = 'other', error: Optional[BaseException] = None) -> None:
+        """
+        Releases the request slot acquired by acquire, and adapts the limit to the outcome of the request.
+        :param slot: slot returned by acquire
+        :param stage: stage of the request, latency spikes are relative to the usual latency of the stage
+        :param error: exception of a failed request
+        """
+        latency = time.monotonic() - slot.started
+        with self._condition:
+            # Only the requests of a full limit grow it: the limit was filled when the request started or ends
+            filled = slot.saturated or self._in_flight >= self.limit or self._waiting > 0
+            self._in_flight -= 1
+            if self.adaptive:
+                self._adapt(slot, stage, latency, error, filled)
+            self._condition.notify_all()
+
+    def _adapt(self, slot: RequestSlot, stage: str, latency: float, error: Optional[BaseException],
+               filled: bool) -> None:
+        """
+        AIMD update of the limit, the condition lock is held.
+        """
+        overloaded = error is not None and is_overload_error(error)
+        if error is not None and not overloaded:
+            # Other errors (bad request, parsing...) say nothing about the load of the provider
+            return
+        spike = False
+        if not overloaded:
+            usual, samples = self._latencies.get(stage, (latency, 0))
+            spike = (samples >= constants.AIMD_LATENCY_MIN_SAMPLES
+                     and latency > constants.AIMD_LATENCY_SPIKE_FACTOR * usual)
+            weight = constants.AIMD_LATENCY_EWMA_WEIGHT if samples else 1.0
+            self._latencies[stage] = (usual + weight * (latency - usual), samples + 1)
+
+        if overloaded or spike:
+            if slot.started < self._last_decrease:
+                return
+            previous = self.limit
+            self._limit = max(1.0, min(self._limit, float(self.max_concurrency)) * constants.AIMD_DECREASE_FACTOR)
+            self._slow_start_threshold = self._limit
+            self._last_decrease = time.monotonic()
+            cause = "overload response" if overloaded else f"{stage} latency spike ({latency:.1f}s)"
+            logger.info(f"Concurrency limit cut from {previous} to {self.limit} on {cause}")
+        elif filled and self._limit < self.max_concurrency:
+            previous = self.limit
+            self._limit += 1.0 if self._limit < self._slow_start_threshold else 1.0 / self._limit
+            self._limit = min(self._limit, float(self.max_concurrency))
+            if self.limit != previous:
+                logger.debug(f"Concurrency limit raised to {self.limit}")
+
+
+_rate_limiters: dict[tuple[str, str], RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: dict) -> RateLimiter:
+    """
+    Returns the process-wide rate limiter of the provider/model described by the model dict.
+    :param model: Dictionary with provider and model_name of the model.
+    :return: RateLimiter shared by every request to that provider/model.
+    """
+    key = (model['provider'], model['model_name'])
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            logger.info(f"Creating rate limiter for {key[0]}/{key[1]}")
+            _rate_limiters[key] = RateLimiter()
+        return _rate_limiters[key]
+
+
+def set_rate_limits(model: dict, max_concurrency: int = constants.MAX_CONCURRENT_REQUESTS,
+                    requests_per_minute: int = constants.REQUESTS_PER_MINUTE,
+                    adaptive: bool = constants.ADAPTIVE_CONCURRENCY) -> RateLimiter:
+    """
+    Replaces the process-wide rate limiter of a provider/model, before any request to it is made.
+    :param model: Dictionary with provider and model_name of the model.
+    :param max_concurrency: Maximum number of requests in flight at the same time, ceiling of the adaptive limit.
+    :param requests_per_minute: Maximum number of requests started per minute, 0 disables the rate limit.
+    :param adaptive: False for a static limit of max_concurrency requests in flight.
+    :return: the new RateLimiter
+    """
+    key = (model['provider'], model['model_name'])
+    with _rate_limiters_lock:
+        _rate_limiters[key] = RateLimiter(max_concurrency, requests_per_minute, adaptive)
+        return _rate_limiters[key]
+
+
+# Run id and stage of the last chat model request started in the current context, see ConcurrencyCallbackHandler
+_current_request: contextvars.ContextVar[Optional[tuple[UUID, str]]] = contextvars.ContextVar(
+    'current_request', default=None)
+
+
+class ConcurrencyCallbackHandler(BaseCallbackHandler, BaseRateLimiter):
+    """
+    Holds every chat model request sent to the provider until the rate limiter of its provider/model lets it start,
+    whichever code path makes it (ingestion or agent node), and reports the outcome of the request to the limiter.
+    It is given to the model both as a callback and as its rate_limiter: LangChain calls the rate limiter after the
+    LLM cache lookup, in the context of the request that on_chat_model_start saw start, so that responses served by
+    the cache never wait for a slot (nor tell anything about the provider).
+    """
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, model: dict):
+        self.model = {'provider': model['provider'], 'model_name': model['model_name']}
+        self._pending: Dict[UUID, tuple[RateLimiter, RequestSlot, str]] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        _current_request.set((run_id, get_request_stage(metadata)))
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        request = _current_request.get()
+        if request is None:
+            return True
+        _current_request.set(None)
+        run_id, stage = request
+        # The limiter is looked up per request, so that set_rate_limits applies to the models already created
+        rate_limiter = get_rate_limiter(self.model)
+        slot = rate_limiter.acquire(_request_budget.get())
+        with self._lock:
+            self._pending[run_id] = (rate_limiter, slot, stage)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        return await asyncio.to_thread(contextvars.copy_context().run, self.acquire, blocking=blocking)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self._release(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._release(run_id, error)
+
+    def _release(self, run_id: UUID, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            pending = self._pending.pop(run_id, None)
+        if pending is None:
+            return
+        rate_limiter, slot, stage = pending
+        rate_limiter.release(slot, stage, error)
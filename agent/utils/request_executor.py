@@ -0,0 +1,190 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from agent.config import constants
+from agent.config.initialize_logger import logger
+from agent.utils.cancellation import check_cancelled, get_cancellation_token
+from agent.utils.rate_limiter import RequestBudget, RequestDeadlineExceededError, is_transient_error, request_budget
+from agent.utils.token_utils import get_request_stage
+
+
+class LatencyTracker:
+    """
+    Latencies of the last successful requests of a model and stage, safe to share between threads.
+    """
+
+    def __init__(self, window: int = constants.HEDGE_LATENCY_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        q quantile of the recorded latencies, None until HEDGE_MIN_SAMPLES latencies are recorded.
+        """
+        with self._lock:
+            if len(self._latencies) < constants.HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+_latency_trackers: Dict[tuple[str, str], LatencyTracker] = {}
+_latency_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(runnable: Runnable, stage: str) -> LatencyTracker:
+    """
+    Returns the process-wide latency tracker of the requests of a model (or runnable) and stage.
+    """
+    name = getattr(runnable, 'model_name', None) or getattr(runnable, 'model', None) or runnable.get_name()
+    key = (str(name), stage)
+    with _latency_trackers_lock:
+        if key not in _latency_trackers:
+            _latency_trackers[key] = LatencyTracker()
+        return _latency_trackers[key]
+
+
+def with_deadline(config: RunnableConfig, seconds: float) -> RunnableConfig:
+    """
+    Copy of a graph config whose requests must all complete within seconds from now (or by the earlier
+    deadline the config already has). The deadline is an absolute time in the configurable of the config,
+    so it reaches every node and subgraph of the run unchanged.
+    """
+    configurable = dict(config.get('configurable') or {})
+    deadline = time.time() + seconds
+    if configurable.get('deadline'):
+        deadline = min(deadline, configurable['deadline'])
+    configurable['deadline'] = deadline
+    return {**config, 'configurable': configurable}
+
+
+def invoke_with_retries(runnable: Runnable, messages: Any, config: Optional[RunnableConfig] = None) -> Any:
+    """
+    runnable.invoke(messages, config), retried up to REQUEST_RETRIES times with exponential backoff while the
+    provider rejects it as overloaded (429/503) or it fails on a transient error; the rate limiter of the model cuts
+    its concurrency limit on the overloads meanwhile.
+    """
+    for attempt in range(constants.REQUEST_RETRIES + 1):
+        try:
+            return runnable.invoke(messages, config=config)
+        except Exception as e:
+            if attempt == constants.REQUEST_RETRIES or not is_transient_error(e):
+                raise
+            delay = constants.REQUEST_RETRY_SECONDS * 2 ** attempt
+            logger.warning(f"Transient provider error, retrying the request in {delay:.1f}s: {e}")
+            time.sleep(delay)
+            check_cancelled()
+
+
+def invoke_llm(runnable: Runnable, messages: Any, config: Optional[RunnableConfig] = None,
+               timeout: Optional[float] = None, hedge: Optional[bool] = None) -> Any:
+    """
+    runnable.invoke(messages, config) (a chat model, or e.g. a structured output runnable), bounded by a deadline,
+    optionally hedged, and abandoned as soon as the cancellation token of the current context is cancelled.
+    Overloaded requests are retried (see invoke_with_retries).
+    The request runs in a daemon thread the caller stops waiting for on deadline or cancellation: the response
+    of an abandoned request is discarded. With hedging, a duplicate request is sent once the request runs longer
+    than the HEDGE_QUANTILE latency of the previous requests of its model and stage, and the first response wins.
+    Within the deadline of a graph run, a request unanswered after timeout seconds is sent again (the previous
+    attempts keep racing), the request only fails once the run deadline is exhausted; without a run deadline, it
+    fails after timeout seconds.
+    :param runnable: Runnable to invoke
+    :param messages: input of the runnable
+    :param config: config of the invoke, its configurable may hold the absolute "deadline" of a graph run (see
+        with_deadline), "request_timeout_seconds" and "hedge_requests" (see AssistantConfiguration)
+    :param timeout: timeout of the request in seconds, defaults to the config or REQUEST_TIMEOUT_SECONDS, 0 for none
+    :param hedge: whether to hedge the request, defaults to the config or HEDGE_REQUESTS
+    :raises RequestDeadlineExceededError: if no response arrives before the run deadline (or the timeout)
+    :raises OperationCancelledError: if the token is cancelled before the response arrives
+    """
+    configurable = (config or {}).get('configurable') or {}
+    if timeout is None:
+        timeout = configurable.get('request_timeout_seconds', constants.REQUEST_TIMEOUT_SECONDS)
+    if hedge is None:
+        hedge = configurable.get('hedge_requests', constants.HEDGE_REQUESTS)
+    start = time.monotonic()
+    run_deadline = start + configurable['deadline'] - time.time() if configurable.get('deadline') else None
+    deadline = run_deadline if run_deadline is not None else (start + timeout if timeout else None)
+    token = get_cancellation_token()
+    if token is None and deadline is None and not hedge:
+        return invoke_with_retries(runnable, messages, config)
+    if token is not None:
+        token.raise_if_cancelled()
+    if deadline is not None and deadline <= start:
+        raise RequestDeadlineExceededError("Deadline of the run exceeded before the request")
+
+    stage = get_request_stage((config or {}).get('metadata'))
+    tracker = get_latency_tracker(runnable, stage)
+    hedge_delay = tracker.quantile(constants.HEDGE_QUANTILE) if hedge else None
+    done = threading.Event()
+    attempts: List[Future] = []
+    sent_at: List[float] = []
+    # Shared by the attempts, so that those still waiting for a slot of the rate limiter give up once the request
+    # is answered, cancelled or past its deadline
+    budget = RequestBudget(deadline=deadline)
+
+    def send() -> None:
+        future = Future()
+        future.add_done_callback(lambda _: done.set())
+        attempts.append(future)
+        sent = time.monotonic()
+        sent_at.append(sent)
+
+        def run():
+            try:
+                with request_budget(budget):
+                    result = invoke_with_retries(runnable, messages, config)
+                tracker.record(time.monotonic() - sent)
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=contextvars.copy_context().run, args=(run,), name="llm-request", daemon=True).start()
+
+    send()
+    try:
+        with token.on_cancel(done.set) if token is not None else nullcontext():
+            while True:
+                done.clear()
+                for future in attempts:
+                    if future.done() and future.exception() is None:
+                        return future.result()
+                if all(future.done() for future in attempts):
+                    raise attempts[0].exception()
+                if token is not None and token.is_cancelled:
+                    logger.info("LLM request abandoned on cancellation")
+                    token.raise_if_cancelled()
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    logger.warning(f"LLM request of stage {stage} abandoned after {now - start:.1f}s")
+                    raise RequestDeadlineExceededError(f"No response to the request of stage {stage} "
+                                                       f"within {now - start:.1f}s")
+                wake_at = deadline
+                if timeout and run_deadline is not None:
+                    resend_at = sent_at[-1] + timeout
+                    if now >= resend_at:
+                        logger.warning(f"No response to the LLM request of stage {stage} within {timeout:.0f}s, "
+                                       f"sending it again (attempt {len(attempts) + 1})")
+                        send()
+                        continue
+                    wake_at = min(wake_at, resend_at)
+                if hedge_delay is not None and len(attempts) == 1:
+                    if now >= start + hedge_delay:
+                        logger.info(f"Hedging LLM request of stage {stage} after {now - start:.1f}s")
+                        send()
+                        continue
+                    wake_at = min(wake_at, start + hedge_delay) if wake_at is not None else start + hedge_delay
+                done.wait(None if wake_at is None else max(0.0, wake_at - now))
+    finally:
+        budget.abandoned.set()
@@ -0,0 +1,361 @@
+import base64
+import contextvars
+import io
+import json
+import math
+import os
+import threading
+import wave
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional, Union
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+from PIL import Image
+
+from agent.config import constants
+from agent.config.initialize_logger import logger
+
+# Metadata key of the RunnableConfig naming the ingestion stage a request belongs to
+STAGE_METADATA_KEY = 'ingestion_stage'
+
+
+class TokenBudgetExceededError(ValueError):
+    """
+    Raised before dispatch when the estimated input tokens of a request exceed the token budget.
+    """
+
+    def __init__(self, estimated_tokens: int, budget: int):
+        super().__init__(f"Request of ~{estimated_tokens} input tokens exceeds the budget of {budget} tokens")
+        self.estimated_tokens = estimated_tokens
+        self.budget = budget
+
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    Rough estimate of the number of tokens of a text.
+    """
+    return len(text) // constants.CHARS_PER_TOKEN + 1
+
+
+def estimate_image_tokens(img_base64: str, provider: str = constants.PROVIDER) -> int:
+    """
+    Estimate the number of tokens billed for an image from its resolution.
+    Gemini: images with both sides within IMAGE_SMALL_SIDE count as a single tile, larger images are split
+    into IMAGE_TILE_SIZE tiles. OpenAI: the image is scaled to fit 2048px then to a shortest side of 768px,
+    and billed a base cost plus a cost per 512px tile.
+    :param img_base64: base64 encoded image
+    :param provider: provider the image is sent to
+    :return: estimated number of image tokens
+    """
+    try:
+        width, height = Image.open(io.BytesIO(base64.b64decode(img_base64))).size
+    except Exception as e:
+        logger.warning(f"Could not read image size, assuming a single tile: {e}")
+        return constants.IMAGE_TOKENS_PER_TILE
+    if provider in ("openai", "azure_openai"):
+        scale = min(1.0, 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1.0, 768 / min(width, height))
+        width, height = width * scale, height * scale
+        tiles = math.ceil(width / constants.OPENAI_IMAGE_TILE_SIZE) * math.ceil(height / constants.OPENAI_IMAGE_TILE_SIZE)
+        return constants.OPENAI_IMAGE_BASE_TOKENS + tiles * constants.OPENAI_IMAGE_TOKENS_PER_TILE
+    if width <= constants.IMAGE_SMALL_SIDE and height <= constants.IMAGE_SMALL_SIDE:
+        return constants.IMAGE_TOKENS_PER_TILE
+    tiles = math.ceil(width / constants.IMAGE_TILE_SIZE) * math.ceil(height / constants.IMAGE_TILE_SIZE)
+    return tiles * constants.IMAGE_TOKENS_PER_TILE
+
+
+def estimate_audio_tokens(audio_base64: str) -> int:
+    """
+    Estimate the number of tokens billed for an audio clip from its duration.
+    :param audio_base64: base64 encoded wav audio
+    :return: estimated number of audio tokens
+    """
+    audio_bytes = base64.b64decode(audio_base64)
+    try:
+        with wave.open(io.BytesIO(audio_bytes)) as wav:
+            duration = wav.getnframes() / float(wav.getframerate())
+    except Exception as e:
+        # Assume 16kHz mono 16 bit PCM
+        logger.warning(f"Could not read audio duration, estimating it from its size: {e}")
+        duration = len(audio_bytes) / (16000 * 2)
+    return math.ceil(duration * constants.AUDIO_TOKENS_PER_SECOND)
+
+
+def _get_data(url: str) -> str:
+    """
+    Returns the base64 data of a data URL, or the string itself when it is not a data URL.
+    """
+    return url.split(',', 1)[1] if url.startswith('data:') else url
+
+
+def estimate_content_tokens(content: Union[str, List[Union[str, dict]]], provider: str = constants.PROVIDER) -> int:
+    """
+    Estimate the input tokens of the content of a message: text, images and audio blocks.
+    :param content: message content, a string or a list of content blocks
+    :param provider: provider the content is sent to
+    :return: estimated number of input tokens
+    """
+    if isinstance(content, str):
+        return estimate_text_tokens(content)
+    tokens = 0
+    for block in content:
+        if isinstance(block, str):
+            tokens += estimate_text_tokens(block)
+            continue
+        block_type = block.get('type')
+        if block_type == 'text':
+            tokens += estimate_text_tokens(block.get('text', ''))
+        elif block_type == 'image_url':
+            image_url = block.get('image_url', '')
+            if isinstance(image_url, dict):
+                image_url = image_url.get('url', '')
+            tokens += estimate_image_tokens(_get_data(image_url), provider)
+        elif block_type == 'image':
+            tokens += estimate_image_tokens(block.get('data', ''), provider)
+        elif block_type in ('media', 'audio') or str(block.get('mime_type', '')).startswith('audio/'):
+            tokens += estimate_audio_tokens(block.get('data', ''))
+        else:
+            tokens += estimate_text_tokens(json.dumps(block))
+    return tokens
+
+
+def estimate_message_tokens(messages: List[Union[BaseMessage, tuple, str]], provider: str = constants.PROVIDER) -> int:
+    """
+    Estimate the input tokens of a request from its messages, before it is dispatched.
+    :param messages: messages of the request (BaseMessage, (role, content) tuples or strings)
+    :param provider: provider the request is sent to
+    :return: estimated number of input tokens
+    """
+    tokens = 0
+    for message in messages:
+        if isinstance(message, BaseMessage):
+            content = message.content
+        elif isinstance(message, tuple):
+            content = message[1]
+        else:
+            content = message
+        tokens += estimate_content_tokens(content, provider)
+    return tokens
+
+
+def get_max_input_tokens(provider: str = constants.PROVIDER, model_name: Optional[str] = None) -> int:
+    """
+    Input token budget of a request to a model: MAX_INPUT_TOKENS when set, else the context window of the model
+    (MODEL_CONTEXT_WINDOWS) or of its provider (PROVIDER_CONTEXT_WINDOWS).
+    :param provider: provider of the model
+    :param model_name: name of the model, None for the default of the provider
+    """
+    if constants.MAX_INPUT_TOKENS > 0:
+        return constants.MAX_INPUT_TOKENS
+    if model_name:
+        for prefix in sorted(constants.MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+            if model_name.startswith(prefix):
+                return constants.MODEL_CONTEXT_WINDOWS[prefix]
+    return constants.PROVIDER_CONTEXT_WINDOWS.get(provider, constants.DEFAULT_CONTEXT_WINDOW)
+
+
+def check_token_budget(messages: List[Union[BaseMessage, tuple, str]], provider: str = constants.PROVIDER,
+                       budget: Optional[int] = None) -> int:
+    """
+    Estimate the input tokens of a request and reject it when it exceeds the budget.
+    :param budget: input token budget, defaults to get_max_input_tokens of the provider
+    :return: estimated number of input tokens
+    :raises TokenBudgetExceededError: if the estimate exceeds the budget
+    """
+    if budget is None:
+        budget = get_max_input_tokens(provider)
+    estimated_tokens = estimate_message_tokens(messages, provider)
+    if estimated_tokens > budget:
+        raise TokenBudgetExceededError(estimated_tokens, budget)
+    return estimated_tokens
+
+
+def token_stage_config(stage: str) -> dict:
+    """
+    RunnableConfig attributing the requests of an invoke to an ingestion stage in the token usage report.
+    """
+    return {"metadata": {STAGE_METADATA_KEY: stage}}
+
+
+def get_request_stage(metadata: Optional[Dict[str, Any]]) -> str:
+    """
+    Stage of a request: the STAGE_METADATA_KEY metadata of its config, or the langgraph node that made it.
+    """
+    metadata = metadata or {}
+    return metadata.get(STAGE_METADATA_KEY) or metadata.get('langgraph_node') or 'other'
+
+
+@dataclass
+class TokenUsage:
+    requests: int = 0
+    estimated_input_tokens: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+    def add(self, other: 'TokenUsage') -> None:
+        self.requests += other.requests
+        self.estimated_input_tokens += other.estimated_input_tokens
+        self.input_tokens += other.input_tokens
+        self.output_tokens += other.output_tokens
+
+
+class TokenUsageReport:
+    """
+    Per-stage request and token totals of an ingestion, safe to share between threads.
+    The report is written as TOKEN_USAGE_FILE in the ingestion output folder, totals of previous runs
+    (e.g. an interrupted ingestion that was resumed) are carried over. Requests answered by the LLM cache are
+    counted in the totals, and apart in cached_requests.
+    """
+
+    def __init__(self, output_dir: Optional[str] = None):
+        """
+        Initializes the report, loading the totals of a previous run from output_dir when present.
+        :param output_dir: ingestion output folder the report is written to
+        """
+        self.output_dir = output_dir
+        self.stages: Dict[str, TokenUsage] = {}
+        self.runs = 1
+        self.cached_requests = 0
+        self._lock = threading.Lock()
+        if output_dir is not None and os.path.isfile(self.file_path):
+            try:
+                with open(self.file_path) as f:
+                    data = json.load(f)
+                self.stages = {stage: TokenUsage(**usage) for stage, usage in data.get('stages', {}).items()}
+                self.runs = data.get('runs', 0) + 1
+                self.cached_requests = data.get('cached_requests', 0)
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Discarding unreadable token usage report {self.file_path}: {e}")
+
+    @property
+    def file_path(self) -> str:
+        return os.path.join(self.output_dir, constants.TOKEN_USAGE_FILE)
+
+    def record(self, stage: str, usage: TokenUsage) -> None:
+        with self._lock:
+            self.stages.setdefault(stage, TokenUsage()).add(usage)
+
+    def record_cached_request(self) -> None:
+        with self._lock:
+            self.cached_requests += 1
+
+    def total(self) -> TokenUsage:
+        total = TokenUsage()
+        with self._lock:
+            for usage in self.stages.values():
+                total.add(usage)
+        return total
+
+    def to_dict(self) -> dict:
+        total = asdict(self.total())
+        with self._lock:
+            stages = {stage: asdict(usage) for stage, usage in sorted(self.stages.items())}
+            cached_requests = self.cached_requests
+        return {"runs": self.runs, "cached_requests": cached_requests, "total": total, "stages": stages}
+
+    def write(self) -> None:
+        """
+        Atomically write the report in the output folder.
+        """
+        if self.output_dir is None:
+            return
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, self.file_path)
+        logger.info(f"Token usage: {self.to_dict()['total']}")
+
+
+_current_report: contextvars.ContextVar[Optional[TokenUsageReport]] = contextvars.ContextVar(
+    'token_usage_report', default=None)
+# Reports of the running ingestions keyed by output folder, for progress reporting
+_live_reports: Dict[str, TokenUsageReport] = {}
+_live_reports_lock = threading.Lock()
+
+
+def get_live_token_usage_report(output_dir: str) -> Optional[TokenUsageReport]:
+    """
+    Returns the report of the ingestion running in output_dir, None if there is none.
+    """
+    with _live_reports_lock:
+        return _live_reports.get(os.path.abspath(output_dir))
+
+
+def record_cached_request() -> None:
+    """
+    Count a request answered by the LLM cache in the report of the current context, if any.
+    """
+    report = _current_report.get()
+    if report is not None:
+        report.record_cached_request()
+
+
+@contextmanager
+def token_usage_report(report: TokenUsageReport) -> Iterator[TokenUsageReport]:
+    """
+    Record the requests made in this context (and in threads started with a copy of it) in the report.
+    The report is written when the context exits, even on failure.
+    """
+    token = _current_report.set(report)
+    if report.output_dir is not None:
+        with _live_reports_lock:
+            _live_reports[os.path.abspath(report.output_dir)] = report
+    try:
+        yield report
+    finally:
+        _current_report.reset(token)
+        if report.output_dir is not None:
+            with _live_reports_lock:
+                _live_reports.pop(os.path.abspath(report.output_dir), None)
+        report.write()
+
+
+class TokenAccountingCallbackHandler(BaseCallbackHandler):
+    """
+    Estimates the input tokens of every chat model request before dispatch, rejects requests over the token
+    budget with TokenBudgetExceededError, and records requests and token usage in the current TokenUsageReport.
+    The stage of a request is the STAGE_METADATA_KEY metadata of its config, or the langgraph node that made it.
+    """
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, provider: str = constants.PROVIDER, budget: Optional[int] = None):
+        self.provider = provider
+        self.budget = budget if budget is not None else get_max_input_tokens(provider)
+        self._pending: Dict[UUID, tuple[str, int, Optional[TokenUsageReport]]] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        stage = get_request_stage(metadata)
+        estimated_tokens = sum(estimate_message_tokens(message_list, self.provider) for message_list in messages)
+        logger.debug(f"Request of stage {stage}: ~{estimated_tokens} input tokens")
+        if estimated_tokens > self.budget:
+            raise TokenBudgetExceededError(estimated_tokens, self.budget)
+        with self._lock:
+            self._pending[run_id] = (stage, estimated_tokens, _current_report.get())
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            pending = self._pending.pop(run_id, None)
+        if pending is None:
+            return
+        stage, estimated_tokens, report = pending
+        if report is None:
+            return
+        usage = TokenUsage(requests=1, estimated_input_tokens=estimated_tokens)
+        for generations in response.generations:
+            for generation in generations:
+                usage_metadata = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+                usage.input_tokens += usage_metadata.get('input_tokens', 0)
+                usage.output_tokens += usage_metadata.get('output_tokens', 0)
+        report.record(stage, usage)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._pending.pop(run_id, None)
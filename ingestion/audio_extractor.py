@@ -6,6 +6,7 @@ import logging
 import shutil
 
 from pydub import AudioSegment
+from agent.utils.cancellation import OperationCancelledError, run_subprocess
 from agent.config.initialize_logger import logger
 
 
@@ -13,7 +14,8 @@ class VideoAudioProcessor:
     """
     Processor to extract the primary audio track from a video file (and or persist/chunk it).
     """
-    def __init__(self, input_path: str, output_path: str, interval_s: int = -1, ffmpeg_path: str = "ffmpeg", persist: bool = False):
+    def __init__(self, input_path: str, output_path: str, interval_s: int = -1, ffmpeg_path: str = "ffmpeg", persist: bool = False,
+                 segment_times: list = None):
         """
         Initializes the VideoAudioProcessor with the given parameters.
         :param input_path: Input video file path, must end with the filename
@@ -21,6 +23,8 @@ class VideoAudioProcessor:
         :param interval_s: If you wish to retrieve the audio in chunks, specify the interval in seconds. (default: -1)
         :param ffmpeg_path: Specify the path to the ffmpeg executable. (default: "ffmpeg")
         :param persist: If you wish to persist the audio in your disk, set this to True. (default: False)
+        :param segment_times: Optional start times in seconds of every chunk but the first, replacing the fixed
+            interval_s chunks of persisted audio (see segmenter.SegmentPlan). (default: None)
         """
         self.ffmpeg_path = ffmpeg_path
         self.input_path = input_path
@@ -29,6 +33,7 @@ class VideoAudioProcessor:
         self.sample_rate = 16000
         self.channels = 1  # Mono audio, ultimately converted to by Gemini
         self.persist = persist
+        self.segment_times = segment_times
         if shutil.which(self.ffmpeg_path) is None:
             raise EnvironmentError(f"ffmpeg not found at path '{self.ffmpeg_path}'. Please install ffmpeg\nIf using macos use brew install ffmpeg.\nFor other platforms, please clone the repo")
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -41,11 +46,14 @@ class VideoAudioProcessor:
         """
         try:
             self.logger.debug(f"Running ffmpeg command: {' '.join(cmd)}")
-            completed = subprocess.run(cmd, capture_output=True, text=True)
+            # ffmpeg is killed if the ingestion is cancelled
+            completed = run_subprocess(cmd, text=True)
             if completed.returncode != 0:
                 err = completed.stderr.strip()
                 raise RuntimeError(f"ffmpeg failed: {err}")
             self.logger.info("ffmpeg command executed successfully.")
+        except OperationCancelledError:
+            raise
         except Exception as e:
             self.logger.error(f"ffmpeg command execution failed: {e}")
             raise
@@ -73,14 +81,22 @@ class VideoAudioProcessor:
                 self.output_path
             ]
             self._run_ffmpeg_command(cmd1)
+            if self.segment_times is None:
+                split_args = ["-segment_time", str(self.interval_s)]
+            elif self.segment_times:
+                split_args = ["-segment_times", ",".join(f"{t:.3f}" for t in self.segment_times)]
+            else:
+                # A single chunk
+                split_args = ["-segment_time", str(24 * 3600)]
             cmd2 = [
                 self.ffmpeg_path,
                 "-i", self.output_path,
                 "-f", "segment",
-                "-segment_time", str(self.interval_s),
+                *split_args,
                 "-ar", str(self.sample_rate),
                 "-ac", str(self.channels),
                 "-c", "copy",
+                "-y",  # chunks of an interrupted run are overwritten
                 f"{base}_%03d{ext}"
             ]
             self._run_ffmpeg_command(cmd2)
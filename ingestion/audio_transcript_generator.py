@@ -1,24 +1,27 @@
 import json
 import os
 import base64
-import time
 from langchain_core.language_models import BaseChatModel
 from agent.config.initialize_logger import logger
 
 from agent.config.assistant_config import AssistantConfiguration
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
 
-from typing import Dict, List
-from ingestion import prompts
+from typing import Dict, List, Optional
+from agent.utils.request_executor import invoke_llm
+from agent.utils.token_utils import token_stage_config
+from ingestion import prompts, segment_cache
 from ingestion.frame_json_parser import FrameJsonOutputParser
+from ingestion.manifest import IngestionManifest, Stage
 
 
-def generate_audio_segment_transcript(path_to_folder: str) -> list[dict]:
+def generate_audio_segment_transcript(path_to_folder: str, manifest: IngestionManifest = None) -> list[dict]:
     """
     Generate a frame transcript based on the agent's state and configuration.
 
     Args:
         path_to_folder (str): The path to the folder containing audio segments.
+        manifest (IngestionManifest): Optional manifest, audio chunks already recorded in it are not requested again.
 
     Returns:
         list[dict]: A dictionary containing the generated frame transcript and related messages.
@@ -33,10 +36,9 @@ def generate_audio_segment_transcript(path_to_folder: str) -> list[dict]:
 
         # LLM Configuration
         logger.info("---GENERATE AUDIO SEGMENT TRANSCRIPT FOR INGESTION---")
-        audio_dict = read_audio_segs_from_folder(path_to_folder)
         configuration = AssistantConfiguration()
         chat_model = configuration.get_model(configuration.default_llm_model)
-        req_output_list = llm_requests(chat_model, path_to_folder)
+        req_output_list = llm_requests(chat_model, path_to_folder, manifest)
         return req_output_list
     except Exception as exc:
         logger.exception(f"Exception in creating transcription of frame segments: {exc}")
@@ -56,30 +58,76 @@ def read_audio_segs_from_folder(path_to_folder) -> Dict[str, str]:
     return audio_base64_dict
 
 
-def llm_requests(chat_model, path_to_folder: str) -> List[Dict[str, str]]:
+def llm_requests(chat_model, path_to_folder: str, manifest: IngestionManifest = None) -> List[Dict[str, str]]:
     """
     Create a list of LLM requests from the base64 encoded images.
+    When a manifest is given, each transcribed chunk is recorded in it and recorded chunks are reused.
 
     Returns:
         List[Dict[str, str]]: A list of dictionaries containing image data for LLM requests.
     """
     req_output_list = []
-    req_parts = [prompts.AUDIO_EXTRACT_PROMPT]
+    audio_f_names = sorted(entry.name for entry in os.scandir(path_to_folder) if entry.is_file())
+    for audio_f_name in audio_f_names:
+        req_output = transcribe_audio_chunk(chat_model, os.path.join(path_to_folder, audio_f_name), manifest)
+        req_output_list.append(req_output)
+    return req_output_list
 
-    # Read frames from the folder and convert to base64
-    audio_segments = read_audio_segs_from_folder(path_to_folder)
 
-    # Create LLM requests from the base64 images
 
-    for audio_f_name in sorted(audio_segments.keys()):
-        audio_base64 = audio_segments.get(audio_f_name, '')
-        req_parts.append(audio_base64)
-        req_output = get_llm_response(req_parts, chat_model)
-        # time.sleep(6)  # Sleep to avoid rate limiting issues with the LLM
-        req_output_list.append(req_output)
-        req_parts = [prompts.AUDIO_EXTRACT_PROMPT]
-    return req_output_list
+def transcribe_audio_chunk(chat_model, audio_path: str, manifest: IngestionManifest = None) -> dict:
+    """
+    Transcribe a single audio chunk file.
+    :param chat_model: BaseChatModel
+    :param audio_path: path of the audio chunk (wav)
+    :param manifest: optional manifest, a chunk already recorded in it is not requested again
+    :return: dict: parsed transcript of the chunk
+    A chunk already transcribed in any previous video (same audio fingerprint) is served from the segment cache.
+    """
+    req_output, audio_key = lookup_audio_chunk(audio_path, manifest)
+    if req_output is not None:
+        return req_output
+    with open(audio_path, "rb") as audiofile:
+        audio_base64 = base64.b64encode(audiofile.read()).decode('utf-8')
+    req_output = get_llm_response([prompts.AUDIO_EXTRACT_PROMPT, audio_base64], chat_model)
+    if audio_key is not None:
+        segment_cache.store(audio_key, get_audio_namespace(), req_output)
+    if manifest is not None:
+        manifest.record_unit(Stage.AUDIO_TRANSCRIPT, os.path.basename(audio_path), req_output)
+    return req_output
+
+
+def get_audio_namespace() -> str:
+    """
+    Segment cache namespace of the audio transcripts of the default model.
+    """
+    return segment_cache.get_namespace(AssistantConfiguration().default_llm_model, prompts.AUDIO_EXTRACT_PROMPT)
+
 
+def lookup_audio_chunk(audio_path: str, manifest: IngestionManifest = None) -> tuple[Optional[dict], Optional[str]]:
+    """
+    Transcript of an audio chunk recorded in the manifest, or served from the segment cache (and then recorded
+    in the manifest), without any LLM request.
+    :param audio_path: path of the audio chunk (wav)
+    :param manifest: optional manifest of the ingestion
+    :return: tuple: the transcript, None if the chunk must be requested, and the segment cache key of the
+        chunk, None if it was not fingerprinted
+    """
+    audio_f_name = os.path.basename(audio_path)
+    if manifest is not None and manifest.has_unit(Stage.AUDIO_TRANSCRIPT, audio_f_name):
+        logger.info(f"Reusing recorded transcript of {audio_f_name}")
+        return manifest.get_unit(Stage.AUDIO_TRANSCRIPT, audio_f_name), None
+    audio_key = None
+    try:
+        audio_key = segment_cache.get_audio_key(audio_path)
+    except Exception as e:
+        logger.warning(f"Could not fingerprint {audio_f_name}, it is not looked up in the segment cache: {e}")
+    req_output = segment_cache.lookup(audio_key, get_audio_namespace()) if audio_key is not None else None
+    if req_output is not None:
+        logger.info(f"Reusing segment cache transcript of {audio_f_name}")
+        if manifest is not None:
+            manifest.record_unit(Stage.AUDIO_TRANSCRIPT, audio_f_name, req_output)
+    return req_output, audio_key
 
 
 def get_llm_response(req_parts: List[str], chat_model: BaseChatModel) -> list[dict]:
@@ -89,30 +137,57 @@ def get_llm_response(req_parts: List[str], chat_model: BaseChatModel) -> list[di
       :param chat_model: BaseChatModel
       :return: list[dict] : List of dictionaries containing the LLM response.
     """
-    # Prepare prompts and messages
-    messages = [
-        HumanMessage(content=[
-            {
-                "type": "text",
-                "text": req_parts[0]
-            },
-            {
-                "type": "media",
-                "data": ' '.join(req_parts[1:]),
-                "mime_type": 'audio/wav',
-            }
-        ])
-    ]
-    # Generate the frame transcript
-    audio_transcript = chat_model.invoke(messages)
-    # time.sleep(6)
+    audio_base64 = ' '.join(req_parts[1:])
+    # Generate the audio transcript
+    audio_transcript = invoke_audio_request(req_parts[0], audio_base64, chat_model)
 
-    # Parse it and return it
+    # Parse it, salvaging the complete turns of a truncated output
     parser = FrameJsonOutputParser()
-    parsed_output = parser.parse(audio_transcript.content)
+    partial = parser.parse_partial(audio_transcript.content)
+    parsed_output = partial.value
+    turns = parsed_output.get('transcript') if isinstance(parsed_output, dict) else None
+    if not partial.complete and isinstance(turns, list) and turns:
+        # Only the turns after the last complete one are requested again
+        logger.warning(f"Audio transcript cut off after {len(turns)} turns, requesting the rest: {partial.dropped}")
+        continue_prompt = prompts.AUDIO_CONTINUE_PROMPT.replace("{last_turns}", json.dumps(turns[-2:]))
+        continuation = invoke_audio_request(continue_prompt, audio_base64, chat_model)
+        try:
+            remaining = parser.parse(continuation.content, salvage=True)
+            if isinstance(remaining, dict) and isinstance(remaining.get('transcript'), list):
+                turns.extend(remaining['transcript'])
+        except ValueError as e:
+            logger.warning(f"Could not parse the rest of the audio transcript, keeping {len(turns)} turns: {e}")
+    elif not partial.complete:
+        logger.warning(f"Salvaged audio transcript, dropped: {partial.dropped}")
     return parsed_output
 
 
+def invoke_audio_request(prompt: str, audio_base64: str, chat_model: BaseChatModel):
+    """
+    Send a prompt with a base64 encoded wav audio to the LLM.
+    :return: AIMessage: the LLM response
+    """
+    messages = [HumanMessage(content=get_audio_content(prompt, audio_base64))]
+    return invoke_llm(chat_model, messages, config=token_stage_config(Stage.AUDIO_TRANSCRIPT.value))
+
+
+def get_audio_content(prompt: str, audio_base64: str) -> list:
+    """
+    Content of the request of a prompt with a base64 encoded wav audio.
+    """
+    return [
+        {
+            "type": "text",
+            "text": prompt
+        },
+        {
+            "type": "media",
+            "data": audio_base64,
+            "mime_type": 'audio/wav',
+        }
+    ]
+
+
 def get_audio_content_list(base64_audio : Dict[str,str]):
     """
     Create a list of audio content dictionaries from the base64 encoded audio data.
@@ -0,0 +1,660 @@
+import base64
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from enum import Enum
+from typing import Dict, List, Optional
+
+from langchain_core.messages import HumanMessage
+
+from agent.config.assistant_config import AssistantConfiguration
+from agent.config.initialize_logger import logger
+from agent.utils.cancellation import check_cancelled
+from agent.utils.token_utils import TokenUsage, TokenUsageReport
+from ingestion import constants, prompts, segment_cache
+from ingestion.audio_transcript_generator import get_audio_content, get_audio_namespace, lookup_audio_chunk
+from ingestion.combined_text_transcriptor import (extract_segments, generate_transcript, get_manifest,
+                                                  resolve_segment_duration)
+from ingestion.frame_json_parser import FrameJsonOutputParser
+from ingestion.frame_transcript_generator import (get_batch_content, get_frame_batches, get_frame_content,
+                                                  get_frame_namespace, lookup_frames, parse_batch_response,
+                                                  read_frames_from_folder)
+from ingestion.lease import LeaseTimeoutError, ingestion_lease
+from ingestion.manifest import Stage
+from ingestion.video_utils import extraction_slot
+
+
+class BatchTimeoutError(TimeoutError):
+    """
+    Raised when a submitted batch is still running after BATCH_MAX_WAIT_SECONDS, the job can be resumed later.
+    """
+
+
+class BatchState(Enum):
+    """
+    State of a batch submitted to a BatchExecutor.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    @property
+    def is_final(self) -> bool:
+        return self in (BatchState.DONE, BatchState.FAILED)
+
+
+@dataclass
+class BatchResult:
+    """
+    Response to a request of a batch.
+
+    Attributes:
+        content: Text of the response, None if the request failed.
+        input_tokens: Input tokens reported by the provider.
+        output_tokens: Output tokens reported by the provider.
+        error: Error of a failed request.
+    """
+    content: Optional[str] = None
+    input_tokens: int = 0
+    output_tokens: int = 0
+    error: str = ""
+
+
+def _split_data_url(url: str) -> tuple[str, str]:
+    """
+    Mime type and base64 data of a data URL ("data:image/jpg;base64,...").
+    """
+    header, data = url.split(',', 1)
+    mime_type = header[len('data:'):].split(';')[0]
+    return ("image/jpeg" if mime_type == "image/jpg" else mime_type), data
+
+
+class BatchExecutor:
+    """
+    Asynchronous batch endpoint: a job file of requests is submitted at once, and the responses of every
+    request, keyed by request id, are fetched once the batch is done.
+    """
+    name = ""
+
+    def __init__(self, model: dict):
+        """
+        :param model: Dictionary with provider and model_name of the model answering the requests.
+        """
+        self.model = model
+
+    def format_request(self, custom_id: str, content: list) -> dict:
+        """
+        Line of the job file of a request with a single user message.
+        :param custom_id: id of the request, the response is returned under this id
+        :param content: LangChain content blocks of the message
+        """
+        raise NotImplementedError
+
+    def submit(self, job_file: str) -> str:
+        """
+        Submit a job file of format_request lines.
+        :return: id of the batch
+        """
+        raise NotImplementedError
+
+    def get_state(self, batch_id: str) -> BatchState:
+        raise NotImplementedError
+
+    def get_results(self, batch_id: str) -> Dict[str, BatchResult]:
+        """
+        Responses of the requests of a batch keyed by request id, requests without a response are missing.
+        """
+        raise NotImplementedError
+
+
+class LocalBatchExecutor(BatchExecutor):
+    """
+    Filesystem-backed stand-in of a provider batch endpoint, to run the batch flow offline (e.g. with the fake
+    provider). A batch is a folder holding the submitted job file, the state of the batch and the responses.
+    Its requests are run with the chat model by a background thread of the process polling the batch, a batch
+    interrupted with its process is resumed by the next poll.
+    """
+    name = "local"
+    _processing = set()
+    _processing_lock = threading.Lock()
+
+    def __init__(self, model: dict, root_dir: str = os.path.join(constants.BATCH_DIR, 'local')):
+        """
+        :param model: Dictionary with provider and model_name of the model answering the requests.
+        :param root_dir: Folder of the batches.
+        """
+        super().__init__(model)
+        self.root_dir = root_dir
+
+    def _path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.root_dir, batch_id, name)
+
+    def _write_state(self, batch_id: str, state: BatchState) -> None:
+        tmp_path = self._path(batch_id, 'state.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({"state": state.value}, f)
+        os.replace(tmp_path, self._path(batch_id, 'state.json'))
+
+    def format_request(self, custom_id: str, content: list) -> dict:
+        return {"custom_id": custom_id, "content": content}
+
+    def submit(self, job_file: str) -> str:
+        batch_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.root_dir, batch_id))
+        shutil.copyfile(job_file, self._path(batch_id, 'input.jsonl'))
+        self._write_state(batch_id, BatchState.PENDING)
+        logger.info(f"Submitted local batch {batch_id}")
+        return batch_id
+
+    def get_state(self, batch_id: str) -> BatchState:
+        with open(self._path(batch_id, 'state.json')) as f:
+            state = BatchState(json.load(f)["state"])
+        if not state.is_final:
+            with self._processing_lock:
+                start = batch_id not in self._processing
+                self._processing.add(batch_id)
+            if start:
+                threading.Thread(target=self._process, args=(batch_id,), name=f"local-batch-{batch_id[:8]}",
+                                 daemon=True).start()
+        return state
+
+    def _process(self, batch_id: str) -> None:
+        """
+        Run the requests of a batch without a response yet, appending their responses to output.jsonl.
+        """
+        try:
+            self._write_state(batch_id, BatchState.RUNNING)
+            done = set(self.get_results(batch_id).keys())
+            chat_model = AssistantConfiguration().get_model(self.model)
+            with open(self._path(batch_id, 'input.jsonl')) as requests, \
+                    open(self._path(batch_id, 'output.jsonl'), 'a') as output:
+                for line in requests:
+                    request = json.loads(line)
+                    if request["custom_id"] in done:
+                        continue
+                    response = {"custom_id": request["custom_id"]}
+                    try:
+                        message = chat_model.invoke([HumanMessage(content=request["content"])])
+                        usage = message.usage_metadata or {}
+                        response.update(content=message.content, input_tokens=usage.get('input_tokens', 0),
+                                        output_tokens=usage.get('output_tokens', 0))
+                    except Exception as e:
+                        logger.warning(f"Request {request['custom_id']} of local batch {batch_id} failed: {e}")
+                        response["error"] = str(e)
+                    output.write(json.dumps(response) + '\n')
+                    output.flush()
+            self._write_state(batch_id, BatchState.DONE)
+        except Exception as e:
+            logger.exception(f"Local batch {batch_id} failed: {e}")
+            self._write_state(batch_id, BatchState.FAILED)
+        finally:
+            with self._processing_lock:
+                self._processing.discard(batch_id)
+
+    def get_results(self, batch_id: str) -> Dict[str, BatchResult]:
+        results = {}
+        if not os.path.isfile(self._path(batch_id, 'output.jsonl')):
+            return results
+        with open(self._path(batch_id, 'output.jsonl')) as f:
+            for line in f:
+                try:
+                    response = json.loads(line)
+                except ValueError:
+                    # Line cut off by the end of the process that was writing it
+                    continue
+                custom_id = response.pop("custom_id")
+                results[custom_id] = BatchResult(**response)
+        return results
+
+
+class GeminiBatchExecutor(BatchExecutor):
+    """
+    Batch mode of the Gemini API (google-genai package), billed about half the price of interactive requests.
+    """
+    name = "gemini"
+
+    def __init__(self, model: dict):
+        super().__init__(model)
+        from google import genai
+
+        self.client = genai.Client()
+
+    def format_request(self, custom_id: str, content: list) -> dict:
+        parts = []
+        for block in content:
+            if block.get("type") == "text":
+                parts.append({"text": block["text"]})
+            elif block.get("type") == "image_url":
+                mime_type, data = _split_data_url(block["image_url"])
+                parts.append({"inline_data": {"mime_type": mime_type, "data": data}})
+            else:
+                parts.append({"inline_data": {"mime_type": block["mime_type"], "data": block["data"]}})
+        return {"key": custom_id, "request": {"contents": [{"role": "user", "parts": parts}]}}
+
+    def submit(self, job_file: str) -> str:
+        from google.genai import types
+
+        uploaded = self.client.files.upload(file=job_file, config=types.UploadFileConfig(
+            display_name=os.path.basename(os.path.dirname(job_file)), mime_type='jsonl'))
+        batch = self.client.batches.create(model=self.model['model_name'], src=uploaded.name)
+        logger.info(f"Submitted Gemini batch {batch.name}")
+        return batch.name
+
+    def get_state(self, batch_id: str) -> BatchState:
+        state = self.client.batches.get(name=batch_id).state.name
+        if state == "JOB_STATE_SUCCEEDED":
+            return BatchState.DONE
+        if state in ("JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"):
+            return BatchState.FAILED
+        return BatchState.RUNNING if state == "JOB_STATE_RUNNING" else BatchState.PENDING
+
+    def get_results(self, batch_id: str) -> Dict[str, BatchResult]:
+        batch = self.client.batches.get(name=batch_id)
+        if batch.dest is None or not batch.dest.file_name:
+            return {}
+        results = {}
+        for line in self.client.files.download(file=batch.dest.file_name).decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            response = json.loads(line)
+            if "response" not in response:
+                results[response["key"]] = BatchResult(error=json.dumps(response.get("error")))
+                continue
+            candidates = response["response"].get("candidates") or [{}]
+            parts = candidates[0].get("content", {}).get("parts", [])
+            usage = response["response"].get("usageMetadata") or response["response"].get("usage_metadata") or {}
+            results[response["key"]] = BatchResult(
+                content=''.join(part.get("text", "") for part in parts),
+                input_tokens=usage.get("promptTokenCount", usage.get("prompt_token_count", 0)),
+                output_tokens=usage.get("candidatesTokenCount", usage.get("candidates_token_count", 0)))
+        return results
+
+
+class OpenAIBatchExecutor(BatchExecutor):
+    """
+    Batch API of OpenAI and Azure OpenAI (openai package), billed about half the price of interactive requests.
+    """
+    name = "openai"
+
+    def __init__(self, model: dict):
+        super().__init__(model)
+        import openai
+
+        if model['provider'] == "azure_openai":
+            self.client = openai.AzureOpenAI(api_version=os.environ["AZURE_OPENAI_API_VERSION"])
+            self.endpoint = "/chat/completions"
+        else:
+            self.client = openai.OpenAI()
+            self.endpoint = "/v1/chat/completions"
+
+    def format_request(self, custom_id: str, content: list) -> dict:
+        openai_content = []
+        for block in content:
+            if block.get("type") == "text":
+                openai_content.append({"type": "text", "text": block["text"]})
+            elif block.get("type") == "image_url":
+                openai_content.append({"type": "image_url", "image_url": {"url": block["image_url"]}})
+            else:
+                openai_content.append({"type": "input_audio",
+                                       "input_audio": {"data": block["data"], "format": "wav"}})
+        return {"custom_id": custom_id, "method": "POST", "url": self.endpoint,
+                "body": {"model": self.model['model_name'],
+                         "messages": [{"role": "user", "content": openai_content}]}}
+
+    def submit(self, job_file: str) -> str:
+        with open(job_file, 'rb') as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=self.endpoint,
+                                           completion_window="24h")
+        logger.info(f"Submitted OpenAI batch {batch.id}")
+        return batch.id
+
+    def get_state(self, batch_id: str) -> BatchState:
+        status = self.client.batches.retrieve(batch_id).status
+        if status == "completed":
+            return BatchState.DONE
+        if status in ("failed", "expired", "cancelling", "cancelled"):
+            return BatchState.FAILED
+        return BatchState.PENDING if status == "validating" else BatchState.RUNNING
+
+    def get_results(self, batch_id: str) -> Dict[str, BatchResult]:
+        # An expired batch still returns the responses completed before it expired
+        batch = self.client.batches.retrieve(batch_id)
+        if not batch.output_file_id:
+            return {}
+        results = {}
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            response = json.loads(line)
+            body = (response.get("response") or {}).get("body") or {}
+            if response.get("error") or not body.get("choices"):
+                results[response["custom_id"]] = BatchResult(error=json.dumps(response.get("error") or body))
+                continue
+            usage = body.get("usage") or {}
+            results[response["custom_id"]] = BatchResult(content=body["choices"][0]["message"]["content"],
+                                                         input_tokens=usage.get("prompt_tokens", 0),
+                                                         output_tokens=usage.get("completion_tokens", 0))
+        return results
+
+
+_EXECUTORS = {executor.name: executor for executor in (LocalBatchExecutor, GeminiBatchExecutor, OpenAIBatchExecutor)}
+
+
+def get_batch_executor(name: str = constants.BATCH_EXECUTOR, model: dict = None) -> BatchExecutor:
+    """
+    Batch executor of a model.
+    :param name: "provider" for the batch endpoint of the provider of the model, "local" for the stand-in
+        executor, or the name of an executor ("gemini", "openai")
+    :param model: Dictionary with provider and model_name of the model, defaults to the default model
+    """
+    model = model or AssistantConfiguration().default_llm_model
+    if name == "provider":
+        match model['provider']:
+            case "google_genai":
+                name = GeminiBatchExecutor.name
+            case "openai" | "azure_openai":
+                name = OpenAIBatchExecutor.name
+            case "fake" | "replay":
+                # Offline providers have no batch endpoint
+                name = LocalBatchExecutor.name
+            case _:
+                raise ValueError(f"No batch endpoint for provider {model['provider']}")
+    if name not in _EXECUTORS:
+        raise ValueError(f"Unsupported batch executor: {name}")
+    return _EXECUTORS[name](model)
+
+
+@dataclass
+class BatchRequest:
+    """
+    Frame or audio request of an ingestion, sent in a batch.
+
+    Attributes:
+        output_dir: Output folder of the ingestion.
+        stage: Stage of the request, Stage.AUDIO_TRANSCRIPT or Stage.FRAME_TRANSCRIPTS.
+        units: Units of the manifest answered by the request (an audio chunk, or frames).
+        content: LangChain content blocks of the request.
+        keys: Segment cache keys of the units.
+        batched: True for a request transcribing several frames (see frame_transcript_generator.get_batch_content).
+    """
+    output_dir: str
+    stage: Stage
+    units: List[str]
+    content: list
+    keys: Dict[str, str] = field(default_factory=dict)
+    batched: bool = False
+
+
+@dataclass
+class BatchJob:
+    """
+    Batch ingestion of one or more videos, persisted in BATCH_DIR/<job_id> with its job file (requests.jsonl)
+    and its request index (index.json, unit of every request id), so that a job can be resumed by id.
+    """
+    job_id: str
+    executor: str
+    model: dict
+    segment_duration: int
+    consider_audio: bool = True
+    consider_video: bool = True
+    # Ingested videos: video_path, output_dir, segment_duration (resolved) and auto_duration
+    videos: List[dict] = field(default_factory=list)
+    # Error of every video left out of the job keyed by output dir
+    errors: Dict[str, str] = field(default_factory=dict)
+    batch_id: Optional[str] = None
+    state: str = BatchState.PENDING.value
+    completed: bool = False
+
+    @property
+    def job_dir(self) -> str:
+        return os.path.join(constants.BATCH_DIR, self.job_id)
+
+    def save(self) -> None:
+        path = os.path.join(self.job_dir, 'job.json')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(asdict(self), f, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, job_id: str) -> 'BatchJob':
+        with open(os.path.join(constants.BATCH_DIR, job_id, 'job.json')) as f:
+            return cls(**json.load(f))
+
+
+def collect_video_requests(video_path: str, output_dir: str, segment_duration: int, consider_audio: bool = True,
+                           consider_video: bool = True) -> tuple[List[BatchRequest], dict]:
+    """
+    Extract the segments of a video and collect the frame and audio requests of its transcription, the units
+    already recorded in its manifest or served from the segment cache are not requested.
+    :return: tuple: the requests, and the video entry of the job
+    """
+    auto_duration = segment_duration == constants.SEGMENT_DURATION_AUTO
+    segment_duration = resolve_segment_duration(video_path, segment_duration, consider_audio, consider_video)
+    manifest = get_manifest(video_path, output_dir, segment_duration, consider_audio, consider_video, auto_duration)
+    with extraction_slot():
+        extract_segments(video_path, output_dir, segment_duration, manifest, consider_audio, consider_video)
+    requests = []
+    if consider_audio and not manifest.is_stage_complete(Stage.AUDIO_TRANSCRIPT):
+        audio_directory = os.path.join(output_dir, 'audio_segments')
+        for audio_f_name in sorted(entry.name for entry in os.scandir(audio_directory) if entry.is_file()):
+            audio_path = os.path.join(audio_directory, audio_f_name)
+            req_output, audio_key = lookup_audio_chunk(audio_path, manifest)
+            if req_output is not None:
+                continue
+            with open(audio_path, "rb") as audiofile:
+                audio_base64 = base64.b64encode(audiofile.read()).decode('utf-8')
+            requests.append(BatchRequest(output_dir, Stage.AUDIO_TRANSCRIPT, [audio_f_name],
+                                         get_audio_content(prompts.AUDIO_EXTRACT_PROMPT, audio_base64),
+                                         {audio_f_name: audio_key} if audio_key is not None else {}))
+    if consider_video and not manifest.is_stage_complete(Stage.FRAME_TRANSCRIPTS):
+        _, pending_img, frame_keys = lookup_frames(read_frames_from_folder(os.path.join(output_dir, 'frames')),
+                                                   manifest)
+        batched = constants.FRAME_BATCH_SIZE > 1
+        if batched:
+            batches = get_frame_batches(pending_img, constants.FRAME_BATCH_SIZE, constants.FRAME_BATCH_TOKEN_BUDGET)
+        else:
+            batches = [[img_name] for img_name in sorted(pending_img.keys())]
+        for batch in batches:
+            content = get_batch_content(batch, pending_img) if batched \
+                else get_frame_content(prompts.FRAME_EXTRACT_PROMPT, pending_img[batch[0]])
+            requests.append(BatchRequest(output_dir, Stage.FRAME_TRANSCRIPTS, batch, content,
+                                         {img_name: frame_keys[img_name] for img_name in batch if img_name in frame_keys},
+                                         batched))
+    logger.info(f"Collected {len(requests)} batch requests of {video_path}")
+    return requests, {"video_path": video_path, "output_dir": output_dir, "segment_duration": segment_duration,
+                      "auto_duration": auto_duration}
+
+
+def submit_batch_job(videos: List[tuple[str, str]], segment_duration: int, consider_audio: bool = True,
+                     consider_video: bool = True, executor: BatchExecutor = None) -> BatchJob:
+    """
+    Extract the segments of the videos, serialize their frame and audio requests into a single job file and
+    submit it. A video that fails to extract is left out of the job, with its error in BatchJob.errors.
+    :param videos: (video path, output folder) of every video
+    :param segment_duration: segment duration in seconds, constants.SEGMENT_DURATION_AUTO to choose it per video
+    :param executor: batch executor, defaults to get_batch_executor()
+    :return: BatchJob: the submitted job, its state is DONE if no request was needed
+    """
+    executor = executor or get_batch_executor()
+    job = BatchJob(job_id=uuid.uuid4().hex, executor=executor.name, model=executor.model,
+                   segment_duration=segment_duration, consider_audio=consider_audio, consider_video=consider_video)
+    os.makedirs(job.job_dir)
+    job_file = os.path.join(job.job_dir, 'requests.jsonl')
+    index = {}
+    with open(job_file, 'w') as f:
+        for video_path, output_dir in videos:
+            check_cancelled()
+            try:
+                os.makedirs(output_dir, exist_ok=True)
+                with ingestion_lease(output_dir):
+                    requests, video = collect_video_requests(video_path, output_dir, segment_duration,
+                                                             consider_audio, consider_video)
+            except Exception as e:
+                logger.exception(f"Could not prepare {video_path} for batch ingestion: {e}")
+                job.errors[output_dir] = str(e) or type(e).__name__
+                continue
+            for request in requests:
+                custom_id = f"{len(job.videos):03d}-{request.stage.value}-{len(index):06d}"
+                f.write(json.dumps(executor.format_request(custom_id, request.content)) + '\n')
+                index[custom_id] = {"output_dir": request.output_dir, "stage": request.stage.value,
+                                    "units": request.units, "keys": request.keys, "batched": request.batched}
+            job.videos.append(video)
+    with open(os.path.join(job.job_dir, 'index.json'), 'w') as f:
+        json.dump(index, f)
+    if index:
+        job.batch_id = executor.submit(job_file)
+    else:
+        job.state = BatchState.DONE.value
+    job.save()
+    logger.info(f"Batch job {job.job_id}: {len(index)} requests of {len(job.videos)} videos")
+    return job
+
+
+def wait_for_batch_job(job: BatchJob, executor: BatchExecutor, poll_seconds: float = constants.BATCH_POLL_SECONDS,
+                       max_wait_seconds: float = constants.BATCH_MAX_WAIT_SECONDS) -> BatchState:
+    """
+    Poll the batch of a job until it is done or failed.
+    :raises BatchTimeoutError: if the batch is still running after max_wait_seconds
+    """
+    deadline = time.monotonic() + max_wait_seconds
+    while True:
+        state = BatchState(job.state) if job.batch_id is None else executor.get_state(job.batch_id)
+        if state.value != job.state:
+            logger.info(f"Batch job {job.job_id}: {job.state} -> {state.value}")
+            job.state = state.value
+            job.save()
+        if state.is_final:
+            return state
+        if time.monotonic() >= deadline:
+            raise BatchTimeoutError(f"Batch job {job.job_id} still {state.value} after {max_wait_seconds:.0f}s")
+        check_cancelled()
+        time.sleep(max(0.0, min(poll_seconds, deadline - time.monotonic())))
+
+
+def get_unit_thumbnail(output_dir: str, stage: Stage, unit_id: str) -> Optional[bytes]:
+    """
+    Thumbnail of a frame unit, the content check of its segment cache entry (see segment_cache.lookup).
+    """
+    if stage != Stage.FRAME_TRANSCRIPTS:
+        return None
+    with open(os.path.join(output_dir, 'frames', unit_id), "rb") as imagefile:
+        return segment_cache.get_frame_thumbnail(base64.b64encode(imagefile.read()).decode('utf-8'))
+
+
+def merge_batch_results(job: BatchJob, results: Dict[str, BatchResult]) -> int:
+    """
+    Record the responses of a batch in the manifests of its videos by request id, and in the segment cache.
+    Requests without a usable response are left unrecorded, the ingestion requests them interactively.
+    Token usage reported by the provider is added to the token usage report of every video.
+    The manifest and report of a video are only written holding its ingestion lease, a video another ingestion
+    holds is waited for; a video whose lease cannot be acquired keeps its units for interactive requests.
+    :return: int: number of units recorded
+    """
+    with open(os.path.join(job.job_dir, 'index.json')) as f:
+        index = json.load(f)
+    namespaces = {Stage.AUDIO_TRANSCRIPT: get_audio_namespace(), Stage.FRAME_TRANSCRIPTS: get_frame_namespace()}
+    parser = FrameJsonOutputParser()
+    # output dir -> (stage, outputs by unit id, segment cache keys by unit id, result) of every answered request
+    responses: Dict[str, List[tuple[Stage, Dict[str, object], Dict[str, str], BatchResult]]] = {}
+    merged, failed = 0, 0
+    for custom_id, entry in index.items():
+        result = results.get(custom_id)
+        if result is None or result.content is None:
+            logger.warning(f"No response to batch request {custom_id}: {result.error if result else 'missing'}")
+            failed += 1
+            continue
+        stage = Stage(entry["stage"])
+        try:
+            if stage == Stage.AUDIO_TRANSCRIPT:
+                partial = parser.parse_partial(result.content)
+                # The rest of a truncated transcript is requested interactively with the whole chunk
+                outputs = {entry["units"][0]: partial.value} if partial.complete else {}
+            elif entry["batched"]:
+                outputs = parse_batch_response(result.content, entry["units"])
+            else:
+                outputs = {entry["units"][0]: parser.parse(result.content, bypass=True)}
+        except ValueError as e:
+            logger.warning(f"Could not parse the response to batch request {custom_id}: {e}")
+            outputs = {}
+        failed += len(entry["units"]) - len(outputs)
+        responses.setdefault(entry["output_dir"], []).append((stage, outputs, entry["keys"], result))
+
+    for video in job.videos:
+        video_responses = responses.get(video["output_dir"], [])
+        if not video_responses:
+            continue
+        check_cancelled()
+        try:
+            with ingestion_lease(video["output_dir"]):
+                manifest = get_manifest(video["video_path"], video["output_dir"], video["segment_duration"],
+                                        job.consider_audio, job.consider_video, video["auto_duration"])
+                report = TokenUsageReport(video["output_dir"])
+                for stage, outputs, keys, result in video_responses:
+                    for unit_id, output in outputs.items():
+                        manifest.record_unit(stage, unit_id, output)
+                        if unit_id in keys:
+                            segment_cache.store(keys[unit_id], namespaces[stage], output,
+                                                get_unit_thumbnail(video["output_dir"], stage, unit_id))
+                    merged += len(outputs)
+                    report.record(stage.value, TokenUsage(requests=1, input_tokens=result.input_tokens,
+                                                          output_tokens=result.output_tokens))
+                report.write()
+        except LeaseTimeoutError as e:
+            logger.warning(f"Could not merge the batch results of {video['output_dir']}, its units are requested "
+                           f"interactively: {e}")
+            failed += sum(len(outputs) for _, outputs, _, _ in video_responses)
+    logger.info(f"Batch job {job.job_id}: merged {merged} units, {failed} left for interactive requests")
+    return merged
+
+
+def complete_batch_job(job: BatchJob, executor: BatchExecutor) -> Dict[str, str]:
+    """
+    Merge the results of a finished batch, then run the ingestion of every video of the job: the merged units
+    are reused from the manifests, only the combination and the requests missing from the batch are sent.
+    :return: error of every failed video keyed by output dir, empty if every video was ingested
+    """
+    if not job.completed:
+        merge_batch_results(job, executor.get_results(job.batch_id) if job.batch_id else {})
+        job.completed = True
+        job.save()
+    errors = dict(job.errors)
+    for video in job.videos:
+        check_cancelled()
+        try:
+            with ingestion_lease(video["output_dir"]):
+                # The segment duration the segments were extracted with, not the AUTO sentinel
+                generate_transcript(video["video_path"], video["output_dir"], video["segment_duration"],
+                                    job.consider_audio, job.consider_video, auto_duration=video["auto_duration"])
+        except Exception as e:
+            logger.exception(f"Ingestion of {video['video_path']} failed: {e}")
+            errors[video["output_dir"]] = str(e) or type(e).__name__
+    return errors
+
+
+def run_batch_ingestion(videos: List[tuple[str, str]], segment_duration: int, consider_audio: bool = True,
+                        consider_video: bool = True, job_id: str = None) -> tuple[BatchJob, Dict[str, str]]:
+    """
+    Ingest videos through the batch endpoint: submit their frame and audio requests, wait for the batch and
+    complete the ingestions with its results.
+    :param videos: (video path, output folder) of every video, ignored when resuming a job
+    :param segment_duration: segment duration in seconds, constants.SEGMENT_DURATION_AUTO to choose it per video
+    :param job_id: id of a submitted job to resume instead of submitting a new one
+    :return: tuple: the job, and the error of every failed video keyed by output dir
+    :raises BatchTimeoutError: if the batch is still running after BATCH_MAX_WAIT_SECONDS
+    """
+    if job_id is not None:
+        job = BatchJob.load(job_id)
+        executor = get_batch_executor(job.executor, job.model)
+        logger.info(f"Resuming batch job {job_id}")
+    else:
+        executor = get_batch_executor()
+        job = submit_batch_job(videos, segment_duration, consider_audio, consider_video, executor)
+    wait_for_batch_job(job, executor)
+    return job, complete_batch_job(job, executor)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""Command-line batch ingestion of a directory or manifest of videos."""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+# Add the parent directory to sys.path to allow imports from the root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+
+from agent.config import constants as agent_constants
+from agent.config.assistant_config import AssistantConfiguration
+from agent.config.initialize_logger import logger
+from agent.utils.rate_limiter import set_rate_limits
+from ingestion import constants
+from ingestion.batch_api import BatchJob, BatchTimeoutError, run_batch_ingestion
+from ingestion.combined_text_transcriptor import generate_transcript
+from ingestion.lease import ingestion_lease
+from ingestion.pipelined_transcriptor import generate_transcript_pipelined
+from ingestion.predictor import estimate_ingestion, record_estimate, record_wall_time
+from ingestion.video_utils import (compute_file_video_id, get_output_id, is_video_ingested,
+                                   set_max_concurrent_extractions)
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.mkv', '.avi', '.webm', '.m4v')
+
+
+@dataclass
+class IngestionResult:
+    video_path: str
+    video_id: str = ""
+    status: str = "failed"
+    video_seconds: float = 0.0
+    wall_seconds: float = 0.0
+    error: str = ""
+
+    @property
+    def speedup(self) -> float:
+        """
+        Seconds of video ingested per second of wall time.
+        """
+        return self.video_seconds / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+
+def collect_videos(inputs: List[str], manifest: Optional[str] = None, recursive: bool = False) -> List[str]:
+    """
+    List the video files of the given files and directories, and of the manifest file (one path per line,
+    blank lines and lines starting with '#' are ignored).
+    :return: list of video paths, without duplicates, in input order
+    """
+    paths = list(inputs)
+    if manifest:
+        with open(manifest) as f:
+            paths.extend(line.strip() for line in f if line.strip() and not line.strip().startswith('#'))
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                for root, _, files in sorted(os.walk(path)):
+                    videos.extend(os.path.join(root, name) for name in sorted(files)
+                                  if name.lower().endswith(VIDEO_EXTENSIONS))
+            else:
+                videos.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                              if name.lower().endswith(VIDEO_EXTENSIONS))
+        elif os.path.isfile(path):
+            videos.append(path)
+        else:
+            logger.warning(f"Skipping missing input {path}")
+    return list(dict.fromkeys(os.path.abspath(video) for video in videos))
+
+
+def get_video_duration(video_path: str) -> float:
+    """
+    Duration of a video in seconds, 0 if it cannot be read.
+    """
+    capture = cv2.VideoCapture(video_path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        frames = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+        return frames / fps if fps > 0 else 0.0
+    finally:
+        capture.release()
+
+
+def ingest_video(video_path: str, docs_dir: str, segment_duration: int, pipelined: bool,
+                 force: bool = False, consider_audio: bool = True, consider_video: bool = True) -> IngestionResult:
+    """
+    Ingest a single video into <docs_dir>/<video_id>, the same output folder the UI uses.
+    Videos already ingested are skipped unless force is set. A video being ingested by another process (or
+    the UI) is waited for, then skipped.
+    """
+    result = IngestionResult(video_path=video_path)
+    start = time.monotonic()
+    try:
+        result.video_id = compute_file_video_id(video_path)
+        output_dir = os.path.join(docs_dir, get_output_id(result.video_id, consider_audio, consider_video))
+        if not force and is_video_ingested(output_dir):
+            result.status = "skipped"
+            return result
+        waited = []
+        with ingestion_lease(output_dir, on_wait=lambda: waited.append(True)):
+            if waited and is_video_ingested(output_dir):
+                result.status = "skipped"
+                return result
+            result.video_seconds = get_video_duration(video_path)
+            logger.info(f"Ingesting {video_path} into {output_dir}")
+            if not os.path.isfile(os.path.join(output_dir, constants.ESTIMATE_FILE)):
+                record_estimate(output_dir, video_path, segment_duration, consider_audio, consider_video)
+            ingestion_start = time.monotonic()
+            if pipelined:
+                generate_transcript_pipelined(video_path, output_dir, segment_duration,
+                                              consider_audio=consider_audio, consider_video=consider_video)
+            else:
+                generate_transcript(video_path, output_dir, segment_duration, consider_audio, consider_video)
+            record_wall_time(output_dir, time.monotonic() - ingestion_start)
+        result.status = "done"
+    except Exception as e:
+        logger.exception(f"Ingestion of {video_path} failed: {e}")
+        # The last line of a multi-line error (e.g. ffmpeg output) is the most specific one
+        result.error = str(e).strip().splitlines()[-1] if str(e).strip() else type(e).__name__
+    finally:
+        result.wall_seconds = time.monotonic() - start
+    return result
+
+
+def ingest_videos_batch_api(videos: List[str], docs_dir: str, segment_duration: int, force: bool = False,
+                            consider_audio: bool = True, consider_video: bool = True,
+                            job_id: str = None) -> List[IngestionResult]:
+    """
+    Ingest the videos through the batch endpoint of the provider (see batch_api), for backfills that do not
+    need interactive latency. Videos already ingested are skipped unless force is set.
+    :param job_id: id of a submitted batch job to resume, its videos replace the given ones
+    """
+    start = time.monotonic()
+    results = {}
+    if job_id is not None:
+        job = BatchJob.load(job_id)
+        videos = [video["video_path"] for video in job.videos]
+        segment_duration, consider_audio, consider_video = job.segment_duration, job.consider_audio, job.consider_video
+    pending = []
+    for video_path in videos:
+        result = results[video_path] = IngestionResult(video_path=video_path)
+        try:
+            result.video_id = compute_file_video_id(video_path)
+            output_dir = os.path.join(docs_dir, get_output_id(result.video_id, consider_audio, consider_video))
+            # Copies of the same video share their output folder
+            if job_id is None and (not force and is_video_ingested(output_dir)
+                                   or output_dir in (pending_dir for _, pending_dir in pending)):
+                result.status = "skipped"
+                continue
+            result.video_seconds = get_video_duration(video_path)
+            pending.append((video_path, output_dir))
+        except Exception as e:
+            logger.exception(f"Ingestion of {video_path} failed: {e}")
+            result.error = str(e) or type(e).__name__
+    if pending:
+        try:
+            job, errors = run_batch_ingestion(pending, segment_duration, consider_audio, consider_video, job_id)
+        except BatchTimeoutError as e:
+            logger.warning(f"{e}, resume it with --resume-batch")
+            errors = {output_dir: str(e) for _, output_dir in pending}
+        for video_path, output_dir in pending:
+            if output_dir in errors:
+                results[video_path].error = errors[output_dir]
+            else:
+                results[video_path].status = "done"
+    # The videos of a batch complete together
+    for result in results.values():
+        if result.status == "done":
+            result.wall_seconds = time.monotonic() - start
+    return list(results.values())
+
+
+def order_longest_first(videos: List[str], segment_duration: int, consider_audio: bool = True,
+                        consider_video: bool = True) -> List[str]:
+    """
+    Order the videos by decreasing predicted ingestion time, so that the longest ones do not start last and
+    leave a single worker busy at the end of the batch.
+    """
+    def predicted_seconds(video_path: str) -> float:
+        try:
+            return estimate_ingestion(video_path, segment_duration, consider_audio, consider_video).wall_seconds
+        except Exception as e:
+            logger.warning(f"Could not predict the ingestion time of {video_path}: {e}")
+            return 0.0
+
+    predictions = {video: predicted_seconds(video) for video in videos}
+    return sorted(videos, key=predictions.get, reverse=True)
+
+
+def format_summary(results: List[IngestionResult], wall_seconds: float) -> str:
+    """
+    Summary table of the per-video throughput and failures of a batch.
+    """
+    lines = [f"{'status':<8} {'video s':>9} {'wall s':>9} {'speedup':>8}  video",
+             "-" * 80]
+    for result in results:
+        lines.append(f"{result.status:<8} {result.video_seconds:>9.1f} {result.wall_seconds:>9.1f} "
+                     f"{result.speedup:>7.2f}x  {result.video_path}")
+        if result.error:
+            lines.append(f"{'':<8} error: {result.error}")
+    done = [result for result in results if result.status == "done"]
+    video_seconds = sum(result.video_seconds for result in done)
+    lines.append("-" * 80)
+    lines.append(f"{len(done)} done, {sum(r.status == 'skipped' for r in results)} skipped, "
+                 f"{sum(r.status == 'failed' for r in results)} failed in {wall_seconds:.1f}s, "
+                 f"{video_seconds:.1f}s of video ({video_seconds / wall_seconds if wall_seconds > 0 else 0.0:.2f}x)")
+    return '\n'.join(lines)
+
+
+def write_summary_csv(results: List[IngestionResult], path: str) -> None:
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(asdict(results[0]).keys()) + ['speedup'])
+        writer.writeheader()
+        for result in results:
+            writer.writerow({**asdict(result), 'speedup': round(result.speedup, 3)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch ingestion of videos')
+    parser.add_argument('inputs', type=str, nargs='*', help='Video files or directories of videos')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='Text file listing the video paths to ingest, one per line')
+    parser.add_argument('--recursive', action='store_true', help='Search the input directories recursively')
+    parser.add_argument('--docs-dir', type=str, default=os.path.join('..', 'docs'),
+                        help='Folder the <video_id> output folders are written to (default: ../docs, as the UI)')
+    parser.add_argument('--segment-duration', type=int, default=15,
+                        help=f'Segment duration in seconds, {constants.SEGMENT_DURATION_AUTO} to choose it per video '
+                             f'(default: 15)')
+    parser.add_argument('--workers', type=int, default=2, help='Number of videos ingested in parallel (default: 2)')
+    parser.add_argument('--extraction-workers', type=int, default=constants.MAX_CONCURRENT_EXTRACTIONS,
+                        help=f'Maximum concurrent frame/audio extractions across videos '
+                             f'(default: {constants.MAX_CONCURRENT_EXTRACTIONS})')
+    parser.add_argument('--llm-concurrency', type=int, default=agent_constants.MAX_CONCURRENT_REQUESTS,
+                        help=f'Maximum concurrent LLM requests across videos, ceiling of the adaptive limit '
+                             f'(default: {agent_constants.MAX_CONCURRENT_REQUESTS})')
+    parser.add_argument('--static-concurrency', action='store_true',
+                        help='Keep --llm-concurrency requests in flight instead of adapting the limit to the '
+                             'provider 429s and latency')
+    parser.add_argument('--requests-per-minute', type=int, default=agent_constants.REQUESTS_PER_MINUTE,
+                        help=f'Maximum LLM requests started per minute across videos, 0 for no limit '
+                             f'(default: {agent_constants.REQUESTS_PER_MINUTE})')
+    ingestion_mode = parser.add_mutually_exclusive_group()
+    ingestion_mode.add_argument('--pipelined', action='store_true',
+                                help='Use the pipelined instead of the staged ingestion (see PIPELINED_INGESTION)')
+    ingestion_mode.add_argument('--staged', action='store_true',
+                                help='Use the staged ingestion even if PIPELINED_INGESTION is set')
+    parser.add_argument('--force', action='store_true', help='Ingest videos again even if already ingested')
+    modality = parser.add_mutually_exclusive_group()
+    modality.add_argument('--no-audio', action='store_true', help='Skip the audio, e.g. for silent screen recordings')
+    modality.add_argument('--no-video', action='store_true', help='Skip the frames, e.g. for podcasts')
+    parser.add_argument('--batch-api', action='store_true',
+                        help='Send the frame and audio requests to the asynchronous batch endpoint of the provider '
+                             '(cheaper, completes within 24 hours, see BATCH_EXECUTOR)')
+    parser.add_argument('--resume-batch', type=str, default=None, metavar='JOB_ID',
+                        help='Wait for and complete a submitted batch job')
+    parser.add_argument('--summary-csv', type=str, default=None, help='Also write the summary to a CSV file')
+    args = parser.parse_args()
+
+    videos = collect_videos(args.inputs, args.manifest, args.recursive)
+    if not videos and not args.resume_batch:
+        parser.print_help()
+        return 1
+
+    # Caps shared by every video of the batch
+    set_max_concurrent_extractions(args.extraction_workers)
+    set_rate_limits(AssistantConfiguration().default_llm_model, args.llm_concurrency, args.requests_per_minute,
+                    adaptive=agent_constants.ADAPTIVE_CONCURRENCY and not args.static_concurrency)
+
+    start = time.monotonic()
+    if args.batch_api or args.resume_batch:
+        results = ingest_videos_batch_api(videos, args.docs_dir, args.segment_duration, args.force,
+                                          not args.no_audio, not args.no_video, args.resume_batch)
+        print(format_summary(results, time.monotonic() - start))
+        if args.summary_csv:
+            write_summary_csv(results, args.summary_csv)
+        return 1 if any(result.status == "failed" for result in results) else 0
+
+    logger.info(f"Ingesting {len(videos)} videos with {args.workers} workers")
+    schedule = videos
+    if args.workers > 1 and len(videos) > 1:
+        schedule = order_longest_first(videos, args.segment_duration, not args.no_audio, not args.no_video)
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = [executor.submit(ingest_video, video, args.docs_dir, args.segment_duration,
+                                   (constants.PIPELINED_INGESTION or args.pipelined) and not args.staged,
+                                   args.force, not args.no_audio, not args.no_video) for video in schedule]
+        for future in as_completed(futures):
+            result = future.result()
+            logger.info(f"{result.status}: {result.video_path} ({result.wall_seconds:.1f}s)")
+            results.append(result)
+    results.sort(key=lambda result: videos.index(result.video_path))
+
+    print(format_summary(results, time.monotonic() - start))
+    if args.summary_csv:
+        write_summary_csv(results, args.summary_csv)
+    return 1 if any(result.status == "failed" for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import contextvars
 import json
 import shutil
 
@@ -9,18 +10,34 @@ from agent.config.initialize_logger import logger
 from agent.config.assistant_config import AssistantConfiguration
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List
-from ingestion import prompts
+from agent.utils.cancellation import OperationCancelledError
+from agent.utils.request_executor import invoke_llm
+from agent.utils.rate_limiter import get_rate_limiter
+from agent.utils.token_utils import TokenUsageReport, estimate_text_tokens, token_stage_config, token_usage_report
+from ingestion import constants, prompts
 from ingestion.audio_extractor import VideoAudioProcessor
 from ingestion.audio_transcript_generator import generate_audio_segment_transcript
 from ingestion.frame_extractor import FrameExtractor
 from ingestion.frame_json_parser import FrameJsonOutputParser
 from ingestion.frame_transcript_generator import generate_frame_segment_transcript
+from ingestion.manifest import IngestionManifest, Stage
+from ingestion.predictor import auto_segment_duration, probe_video
+from ingestion.segment_cache import segment_cache_stats
+from ingestion.segmenter import SegmentPlan, get_segment_plan
+from ingestion.transcript_store import TranscriptStore
+from ingestion.video_utils import extraction_slot
 
 
-def generate_transcript(video_path: str, output_dir: str, segment_duration: int) -> tuple[str, str]:
+def generate_transcript(video_path: str, output_dir: str, segment_duration: int,
+                        consider_audio: bool = True, consider_video: bool = True,
+                        auto_duration: bool = False) -> tuple[str, str]:
     """
     Generate a frame transcript based on the agent's state and configuration.
+    Every completed stage and unit is checkpointed in a manifest in output_dir, so a rerun after a
+    failure resumes from the first incomplete unit.
+    A disabled modality (consider_audio / consider_video) skips its extraction and transcription entirely.
 
     Args:
         config (RunnableConfig): The configuration for the runnable.
@@ -28,120 +45,438 @@ def generate_transcript(video_path: str, output_dir: str, segment_duration: int)
     Returns:
         :param output_dir:
         :param video_path:
-        :param segment_duration:
+        :param segment_duration: segment duration in seconds, constants.SEGMENT_DURATION_AUTO to choose it from the
+            video (see choose_segment_duration)
+        :param consider_audio:
+        :param consider_video:
+        :param auto_duration: True if segment_duration was already chosen by choose_segment_duration (e.g. by the
+            batch job that extracted the segments), so that the manifest of the auto ingestion is resumed
     """
 
     try:
+        check_modalities(consider_audio, consider_video)
         # LLM Configuration
         logger.info("---GENERATE SEGMENT TRANSCRIPT FOR INGESTION---")
         configuration = AssistantConfiguration()
         logger.info(configuration.default_llm_model['provider'])
         logger.info(configuration.default_llm_model['model_name'])
         chat_model = configuration.get_model(configuration.default_llm_model)
+        auto_duration = auto_duration or segment_duration == constants.SEGMENT_DURATION_AUTO
+        segment_duration = resolve_segment_duration(video_path, segment_duration, consider_audio, consider_video)
+        manifest = get_manifest(video_path, output_dir, segment_duration, consider_audio, consider_video, auto_duration)
+        with token_usage_report(TokenUsageReport(output_dir)), segment_cache_stats(output_dir):
+            json_str = run_stages(chat_model, video_path, output_dir, segment_duration, manifest,
+                                  consider_audio, consider_video)
+    except OperationCancelledError:
+        logger.info(f"Ingestion of {video_path} cancelled, it resumes from its manifest when rerun")
+        raise
+    except Exception as exc:
+        logger.exception(f"Exception in creating transcription of frame segments: {exc}")
+        raise
+    return json_str, output_dir
 
-        # Extract segments from the video and audio
-        extract_segments(video_path, output_dir, segment_duration)
-        segment_transcripts = {}
+
+def run_stages(chat_model, video_path: str, output_dir: str, segment_duration: int,
+               manifest: IngestionManifest, consider_audio: bool = True, consider_video: bool = True) -> str:
+    """
+    Run the extraction, transcription and combination stages not yet completed in the manifest.
+    Only the stages of the considered modalities are run.
+    :return: str: the transcript.json content
+    """
+    # Extract segments from the video and audio
+    with extraction_slot():
+        plan = extract_segments(video_path, output_dir, segment_duration, manifest, consider_audio, consider_video)
+    store = TranscriptStore(output_dir)
+    segment_transcripts = {}
+    if consider_audio:
         # Generate audio segment transcript
         audio_directory = os.path.join(output_dir, 'audio_segments')
-        audio_seg_transcripts = generate_audio_segment_transcript(audio_directory)
+        if manifest.is_stage_complete(Stage.AUDIO_TRANSCRIPT):
+            audio_units = manifest.get_units(Stage.AUDIO_TRANSCRIPT)
+            audio_seg_transcripts = [audio_units[name] for name in sorted(audio_units.keys())]
+        else:
+            audio_seg_transcripts = generate_audio_segment_transcript(audio_directory, manifest)
+            manifest.complete_stage(Stage.AUDIO_TRANSCRIPT)
         for idx, audio_seg in enumerate(audio_seg_transcripts):
             segment_id = f"{idx:03d}"
             segment_transcripts[segment_id] = {
                 "audio_transcript": audio_seg,
                 "frame_transcript": {}
             }
+            # Not complete before its frames are transcribed too
+            store.put_segment(segment_id, segment_transcripts[segment_id], *plan.get_span(idx, segment_duration),
+                              complete=not consider_video)
+        # The audio transcripts alone are enough for a first interaction while the frames are transcribed
+        publish_partial_transcript(output_dir, segment_transcripts)
+    if consider_video:
         # Generate frame segment transcript
         frame_directory = os.path.join(output_dir, "frames")
-        frame_seg_transcripts = generate_frame_segment_transcript(frame_directory)
+        if manifest.is_stage_complete(Stage.FRAME_TRANSCRIPTS):
+            frame_units = manifest.get_units(Stage.FRAME_TRANSCRIPTS)
+            frame_seg_transcripts = [{'title': name, 'explanation': frame_units[name]} for name in sorted(frame_units.keys())]
+        else:
+            frame_seg_transcripts = generate_frame_segment_transcript(frame_directory, manifest=manifest)
+            manifest.complete_stage(Stage.FRAME_TRANSCRIPTS)
         for frame_seg in frame_seg_transcripts:
             img_path = frame_seg['title']
             segment_id = img_path.split('/')[0]
-            if segment_transcripts.get(segment_id).get('frame_transcript'):
-                frame_tx = segment_transcripts[segment_id]['frame_transcript']
+            segment_data = segment_transcripts.setdefault(segment_id, {"audio_transcript": {}, "frame_transcript": {}})
+            if segment_data.get('frame_transcript'):
+                frame_tx = segment_data['frame_transcript']
                 frame_tx['title'].append(frame_seg['title'])
                 frame_tx['details'].append(frame_seg['explanation'])
             else:
-                segment_transcripts.get(segment_id)['frame_transcript'] = {'title': [frame_seg['title']],
-                                                                           'details': [frame_seg['explanation']]}
-
-        logger.info("Segment processing completed")
-
-        # Call LLM to combine audio and frame transcripts
-        transcript = llm_requests(chat_model, segment_transcripts)
-        segment_transcripts['combined_transcript'] = [transcript]
-        json_str = json.dumps(segment_transcripts)
-        with open(os.path.join(output_dir, 'transcript.json'), 'w') as f:
-            f.write(json_str)
-
-        # Clean up audio directory
-        if os.path.exists(audio_directory):
-            shutil.rmtree(audio_directory)
-            print(f"{audio_directory} directory deleted")
-        else:
-            print(f"{audio_directory} directory does not exist")
+                segment_data['frame_transcript'] = {'title': [frame_seg['title']],
+                                                    'details': [frame_seg['explanation']]}
+        for segment_id, segment_data in segment_transcripts.items():
+            store.put_segment(segment_id, segment_data, *plan.get_span(int(segment_id), segment_duration))
 
+    logger.info("Segment processing completed")
+    publish_partial_transcript(output_dir, segment_transcripts)
 
+    json_str = combine_and_write_transcript(chat_model, segment_transcripts, output_dir, manifest,
+                                            consider_audio, consider_video)
+    return json_str
+
+
+def combine_and_write_transcript(chat_model, segment_transcripts: dict, output_dir: str,
+                                 manifest: IngestionManifest, consider_audio: bool = True,
+                                 consider_video: bool = True) -> str:
+    """
+    Combine the audio and frame transcripts of every segment, write the combined document to the transcript
+    store (and transcript.json, see constants.TRANSCRIPT_JSON_EXPORT) and clean up the audio chunks.
+    The segments are expected to be in the transcript store already.
+    :param chat_model: BaseChatModel
+    :param segment_transcripts: audio and frame transcripts keyed by segment id
+    :param output_dir: Path to the output directory of the ingestion.
+    :param manifest: manifest of the ingestion
+    :param consider_audio: False if the audio was not transcribed
+    :param consider_video: False if the frames were not transcribed
+    :return: str: the transcript.json content
+    """
+    # Call LLM to combine audio and frame transcripts
+    if manifest.is_stage_complete(Stage.COMBINED):
+        transcript = manifest.get_unit(Stage.COMBINED, 'combined_transcript')
+    else:
+        transcript = llm_requests(chat_model, segment_transcripts, manifest=manifest,
+                                  consider_audio=consider_audio, consider_video=consider_video)
+        manifest.record_unit(Stage.COMBINED, 'combined_transcript', transcript)
+        manifest.complete_stage(Stage.COMBINED)
+    segment_ids = sorted(segment_transcripts.keys())
+    metadata = {
+        "partial": False,
+        "segments_completed": len(segment_ids),
+        "modalities": get_modalities(consider_audio, consider_video),
+        "segment_duration": manifest.params.get("segment_duration"),
+        "segment_duration_mode": manifest.params.get("segment_duration_mode", "manual"),
+    }
+    TranscriptStore(output_dir).put_document(transcript, metadata, segment_ids)
+    segment_transcripts['combined_transcript'] = [transcript]
+    segment_transcripts['metadata'] = metadata
+    json_str = json.dumps(segment_transcripts)
+    if constants.TRANSCRIPT_JSON_EXPORT:
+        write_transcript_json(output_dir, segment_transcripts)
+
+    # Clean up audio directory
+    audio_directory = os.path.join(output_dir, 'audio_segments')
+    if os.path.exists(audio_directory):
+        shutil.rmtree(audio_directory)
+        print(f"{audio_directory} directory deleted")
+    else:
+        print(f"{audio_directory} directory does not exist")
+    return json_str
+
+
+def write_transcript_json(output_dir: str, transcript: dict) -> str:
+    """
+    Atomically write transcript.json, readers never see a half written file.
+    :param output_dir: Path to the output directory of the ingestion.
+    :param transcript: content of transcript.json
+    :return: str: the transcript.json content
+    """
+    json_str = json.dumps(transcript)
+    file_path = os.path.join(output_dir, 'transcript.json')
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(json_str)
+    os.replace(tmp_path, file_path)
+    return json_str
+
+
+def publish_partial_transcript(output_dir: str, segment_transcripts: dict) -> None:
+    """
+    Publish the segments transcribed so far as a partial combined document of the transcript store, so that
+    the agents can be invoked before the ingestion is over. The running combined transcript is rendered from
+    the segment transcripts without any LLM call, it is replaced by the LLM combination once every segment
+    is transcribed. The partial document is flagged with metadata.partial = True.
+    :param output_dir: Path to the output directory of the ingestion.
+    :param segment_transcripts: audio and frame transcripts keyed by segment id
+    """
+    ordered_transcripts = {segment_id: segment_transcripts[segment_id] for segment_id in sorted(segment_transcripts)}
+    logger.info(f"Publishing partial transcript of {len(ordered_transcripts)} segments")
+    TranscriptStore(output_dir).put_document({"combined_transcript": render_partial_transcript(ordered_transcripts)}, {
+        "partial": True,
+        "segments_completed": len(ordered_transcripts),
+    })
+
+
+def render_partial_transcript(segment_transcripts: dict) -> str:
+    """
+    Render the audio turns and frame explanations of the segments, in segment order, as plain text.
+    """
+    lines = []
+    for segment_id, segment_data in segment_transcripts.items():
+        lines.append(f"Segment {segment_id}:")
+        audio = segment_data.get("audio_transcript") or {}
+        turns = audio.get("transcript", []) if isinstance(audio, dict) else []
+        for turn in turns:
+            if isinstance(turn, dict):
+                lines.append(f"{turn.get('speaker', 'Unknown')}: {turn.get('text', '')}")
+        for detail in (segment_data.get("frame_transcript") or {}).get("details", []):
+            lines.append(f"Visual: {detail}")
+        lines.append("")
+    return "\n".join(lines).strip()
+
+
+def get_manifest(video_path: str, output_dir: str, segment_duration: int,
+                 consider_audio: bool = True, consider_video: bool = True,
+                 auto_duration: bool = False) -> IngestionManifest:
+    """
+    Open the manifest of an ingestion, keyed on the parameters its recorded results depend on.
+    :param auto_duration: True if segment_duration was chosen by choose_segment_duration
+    """
+    params = {
+        "video_size": os.path.getsize(video_path),
+        "segment_duration": segment_duration,
+        "segmentation": constants.SEGMENTATION_MODE,
+        "modalities": get_modalities(consider_audio, consider_video),
+    }
+    if auto_duration:
+        params["segment_duration_mode"] = "auto"
+    return IngestionManifest(output_dir, params)
 
-    except Exception as exc:
-        logger.exception(f"Exception in creating transcription of frame segments: {exc}")
-        raise
-    return json_str, output_dir
+
+def choose_segment_duration(video_path: str, consider_audio: bool = True, consider_video: bool = True) -> int:
+    """
+    Segment duration of a video in auto mode: the longest duration within the per-request limits (see
+    predictor.auto_segment_duration), so that the number of requests is minimized. The content-defined
+    segmentation then aligns the segment boundaries with the scene cuts and silences of the video.
+    :return: int: segment duration in seconds
+    """
+    duration = auto_segment_duration(probe_video(video_path), consider_audio, consider_video)
+    logger.info(f"Auto segment duration of {video_path}: {duration}s")
+    return duration
+
+
+def resolve_segment_duration(video_path: str, segment_duration: int, consider_audio: bool = True,
+                             consider_video: bool = True) -> int:
+    """
+    segment_duration, or the duration chosen by choose_segment_duration for constants.SEGMENT_DURATION_AUTO.
+    """
+    if segment_duration == constants.SEGMENT_DURATION_AUTO:
+        return choose_segment_duration(video_path, consider_audio, consider_video)
+    return segment_duration
+
+
+def get_modalities(consider_audio: bool, consider_video: bool) -> List[str]:
+    """
+    Names of the considered modalities, e.g. ["audio", "video"].
+    """
+    return [name for name, considered in (("audio", consider_audio), ("video", consider_video)) if considered]
+
+
+def check_modalities(consider_audio: bool, consider_video: bool) -> None:
+    """
+    :raises ValueError: if neither the audio nor the video is considered
+    """
+    if not consider_audio and not consider_video:
+        raise ValueError("At least one of the audio and the video must be considered")
+
+
+def get_combine_prompt(consider_audio: bool = True, consider_video: bool = True) -> str:
+    """
+    Combine prompt adapted to the considered modalities.
+    """
+    if not consider_video:
+        return prompts.COMBINED_EXTRACT_PROMPT + prompts.COMBINED_AUDIO_ONLY_NOTE
+    if not consider_audio:
+        return prompts.COMBINED_EXTRACT_PROMPT + prompts.COMBINED_VIDEO_ONLY_NOTE
+    return prompts.COMBINED_EXTRACT_PROMPT
 
 
-def extract_segments(video_path: str, output_dir: str, segment_duration: int):
+def extract_segments(video_path: str, output_dir: str, segment_duration: int,
+                     manifest: IngestionManifest = None, consider_audio: bool = True,
+                     consider_video: bool = True) -> SegmentPlan:
     """
     Extract segments from the video and audio.
     :param video_path: Path to the input video file.
     :param output_dir: Path to the output directory where segments will be stored.
-    :param segment_duration: Each segment's duration in seconds(input by user).
-    :return: None
+    :param segment_duration: Each segment's duration in seconds(input by user), the target duration of
+        content-defined segments (see constants.SEGMENTATION_MODE).
+    :param manifest: Optional manifest, extraction stages already completed in it are skipped.
+    :param consider_audio: False to skip the audio extraction
+    :param consider_video: False to skip the frame extraction
+    :return: SegmentPlan: the segmentation of the video
     """
+    plan = get_segment_plan(video_path, segment_duration, manifest, consider_audio, consider_video)
     SEGMENT_DURATION_SECONDS = segment_duration
-    MAX_FRAMES_PER_SEGMENT_FOR_LLM = 10
-    SCENE_DETECTION_THRESHOLD = 27.0
+    MAX_FRAMES_PER_SEGMENT_FOR_LLM = constants.MAX_FRAMES_PER_SEGMENT
+    SCENE_DETECTION_THRESHOLD = constants.SCENE_DETECTION_THRESHOLD
     video_output_dir = os.path.join(output_dir, "frames")
     audio_output_dir = os.path.join(output_dir, "audio_segments")
-    frame_extractor = FrameExtractor(video_path=video_path, persist=True,
-                                     segment_duration_seconds=SEGMENT_DURATION_SECONDS,
-                                     max_frames_per_segment=MAX_FRAMES_PER_SEGMENT_FOR_LLM,
-                                     scene_detection_threshold=SCENE_DETECTION_THRESHOLD,
-                                     frame_path=video_output_dir)
-    segments_data = frame_extractor.extractor(mode=2)
-    aob = VideoAudioProcessor(
-        input_path=video_path,
-        output_path=audio_output_dir,
-        interval_s=segment_duration,
-        persist=True
-    )
-    audio_chunks = aob.extractor()
-
-
-def llm_requests(chat_model, segment_transcripts: dict) -> List[Dict[str, str]]:
+    if consider_video and (manifest is None or not manifest.is_stage_complete(Stage.FRAMES_EXTRACTED)):
+        frame_extractor = FrameExtractor(video_path=video_path, persist=True,
+                                         segment_duration_seconds=SEGMENT_DURATION_SECONDS,
+                                         max_frames_per_segment=MAX_FRAMES_PER_SEGMENT_FOR_LLM,
+                                         scene_detection_threshold=SCENE_DETECTION_THRESHOLD,
+                                         frame_path=video_output_dir,
+                                         segment_boundaries=plan.boundaries,
+                                         scene_frames=plan.scene_frames)
+        segments_data = frame_extractor.extractor(mode=2)
+        if manifest is not None:
+            manifest.complete_stage(Stage.FRAMES_EXTRACTED)
+    # Audio chunks are only needed until every audio chunk is transcribed
+    audio_needed = consider_audio and (manifest is None or not manifest.is_stage_complete(Stage.AUDIO_TRANSCRIPT))
+    if audio_needed and (manifest is None or not manifest.is_stage_complete(Stage.AUDIO_CHUNKED)
+                         or not os.path.isdir(audio_output_dir)):
+        aob = VideoAudioProcessor(
+            input_path=video_path,
+            output_path=audio_output_dir,
+            interval_s=segment_duration,
+            persist=True,
+            segment_times=plan.boundaries
+        )
+        audio_chunks = aob.extractor()
+        if manifest is not None:
+            manifest.complete_stage(Stage.AUDIO_CHUNKED)
+    return plan
+
+
+def llm_requests(chat_model, segment_transcripts: dict, combine_mode: str = constants.COMBINE_MODE,
+                 manifest: IngestionManifest = None, consider_audio: bool = True,
+                 consider_video: bool = True) -> List[Dict[str, str]]:
     """
     Create a list of LLM requests from the base64 encoded images.
 
+    :param chat_model: BaseChatModel
+    :param segment_transcripts: audio and frame transcripts keyed by segment id
+    :param combine_mode: "single", "map_reduce" or "auto" (see constants.COMBINE_MODE)
+    :param manifest: optional manifest, map and reduce results recorded in it are reused
+    :param consider_audio: False to leave the audio transcripts out of the requests
+    :param consider_video: False to leave the frame transcripts out of the requests
     Returns:
         List[Dict[str, str]]: A list of dictionaries containing image data for LLM requests.
     """
 
-    req_parts = [prompts.COMBINED_EXTRACT_PROMPT]
+    combine_prompt = get_combine_prompt(consider_audio, consider_video)
+    req_parts = [combine_prompt]
 
     result: dict = {}
     for segment_id, segment_data in segment_transcripts.items():
-        audio = segment_data.get("audio_transcript", {})
-        details = segment_data.get("frame_transcript", {}).get("details", [])
-        result[segment_id] = {
-            "audio_transcript": audio,
-            "frame_transcript": details
-        }
-    req_parts.append(json.dumps(result))
-
+        result[segment_id] = {}
+        if consider_audio:
+            result[segment_id]["audio_transcript"] = segment_data.get("audio_transcript", {})
+        if consider_video:
+            result[segment_id]["frame_transcript"] = segment_data.get("frame_transcript", {}).get("details", [])
+    payload = json.dumps(result)
+
+    if combine_mode == "auto":
+        combine_mode = "map_reduce" if estimate_text_tokens(payload) > constants.COMBINE_MAX_INPUT_TOKENS else "single"
+    if combine_mode == "map_reduce":
+        return map_reduce_combine(chat_model, result, manifest, combine_prompt)
+
+    req_parts.append(payload)
     req_output = get_llm_response(req_parts, chat_model)
 
     return req_output
 
 
+def group_by_token_budget(items: Dict[str, str], token_budget: int) -> List[Dict[str, str]]:
+    """
+    Split an ordered dict of serialized items into consecutive groups whose estimated tokens fit token_budget.
+    A single item larger than the budget forms a group of its own.
+    :param items: serialized items keyed by their chronological id
+    :param token_budget: maximum estimated tokens of a group
+    :return: list of groups, each an ordered dict of items
+    """
+    groups, current, current_tokens = [], {}, 0
+    for key, text in items.items():
+        tokens = estimate_text_tokens(text)
+        if current and current_tokens + tokens > token_budget:
+            groups.append(current)
+            current, current_tokens = {}, 0
+        current[key] = text
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def map_reduce_combine(chat_model, segment_payloads: dict, manifest: IngestionManifest = None,
+                       combine_prompt: str = prompts.COMBINED_EXTRACT_PROMPT) -> Dict[str, str]:
+    """
+    Combine the segment transcripts hierarchically: groups of consecutive segments are combined in parallel (map),
+    then the partial transcripts are merged in a tree until a single transcript is left (reduce).
+    The fan-in of each reduce level is chosen so that a reduce request fits constants.COMBINE_GROUP_TOKEN_BUDGET.
+    :param chat_model: BaseChatModel
+    :param segment_payloads: audio and frame transcripts keyed by segment id
+    :param manifest: optional manifest, map and reduce results recorded in it are reused
+    :param combine_prompt: prompt of the map requests (see get_combine_prompt)
+    :return: Dict[str, str]: the combined transcript, in the same schema as the single request combination
+    """
+    rate_limiter = get_rate_limiter(AssistantConfiguration().default_llm_model)
+
+    def combine(unit_id: str, prompt: str, group: Dict[str, str]) -> str:
+        if manifest is not None and manifest.has_unit(Stage.COMBINED, unit_id):
+            return manifest.get_unit(Stage.COMBINED, unit_id)
+        logger.info(f"Combining {unit_id}")
+        payload = '{' + ', '.join(f'{json.dumps(key)}: {text}' for key, text in group.items()) + '}'
+        output = get_combined_text(get_llm_response([prompt, payload], chat_model)["combined_transcript"])
+        if manifest is not None:
+            manifest.record_unit(Stage.COMBINED, unit_id, output)
+        return output
+
+    def run_level(prompt: str, groups: List[Dict[str, str]], level: str) -> List[str]:
+        with ThreadPoolExecutor(max_workers=rate_limiter.max_concurrency) as executor:
+            # Each request runs in a copy of the caller context to be accounted in its token usage report
+            futures = [executor.submit(contextvars.copy_context().run, combine, f"{level}:{min(group)}-{max(group)}", prompt, group) for group in groups]
+            return [future.result() for future in futures]
+
+    # Map: combine groups of consecutive segments
+    segment_texts = {segment_id: json.dumps(data) for segment_id, data in segment_payloads.items()}
+    groups = group_by_token_budget(segment_texts, constants.COMBINE_GROUP_TOKEN_BUDGET)
+    logger.info(f"Combining {len(segment_texts)} segments in {len(groups)} map requests")
+    partials = run_level(combine_prompt, groups, "map")
+
+    # Reduce: merge the partial transcripts in a tree
+    level = 0
+    while len(partials) > 1:
+        partial_texts = {f"{idx:03d}": json.dumps(text) for idx, text in enumerate(partials)}
+        avg_tokens = sum(estimate_text_tokens(text) for text in partial_texts.values()) / len(partial_texts)
+        fan_in = max(2, int(constants.COMBINE_GROUP_TOKEN_BUDGET // avg_tokens))
+        groups = [dict(list(partial_texts.items())[i:i + fan_in]) for i in range(0, len(partial_texts), fan_in)]
+        logger.info(f"Reducing {len(partials)} partial transcripts with a fan-in of {fan_in}")
+        partials = run_level(prompts.COMBINED_REDUCE_PROMPT, groups, f"reduce{level}")
+        level += 1
+
+    return {
+        "combined_transcript": partials[0] if partials else ""
+    }
+
+
+def get_combined_text(content: str) -> str:
+    """
+    Extract the combined transcript text from a combine response, falling back to the raw response.
+    """
+    try:
+        parsed_output = FrameJsonOutputParser().parse(content)
+        if isinstance(parsed_output, dict) and isinstance(parsed_output.get("combined_transcript"), str):
+            return parsed_output["combined_transcript"]
+    except ValueError:
+        logger.debug("Combine response is not valid JSON, keeping the raw response")
+    return content
+
+
 def get_llm_response(req_parts, chat_model: BaseChatModel) -> list[dict]:
     """
       Generate a response from the LLM based on the provided request parts.
@@ -158,7 +493,7 @@ def get_llm_response(req_parts, chat_model: BaseChatModel) -> list[dict]:
         ('human',
          req_parts[1])
         ]
-    transcript = chat_model.invoke(messages)
+    transcript = invoke_llm(chat_model, messages, config=token_stage_config(Stage.COMBINED.value))
     # parser = FrameJsonOutputParser()
     # parsed_output = parser.parse(transcript.content)
 
@@ -169,14 +504,20 @@ def get_llm_response(req_parts, chat_model: BaseChatModel) -> list[dict]:
 
 # ============ Test Code ===============
 
-def create_ingestion_data(video_path, output_dir: str, segment_duration_seconds: int = 15) -> tuple[str, str]:
+def create_ingestion_data(video_path, output_dir: str, segment_duration_seconds: int = 15,
+                          pipelined: bool = constants.PIPELINED_INGESTION, consider_audio: bool = True,
+                          consider_video: bool = True) -> tuple[str, str]:
     try:
         if os.path.isfile(video_path):
             print(f"{video_path} exists")
         else:
             print(f"{video_path} does not exist")
 
-        return generate_transcript(video_path, output_dir, segment_duration_seconds)
+        if pipelined:
+            from ingestion.pipelined_transcriptor import generate_transcript_pipelined
+            return generate_transcript_pipelined(video_path, output_dir, segment_duration_seconds,
+                                                 consider_audio=consider_audio, consider_video=consider_video)
+        return generate_transcript(video_path, output_dir, segment_duration_seconds, consider_audio, consider_video)
     except Exception as e:
         logger.exception(e)
         return '', ''
@@ -3,6 +3,7 @@ import json
 from langchain_core.language_models import BaseChatModel
 from agent.config.initialize_logger import logger
 from agent.config.assistant_config import AssistantConfiguration
+from agent.utils.request_executor import invoke_llm
 from langchain_core.messages import HumanMessage
 
 import os
@@ -70,13 +71,13 @@ def get_llm_response(req_parts, chat_model: BaseChatModel) -> list[dict]:
         HumanMessage(content=req_parts)
     ]
     # Generate the frame transcript
-    transcript = chat_model.invoke(messages)
+    transcript = invoke_llm(chat_model, messages)
     # logger.debug(f"Generated audio transcript: {audio_transcript.content}")
     # print(f"Generated audio transcript: {audio_transcript.content}")
     # Use the parser
     parser = FrameJsonOutputParser()
 
-    parsed_output = parser.parse(transcript.content)
+    parsed_output = parser.parse(transcript.content, salvage=True)
 
     # Access example
     logger.info("Parsed Output: ", parsed_output)
@@ -1,4 +1,126 @@
+import os
+
 MAX_PAYLOAD_MB = 10
 MAX_PAYLOAD_BYTES = MAX_PAYLOAD_MB * 1024 * 1024
 FRAME_PATH= "./docs/frames"
-# AUDIO_SEGMENTS_PATH = "./docs/audio_segments"
\ No newline at end of file
+# AUDIO_SEGMENTS_PATH = "./docs/audio_segments"
+# Segment transcripts of a transcriptor ingestion in progress, transcript.json is only written once every segment
+# is transcribed
+PARTIAL_TRANSCRIPT_FILE = 'transcript.partial.json'
+
+# Number of frames of the same segment packed into a single frame transcript request (1 disables batching)
+FRAME_BATCH_SIZE = int(os.getenv('FRAME_BATCH_SIZE', 1))
+# Estimated image tokens allowed in a single batched frame transcript request
+FRAME_BATCH_TOKEN_BUDGET = int(os.getenv('FRAME_BATCH_TOKEN_BUDGET', 16000))
+
+# Combination of the segment transcripts: "single" request, hierarchical "map_reduce", or "auto"
+# (map_reduce only when the single request would exceed COMBINE_MAX_INPUT_TOKENS)
+COMBINE_MODE = os.getenv('COMBINE_MODE', 'auto')
+COMBINE_MAX_INPUT_TOKENS = int(os.getenv('COMBINE_MAX_INPUT_TOKENS', 32000))
+# Estimated input tokens of a single map or reduce request of the map_reduce combination
+COMBINE_GROUP_TOKEN_BUDGET = int(os.getenv('COMBINE_GROUP_TOKEN_BUDGET', 16000))
+
+# Frame extraction of the combined transcriptor
+MAX_FRAMES_PER_SEGMENT = 10
+SCENE_DETECTION_THRESHOLD = 27.0
+
+# Pipelined ingestion (opt-in): transcription of extracted segments overlaps with the extraction of the next ones
+PIPELINED_INGESTION = os.getenv('PIPELINED_INGESTION', 'false').lower() in ('1', 'true', 'yes')
+# Maximum number of extracted segments waiting for transcription, bounds how far extraction runs ahead
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 4))
+
+# Progressive transcript availability: a partial transcript.json is published every N transcribed segments
+PARTIAL_TRANSCRIPT_EVERY = int(os.getenv('PARTIAL_TRANSCRIPT_EVERY', 2))
+
+# Maximum number of frame/audio extractions running at the same time in the process (CPU bound)
+MAX_CONCURRENT_EXTRACTIONS = int(os.getenv('MAX_CONCURRENT_EXTRACTIONS', os.cpu_count() or 1))
+# Size of the chunks read when hashing a video file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Cross-video cache (opt-in) of frame and audio chunk transcripts, keyed by frame phash and audio fingerprint
+SEGMENT_CACHE_ENABLED = os.getenv('SEGMENT_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+SEGMENT_CACHE_PATH = os.getenv('SEGMENT_CACHE_PATH', os.path.join('..', 'docs', 'segment_cache.sqlite'))
+# Name of the per-ingestion hit rate report written in the output folder
+SEGMENT_CACHE_STATS_FILE = 'segment_cache_stats.json'
+# Side of the perceptual hash of a frame (hash of FRAME_PHASH_SIZE^2 bits)
+FRAME_PHASH_SIZE = 16
+# Frames sharing a perceptual hash only reuse a transcript if their grayscale thumbnails (width, height) differ by
+# at most FRAME_MAX_BLOCK_DIFF gray levels on average over every FRAME_DIFF_BLOCK_SIZE pixels square: re-encoding
+# stays well below it, a changed word or figure on a slide does not
+FRAME_THUMBNAIL_SIZE = (128, 72)
+FRAME_DIFF_BLOCK_SIZE = 4
+FRAME_MAX_BLOCK_DIFF = float(os.getenv('FRAME_MAX_BLOCK_DIFF', 6))
+# Audio fingerprint: loudness window and number of quantization levels
+AUDIO_FINGERPRINT_WINDOW_MS = 100
+AUDIO_FINGERPRINT_LEVELS = 16
+
+# Segmentation: "fixed" duration windows, or opt-in "content" defined boundaries anchored to scene cuts and
+# silences, so that an edited video shares most of its segments with the original
+SEGMENTATION_MODE = os.getenv('SEGMENTATION_MODE', 'fixed')
+# Content-defined segments last between SEGMENT_MIN_FACTOR and SEGMENT_MAX_FACTOR times the segment duration
+SEGMENT_MIN_FACTOR = 0.5
+SEGMENT_MAX_FACTOR = 2.0
+# Segment duration choosing the duration of every video from its content and the per-request limits
+SEGMENT_DURATION_AUTO = 0
+# Bounds of the automatically chosen segment duration in seconds
+AUTO_SEGMENT_MIN_SECONDS = int(os.getenv('AUTO_SEGMENT_MIN_SECONDS', 15))
+AUTO_SEGMENT_MAX_SECONDS = int(os.getenv('AUTO_SEGMENT_MAX_SECONDS', 300))
+# Candidate cuts before the segment duration are kept when their content hash is a multiple of this divisor
+SEGMENT_BOUNDARY_DIVISOR = 2
+# Loudness envelope used to find silences and hash candidate cuts
+SEGMENT_ENVELOPE_SAMPLE_RATE = 8000
+SEGMENT_ENVELOPE_WINDOW_MS = 100
+# Windows of decoded audio read at a time while computing the envelope (one minute)
+SEGMENT_ENVELOPE_CHUNK_WINDOWS = 600
+SEGMENT_HASH_WINDOW_MS = 1000
+# Scene cuts following a candidate cut hashed instead of its loudness when the audio is missing or flat
+SEGMENT_HASH_SCENES = 3
+SILENCE_THRESHOLD_DB = float(os.getenv('SILENCE_THRESHOLD_DB', -40))
+SILENCE_MIN_MS = 300
+
+# The transcript store (transcript.sqlite) is the source of truth, transcript.json is also written at the end of
+# an ingestion for the tools reading it
+TRANSCRIPT_JSON_EXPORT = os.getenv('TRANSCRIPT_JSON_EXPORT', 'true').lower() in ('1', 'true', 'yes')
+
+# Per-video ingestion lease: a lease without heartbeat for LEASE_TTL_SECONDS is stale and taken over
+LEASE_TTL_SECONDS = int(os.getenv('LEASE_TTL_SECONDS', 60))
+LEASE_HEARTBEAT_SECONDS = int(os.getenv('LEASE_HEARTBEAT_SECONDS', 10))
+LEASE_POLL_SECONDS = 2
+# Maximum time a second requester of a video waits for the running ingestion of that video
+LEASE_WAIT_TIMEOUT_SECONDS = int(os.getenv('LEASE_WAIT_TIMEOUT_SECONDS', 4 * 3600))
+
+# Background ingestion jobs of the UI: persistent job table and size of the worker pool shared by all sessions
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', os.path.join('..', 'docs', 'jobs.sqlite'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+# Seconds between two refreshes of the job progress in the UI
+JOB_POLL_SECONDS = 2
+# A job whose sessions all stopped polling its progress for this many seconds (closed tabs) is cancelled
+JOB_ABANDON_SECONDS = int(os.getenv('JOB_ABANDON_SECONDS', 60))
+
+# Ingestion time and cost predictor: low resolution frames sampled to measure the scene density of a video, and
+# mean absolute gray level difference between two samples counted as a visual change / a hard cut
+PREDICTOR_PROBE_SAMPLES = 60
+PREDICTOR_CHANGE_THRESHOLD = 6.0
+PREDICTOR_CUT_THRESHOLD = 30.0
+# Priors of the raw estimate, corrected by the calibration on past runs
+PREDICTOR_OUTPUT_TOKENS_PER_FRAME = 60
+PREDICTOR_OUTPUT_TOKENS_PER_AUDIO_SECOND = 4
+PREDICTOR_OUTPUT_TOKENS_PER_COMBINE = 1000
+PREDICTOR_REQUEST_SECONDS = 4.0
+PREDICTOR_EXTRACTION_SECONDS_PER_SECOND = 0.1
+# Calibration on the last N completed ingestions of the docs folder, each recording its raw estimate in ESTIMATE_FILE
+PREDICTOR_CALIBRATION_RUNS = 20
+PREDICTOR_DOCS_DIR = os.getenv('PREDICTOR_DOCS_DIR', os.path.join('..', 'docs'))
+ESTIMATE_FILE = 'ingestion_estimate.json'
+# Price of the model in the currency of your choice, 0 leaves the cost out of the estimates
+PRICE_PER_MILLION_INPUT_TOKENS = float(os.getenv('PRICE_PER_MILLION_INPUT_TOKENS', 0))
+PRICE_PER_MILLION_OUTPUT_TOKENS = float(os.getenv('PRICE_PER_MILLION_OUTPUT_TOKENS', 0))
+
+# Batch API ingestion of backfills: frame and audio requests are sent to the asynchronous batch endpoint of the
+# provider ("provider"), or run by the filesystem-backed stand-in executor ("local", e.g. offline)
+BATCH_EXECUTOR = os.getenv('BATCH_EXECUTOR', 'provider')
+# Folder of the batch jobs (job file, request index, state) and of the local executor batches
+BATCH_DIR = os.getenv('BATCH_DIR', os.path.join('..', 'docs', 'batches'))
+BATCH_POLL_SECONDS = float(os.getenv('BATCH_POLL_SECONDS', 60))
+# Providers complete a batch within 24 hours, a batch still running after this wait is left for a later resume
+BATCH_MAX_WAIT_SECONDS = float(os.getenv('BATCH_MAX_WAIT_SECONDS', 25 * 3600))
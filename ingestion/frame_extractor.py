@@ -4,11 +4,13 @@ import base64
 import io
 import imagehash
 
-from scenedetect import SceneManager, open_video
+from scenedetect import SceneManager
 from scenedetect.detectors import ContentDetector
-from typing import List
+from typing import Iterator, List
 from PIL import Image
 from agent.config.initialize_logger import logger
+from agent.utils.cancellation import CancellationToken, OperationCancelledError, get_cancellation_token
+from ingestion.segmenter import detect_scenes
 
 
 def is_hash_unique(seen_hashes, new_hash, tolerance=5) -> bool:
@@ -24,9 +26,16 @@ def is_hash_unique(seen_hashes, new_hash, tolerance=5) -> bool:
 class FrameExtractor:
     def __init__(self, video_path: str, frame_interval: int = 25, persist: bool = False,
                  segment_duration_seconds: int = 15, max_frames_per_segment: int = 10,
-                 scene_detection_threshold: float = 27.0, frame_path: str = "../docs/frames"):
+                 scene_detection_threshold: float = 27.0, frame_path: str = "../docs/frames",
+                 segment_boundaries: List[float] = None, scene_frames: List[List[int]] = None,
+                 cancellation_token: CancellationToken = None):
         """
         Initializes the FrameExtractor.
+        :param segment_boundaries: Optional start time in seconds of every segment but the first, replacing the
+            fixed segment_duration_seconds windows (see segmenter.SegmentPlan).
+        :param scene_frames: Optional (start frame, end frame) of the scenes already detected in the video.
+        :param cancellation_token: Optional token stopping the extraction between two frames, the token of the
+            current context by default. Segments already yielded (and persisted) are kept.
         """
         self.video_path = video_path
         self.frame_interval = frame_interval
@@ -34,6 +43,9 @@ class FrameExtractor:
         self.segment_duration_seconds = segment_duration_seconds
         self.max_frames_per_segment = max_frames_per_segment
         self.scene_detection_threshold = scene_detection_threshold
+        self.segment_boundaries = segment_boundaries
+        self.scene_frames = scene_frames
+        self.cancellation_token = cancellation_token or get_cancellation_token()
         if self.persist:
             self.frame_path = frame_path
             if not os.path.exists(self.frame_path):
@@ -84,6 +96,7 @@ class FrameExtractor:
         frame_index, seen_hashes, base64Frames, frame_paths = 0, set(), [], []
         try:
             while video.isOpened():
+                self.check_cancelled()
                 ret, frame = video.read()
                 if not ret:
                     break
@@ -111,10 +124,19 @@ class FrameExtractor:
             logger.error(f"Error during nth frame extraction: {e}")
             raise
 
+    def check_cancelled(self) -> None:
+        """
+        Cancellation point of the extraction.
+        :raises OperationCancelledError: if the cancellation token is cancelled
+        """
+        if self.cancellation_token is not None:
+            self.cancellation_token.raise_if_cancelled()
+
     def extract_frame_and_hash(self, frame_number: int) -> tuple[str, imagehash.ImageHash] | tuple[None, None]:
         """
         Extracts a specific frame and returns its base64 encoded JPEG and perceptual hash.
         """
+        self.check_cancelled()
         cap = cv2.VideoCapture(self.video_path)
         if not cap.isOpened():
             logger.debug(f"Error: Could not open video file {self.video_path}")
@@ -137,13 +159,37 @@ class FrameExtractor:
         Processes the video in fixed-duration segments, performs scene detection,
         and extracts representative frames ensuring unique frames even across sampling strategies.
         """
-        frame_paths = []
+        processed_segments_data, frame_paths = [], []
+        for segment_idx, segment_frames in self.iter_segmented_frames(video):
+            for frame_base64, frame_file in segment_frames:
+                processed_segments_data.append(frame_base64)
+                if frame_file:
+                    frame_paths.append(frame_file)
+        return processed_segments_data, frame_paths
+
+    def iter_segmented_frames(self, video: cv2.VideoCapture = None) -> Iterator[tuple[int, List[tuple[str, str | None]]]]:
+        """
+        Same as get_segmented_frames, but yields the frames of each segment as soon as the segment is processed
+        (and persisted), so that consumers can start working on a segment while the next ones are extracted.
+        :param video: Opened video capture, the video is opened from video_path if not given.
+        :return: Iterator of (segment index, list of (base64 encoded frame, persisted frame path or None)).
+        """
+        if video is None:
+            video = cv2.VideoCapture(self.video_path)
+            if not video.isOpened():
+                raise FileNotFoundError(f"Could not open video file: {self.video_path}")
         fps = video.get(cv2.CAP_PROP_FPS)
         total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
         video.release()
 
         segment_frame_length = int(fps * self.segment_duration_seconds)
-        total_segments = (total_frames + segment_frame_length - 1) // segment_frame_length
+        if self.segment_boundaries is not None:
+            segment_starts = [0] + [int(round(boundary * fps)) for boundary in self.segment_boundaries]
+            segment_starts = [start for start in segment_starts if start < total_frames]
+        else:
+            segment_starts = list(range(0, total_frames, segment_frame_length))
+        segment_ranges = [(start, end - 1) for start, end in zip(segment_starts, segment_starts[1:] + [total_frames])]
+        total_segments = len(segment_ranges)
 
         logger.debug(f"\n--- Video Segmentation Details ---")
         logger.debug(f"Video FPS: {fps:.2f}, Total Frames: {total_frames}")
@@ -153,27 +199,28 @@ class FrameExtractor:
         logger.debug(f"Scene Detection Threshold: {self.scene_detection_threshold}")
         logger.debug(f"----------------------------------")
 
-        processed_segments_data = []
-
         # Global scene detection
         all_scene_frames = []
-        try:
-            scene_manager = SceneManager()
-            scene_manager.add_detector(ContentDetector(threshold=self.scene_detection_threshold))
-            logger.debug("\nPerforming global scene detection...")
-            video_stream = open_video(self.video_path)
-            scene_manager.detect_scenes(video=video_stream)
-            all_scenes = scene_manager.get_scene_list(start_in_scene=True)
-            logger.debug(f"Global scene detection completed. Total scenes detected: {len(all_scenes)}")
-            all_scene_frames = [(s[0].get_frames(), s[1].get_frames()) for s in all_scenes]
-        except Exception as e:
-            logger.error(
-                f"Warning: Error during global scene detection. Falling back to uniform sampling for all segments: {e}")
-            all_scene_frames = []
+        if self.scene_frames is not None:
+            all_scene_frames = [tuple(scene) for scene in self.scene_frames]
+        else:
+            try:
+                scene_manager = SceneManager()
+                scene_manager.add_detector(ContentDetector(threshold=self.scene_detection_threshold))
+                logger.debug("\nPerforming global scene detection...")
+                detect_scenes(scene_manager, self.video_path)
+                all_scenes = scene_manager.get_scene_list(start_in_scene=True)
+                logger.debug(f"Global scene detection completed. Total scenes detected: {len(all_scenes)}")
+                all_scene_frames = [(s[0].get_frames(), s[1].get_frames()) for s in all_scenes]
+            except OperationCancelledError:
+                raise
+            except Exception as e:
+                logger.error(
+                    f"Warning: Error during global scene detection. Falling back to uniform sampling for all segments: {e}")
+                all_scene_frames = []
 
         seen_hashes = set()
-        for segment_idx, start_frame_idx in enumerate(range(0, total_frames, segment_frame_length)):
-            end_frame_idx = min(start_frame_idx + segment_frame_length - 1, total_frames - 1)
+        for segment_idx, (start_frame_idx, end_frame_idx) in enumerate(segment_ranges):
             logger.debug(
                 f"\n--- Processing Segment {segment_idx + 1}/{total_segments} (Frames {start_frame_idx} to {end_frame_idx}) ---")
 
@@ -228,17 +275,17 @@ class FrameExtractor:
 
             logger.debug(
                 f"  **Final unique frames for Segment {segment_idx + 1}: {sorted([frame_num for (frame_num, _) in selected_frames])}**")
+            segment_frames = []
             for frame_num, frame_base64 in selected_frames:
-                processed_segments_data.append(frame_base64)
+                frame_file = None
                 if self.persist:
                     frame_folder = os.path.join(self.frame_path,f"{segment_idx:03d}")
                     frame_file = os.path.join(frame_folder ,f"segment_{segment_idx}_frame_{frame_num}.jpg")
                     os.makedirs(os.path.dirname(frame_file), exist_ok=True)
                     with open(frame_file, "wb") as f:
                         f.write(base64.b64decode(frame_base64))
-                    frame_paths.append(frame_file)
-
-        return processed_segments_data, frame_paths
+                segment_frames.append((frame_base64, frame_file))
+            yield segment_idx, segment_frames
 
 # ===== TEST CODE =====
 # if __name__ == "__main__":
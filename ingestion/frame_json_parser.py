@@ -1,42 +1,250 @@
 import json
 import re
+from dataclasses import dataclass, field
 
-from typing import List, Dict
+from typing import Any, List, Dict, Optional
 from langchain_core.output_parsers import BaseOutputParser
 
 from agent.config.initialize_logger import logger
 
+# Patterns are compiled once, parse is called for every LLM response
+_JSON_FENCE_START = re.compile(r"^```json\s*")
+_FENCE_START = re.compile(r"^```")
+_ESCAPED_UNDERSCORE = re.compile(r'\\_')
+# A backslash and the character it escapes, matched as a pair so that an escaped backslash is never re-escaped
+_ESCAPE = re.compile(r'\\(["\\/bfnrtu]?)')
+_TRAILING_COMMA = re.compile(r",\s*(?=[\]\}])")
+# Characters that change the state of the JSON scanner, everything else is skipped
+_STRUCTURAL_CHAR = re.compile(r'[\\"\[\]{},]')
 
-class FrameJsonOutputParser(BaseOutputParser):
+_CLOSERS = {'[': ']', '{': '}'}
+
+
+def _fix_escape(match: re.Match) -> str:
     """
-    Parses JSON output from LLM after removing markdown code fences or leading 'json' tags.
+    Keeps a valid escape, escapes the backslash of an invalid one.
+    """
+    return match.group() if match.group(1) else '\\\\'
+
+
+def clean_json_text(text: str) -> str:
+    """
+    Remove markdown code fences and fix the escapes and trailing commas LLMs commonly produce.
+    """
+    cleaned_text = text.strip()
+    if cleaned_text.startswith("```json"):
+        cleaned_text = _JSON_FENCE_START.sub("", cleaned_text)
+    if cleaned_text.startswith("```"):
+        cleaned_text = _FENCE_START.sub("", cleaned_text)
+    if cleaned_text.endswith("```"):
+        cleaned_text = cleaned_text[:-3].strip()
+    cleaned_text = _ESCAPED_UNDERSCORE.sub('_', cleaned_text)
+    cleaned_text = _ESCAPE.sub(_fix_escape, cleaned_text)
+    # remove only commas immediately before a closing ] or }
+    return _TRAILING_COMMA.sub("", cleaned_text)
+
+
+@dataclass
+class PartialJson:
+    """
+    Result of parsing a possibly truncated or broken JSON output.
+    """
+    value: Any
+    """ The parsed value, or what could be recovered of it """
+    complete: bool
+    """ True when the output was valid JSON and nothing is missing """
+    dropped: List[str] = field(default_factory=list)
+    """ Raw text of the top-level items that could not be recovered (a truncated tail or a broken item) """
+
+
+class IncrementalJsonParser:
     """
+    Incremental JSON parser for streamed LLM outputs.
+    Chunks are scanned once as they are fed, and every top-level item (array element or object member)
+    is parsed as soon as it is complete. Text before the first bracket (e.g. a code fence) and after the
+    end of the top-level value is ignored.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.done = False
+        self._pos = 0
+        self._start = None
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape_at = -1
+        self._item_start = None
+        self._item_spans: List[tuple[int, int]] = []
+        # Last offset where the output can be cut and closed with _cut_stack into a valid value made of
+        # complete items only (members of the top-level object, elements of arrays not nested in an item object)
+        self._cut = None
+        self._cut_stack: List[str] = []
+
+    def feed(self, chunk: str) -> List[Any]:
+        """
+        Consume the next chunk of the output.
+        :param chunk: next chunk of text
+        :return: top-level items completed by this chunk (array elements, or {key: value} for object members)
+        """
+        start = len(self.buffer)
+        self.buffer += chunk
+        if self.done:
+            return []
+        if self._start is None:
+            for idx in range(start, len(self.buffer)):
+                if self.buffer[idx] in _CLOSERS:
+                    self._start = idx
+                    break
+            else:
+                return []
+            self._pos = self._start
+        completed = []
+        for match in _STRUCTURAL_CHAR.finditer(self.buffer, self._pos):
+            idx = match.start()
+            char = match.group()
+            if self._in_string:
+                if idx == self._escape_at:
+                    continue
+                if char == '\\':
+                    self._escape_at = idx + 1
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+                if len(self._stack) == 1 and self._item_start is None:
+                    self._item_start = idx
+            elif char in _CLOSERS:
+                if len(self._stack) == 1 and self._item_start is None:
+                    self._item_start = idx
+                self._stack.append(char)
+            elif char in (']', '}'):
+                if len(self._stack) == 1:
+                    completed.extend(self._end_item(idx))
+                self._stack.pop()
+                if self._stack and self._stack[-1] == '[':
+                    self._set_cut(idx + 1)
+                if not self._stack:
+                    self.done = True
+                    self._pos = idx + 1
+                    return completed
+            elif char == ',':
+                if len(self._stack) == 1:
+                    completed.extend(self._end_item(idx))
+                elif self._stack[-1] == '[':
+                    self._set_cut(idx)
+        self._pos = len(self.buffer)
+        return completed
+
+    def _set_cut(self, idx: int) -> None:
+        if '{' in self._stack[1:]:
+            # Cutting inside a nested object would keep a partial item
+            return
+        self._cut = idx
+        self._cut_stack = list(self._stack)
 
-    def parse(self, text: str, bypass: bool = False) -> List[Dict] | str:
-        # Remove triple backtick blocks or leading 'json'
-        cleaned_text = text.strip()
+    def _end_item(self, idx: int) -> List[Any]:
+        """
+        Close the top-level item ending at idx, returns it parsed (or nothing if it is empty or broken).
+        """
+        item_start = self._item_start
+        if item_start is None:
+            # Item made of a bare literal (number, true, ...) without structural characters
+            previous_end = self._item_spans[-1][1] + 1 if self._item_spans else self._start + 1
+            item_start = previous_end
+        self._item_start = None
+        if not self.buffer[item_start:idx].strip():
+            return []
+        self._item_spans.append((item_start, idx))
+        self._set_cut(idx)
+        item = self._parse_item(item_start, idx)
+        return [] if item is None else [item]
 
-        # Remove markdown-style ```json ... ``` wrapping
-        if cleaned_text.startswith("```json"):
-            cleaned_text = re.sub(r"^```json\s*", "", cleaned_text)
-        if cleaned_text.startswith("```"):
-            cleaned_text = re.sub(r"^```", "", cleaned_text)
-        if cleaned_text.endswith("```"):
-            cleaned_text = cleaned_text[:-3].strip()
-        cleaned_text = re.sub(r'\\_', '_', cleaned_text)
+    def _parse_item(self, item_start: int, item_end: int) -> Optional[Any]:
+        text = clean_json_text(self.buffer[item_start:item_end])
+        if self.buffer[self._start] == '{':
+            text = '{' + text + '}'
         try:
-            cleaned_text = re.sub(r'\\(?!["\\/bfnrtu])', r'\\\\', cleaned_text)
-            # remove only commas immediately before a closing ] or }
-            cleaned_text = re.sub(r",\s*(?=[\]\}])", "", cleaned_text)
-
-            if bypass:
-                return cleaned_text
-        except re.error as e:
-            logger.error(f"Regex error while cleaning text: {e}")
-        parsed = {}
+            return json.loads(text)
+        except json.JSONDecodeError:
+            logger.debug(f"Skipping broken JSON item: {text[:200]}")
+            return None
+
+    def result(self) -> PartialJson:
+        """
+        Parse everything fed so far. A complete output is parsed as a whole, otherwise the complete items
+        are salvaged and the text of the missing ones is reported.
+        :raises ValueError: if no JSON value could be recovered
+        """
+        if self._start is None:
+            raise ValueError(f"No JSON value found in output:\n{self.buffer[:500]}")
+        end = self._pos if self.done else len(self.buffer)
+        text = self.buffer[self._start:end]
+        try:
+            return PartialJson(json.loads(clean_json_text(text)), complete=self.done)
+        except json.JSONDecodeError:
+            pass
+
+        # Truncated output: cut after the last complete item and close the open brackets
+        if self._cut is not None:
+            closers = ''.join(_CLOSERS[opener] for opener in reversed(self._cut_stack))
+            try:
+                value = json.loads(clean_json_text(self.buffer[self._start:self._cut] + closers))
+                dropped = self.buffer[self._cut:end].strip(' \n\t,]}')
+                return PartialJson(value, complete=False, dropped=[dropped] if dropped else [])
+            except json.JSONDecodeError:
+                pass
+
+        # Broken output: keep the top-level items that parse on their own
+        is_object = self.buffer[self._start] == '{'
+        value = {} if is_object else []
+        dropped = []
+        spans = list(self._item_spans)
+        last_end = spans[-1][1] + 1 if spans else self._start + 1
+        if self.buffer[last_end:end].strip(' \n\t]}'):
+            spans.append((last_end, end))
+        for item_start, item_end in spans:
+            item = self._parse_item(item_start, item_end)
+            if item is None:
+                dropped.append(self.buffer[item_start:item_end].strip())
+            elif is_object:
+                value.update(item)
+            else:
+                value.append(item)
+        if not value:
+            raise ValueError(f"Failed to salvage JSON output:\n{text[:500]}")
+        return PartialJson(value, complete=False, dropped=dropped)
+
+
+class FrameJsonOutputParser(BaseOutputParser):
+    """
+    Parses JSON output from LLM after removing markdown code fences or leading 'json' tags.
+    """
+
+    def parse(self, text: str, bypass: bool = False, salvage: bool = False) -> List[Dict] | str:
+        """
+        :param text: LLM output
+        :param bypass: return the cleaned text without parsing it
+        :param salvage: recover the complete items of a truncated or broken output instead of raising
+        """
+        cleaned_text = clean_json_text(text)
+        if bypass:
+            return cleaned_text
         try:
-            parsed = json.loads(cleaned_text)
+            return json.loads(cleaned_text)
         except json.JSONDecodeError as e:
+            if salvage:
+                partial = self.parse_partial(text)
+                logger.warning(f"Salvaged JSON output, dropped {len(partial.dropped)} items: {e}")
+                return partial.value
             raise ValueError(f"Failed to parse JSON output: {e}\nCleaned text:\n{cleaned_text}")
 
-        return parsed
+    def parse_partial(self, text: str) -> PartialJson:
+        """
+        Parse an output that may be truncated or slightly broken, recovering its complete top-level items
+        (and the complete array elements of a truncated item) and reporting the ones that were dropped.
+        :raises ValueError: if no JSON value could be recovered
+        """
+        parser = IncrementalJsonParser()
+        parser.feed(text)
+        return parser.result()
@@ -1,5 +1,3 @@
-import time
-
 from langchain_core.language_models import BaseChatModel
 from langchain_core.runnables import RunnableConfig
 
@@ -8,19 +6,28 @@ from agent.config.initialize_logger import logger
 from agent.config.assistant_config import AssistantConfiguration
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
 
+import json
 import os
 import base64
 from typing import Dict, List, Union
-from ingestion import prompts
+
+from agent.utils.request_executor import invoke_llm
+from agent.utils.token_utils import estimate_image_tokens, token_stage_config
+from ingestion import constants, prompts, segment_cache
 from ingestion.frame_json_parser import FrameJsonOutputParser
+from ingestion.manifest import IngestionManifest, Stage
 
 
-def generate_frame_segment_transcript(path_to_frame_folder: str) -> tuple[dict[str, str], dict[str, str]]:
+def generate_frame_segment_transcript(path_to_frame_folder: str,
+                                      batch_size: int = constants.FRAME_BATCH_SIZE,
+                                      manifest: IngestionManifest = None) -> tuple[dict[str, str], dict[str, str]]:
     """
     Generate a frame transcript based on the agent's state and configuration.
 
     Args:
-        config (RunnableConfig): The configuration for the runnable.
+        path_to_frame_folder (str): The path to the folder containing the frame segments.
+        batch_size (int): Maximum number of frames of a segment packed into one request, 1 disables batching.
+        manifest (IngestionManifest): Optional manifest, frames already recorded in it are not requested again.
 
     Returns:
         Dict[str, str]: A dictionary containing the generated frame transcript and related messages.
@@ -38,7 +45,10 @@ def generate_frame_segment_transcript(path_to_frame_folder: str) -> tuple[dict[s
 
         configuration = AssistantConfiguration()
         chat_model = configuration.get_model(configuration.default_llm_model)
-        req_output_list= llm_requests(chat_model, path_to_frame_folder)
+        if batch_size > 1:
+            req_output_list = batched_llm_requests(chat_model, path_to_frame_folder, batch_size, manifest=manifest)
+        else:
+            req_output_list = llm_requests(chat_model, path_to_frame_folder, manifest)
         return req_output_list
     except Exception as exc:
         logger.exception(f"Exception in creating transcription of frame segments: {exc}")
@@ -65,31 +75,208 @@ def read_frames_from_folder(path_to_frame_folder) -> Dict[str, str]:
                 img_base64_dict[f"{segment_id}/{entry.name}"] = f"{convert}"
     return img_base64_dict
 
-def llm_requests(chat_model, path_to_frame_folder):
+def llm_requests(chat_model, path_to_frame_folder, manifest: IngestionManifest = None):
     """
     Create a list of LLM requests from the base64 encoded images.
+    When a manifest is given, each transcribed frame is recorded in it and recorded frames are reused.
 
     Returns:
         List[Dict[str, str]]: A list of dictionaries containing image data for LLM requests.
     """
-    req_output_list = []
-
-    req_parts = [prompts.FRAME_EXTRACT_PROMPT]
-
     # Read frames from the folder and convert to base64
     base64_img = read_frames_from_folder(path_to_frame_folder) #"../docs/frames"
 
-    # Create LLM requests from the base64 images
-    img_list, img_path_list = get_img_content_list(base64_img)
+    # One request per frame
+    frame_outputs = transcribe_frames(chat_model, base64_img, batch_size=1, manifest=manifest)
+    return [{'title': img_name, 'explanation': frame_outputs[img_name]} for img_name in sorted(base64_img.keys())]
+
+
+
+def batched_llm_requests(chat_model, path_to_frame_folder: str, batch_size: int,
+                         token_budget: int = constants.FRAME_BATCH_TOKEN_BUDGET,
+                         manifest: IngestionManifest = None) -> List[Dict[str, str]]:
+    """
+    Create LLM requests that pack several frames of the same segment into a single request.
+    Frames missing from a batched response are re-requested one at a time.
+
+    :param chat_model: BaseChatModel
+    :param path_to_frame_folder: folder path containing frame segments
+    :param batch_size: maximum number of frames per request
+    :param token_budget: maximum estimated image tokens per request
+    :param manifest: optional manifest, frames already recorded in it are not requested again
+    :return: List[Dict[str, str]]: frame transcripts in the same format (and order) as llm_requests
+    """
+    base64_img = read_frames_from_folder(path_to_frame_folder)
+    frame_outputs = transcribe_frames(chat_model, base64_img, batch_size, token_budget, manifest)
+    return [{'title': img_name, 'explanation': frame_outputs[img_name]} for img_name in sorted(base64_img.keys())]
+
 
+def transcribe_frames(chat_model, base64_img: Dict[str, str], batch_size: int = constants.FRAME_BATCH_SIZE,
+                      token_budget: int = constants.FRAME_BATCH_TOKEN_BUDGET,
+                      manifest: IngestionManifest = None) -> Dict[str, str]:
+    """
+    Transcribe the given frames, one request per frame or batched per segment when batch_size > 1.
+    :param chat_model: BaseChatModel
+    :param base64_img: base64 encoded images keyed by "<segment_id>/<frame name>"
+    :param batch_size: maximum number of frames per request, 1 disables batching
+    :param token_budget: maximum estimated image tokens per batched request
+    :param manifest: optional manifest, frames already recorded in it are not requested again
+    :return: Dict[str, str]: transcript of every frame keyed by frame name
+    Frames already transcribed in any previous video (same perceptual hash) are served from the segment cache.
+    """
+    frame_outputs, pending_img, frame_keys = lookup_frames(base64_img, manifest)
+    namespace = get_frame_namespace()
+    if batch_size > 1:
+        batches = get_frame_batches(pending_img, batch_size, token_budget)
+    else:
+        batches = [[img_name] for img_name in sorted(pending_img.keys())]
+    for batch in batches:
+        batch_output = {}
+        if batch_size > 1:
+            logger.info(f"Requesting transcript for {len(batch)} frames in a single request")
+            batch_output = get_batch_llm_response(batch, pending_img, chat_model)
+            missing = [img_name for img_name in batch if img_name not in batch_output]
+            if 1 < len(missing) < len(batch):
+                # Only the frames missing from a truncated or broken response are requested again
+                logger.info(f"Requesting transcript for the {len(missing)} missing frames in a single request")
+                batch_output.update(get_batch_llm_response(missing, pending_img, chat_model))
+        for img_name in batch:
+            if img_name in batch_output:
+                req_output = batch_output[img_name]
+            else:
+                if batch_size > 1:
+                    logger.warning(f"Frame {img_name} missing from batched response, falling back to a single frame request")
+                req_output = get_llm_response([prompts.FRAME_EXTRACT_PROMPT, pending_img[img_name]], chat_model)
+            if manifest is not None:
+                manifest.record_unit(Stage.FRAME_TRANSCRIPTS, img_name, req_output)
+            if img_name in frame_keys:
+                segment_cache.store(frame_keys[img_name], namespace, req_output,
+                                    segment_cache.get_frame_thumbnail(pending_img[img_name]))
+            frame_outputs[img_name] = req_output
+
+    return frame_outputs
+
+
+def get_frame_namespace() -> str:
+    """
+    Segment cache namespace of the frame transcripts of the default model.
+    """
+    return segment_cache.get_namespace(AssistantConfiguration().default_llm_model, prompts.FRAME_EXTRACT_PROMPT)
+
+
+def lookup_frames(base64_img: Dict[str, str],
+                  manifest: IngestionManifest = None) -> tuple[Dict[str, str], Dict[str, str], Dict[str, str]]:
+    """
+    Split the frames into those already transcribed, recorded in the manifest or served from the segment cache
+    (and then recorded in the manifest), and those to be requested.
+    :param base64_img: base64 encoded images keyed by "<segment_id>/<frame name>"
+    :param manifest: optional manifest of the ingestion
+    :return: tuple: transcripts of the transcribed frames, base64 images of the frames to be requested, and the
+        segment cache keys of the hashed frames, all keyed by frame name
+    """
+    frame_outputs = {}
+    pending_img = {}
+    frame_keys = {}
+    namespace = get_frame_namespace()
+    for img_name, img in base64_img.items():
+        if manifest is not None and manifest.has_unit(Stage.FRAME_TRANSCRIPTS, img_name):
+            frame_outputs[img_name] = manifest.get_unit(Stage.FRAME_TRANSCRIPTS, img_name)
+            continue
+        try:
+            thumbnail = segment_cache.get_frame_thumbnail(img)
+            frame_keys[img_name] = segment_cache.get_frame_key(img)
+        except Exception as e:
+            logger.warning(f"Could not hash frame {img_name}, it is not looked up in the segment cache: {e}")
+        cached_output = segment_cache.lookup(frame_keys[img_name], namespace, thumbnail) \
+            if img_name in frame_keys else None
+        if cached_output is not None:
+            logger.info(f"Reusing segment cache transcript of {img_name}")
+            frame_outputs[img_name] = cached_output
+            if manifest is not None:
+                manifest.record_unit(Stage.FRAME_TRANSCRIPTS, img_name, cached_output)
+        else:
+            pending_img[img_name] = img
+    return frame_outputs, pending_img, frame_keys
+
+
+def get_frame_batches(base64_img: Dict[str, str], batch_size: int, token_budget: int) -> List[List[str]]:
+    """
+    Group frame names into batches of at most batch_size frames from the same segment,
+    keeping the estimated image tokens of each batch within token_budget.
+    :param base64_img: base64 encoded images keyed by "<segment_id>/<frame name>"
+    :param batch_size: maximum number of frames per batch
+    :param token_budget: maximum estimated image tokens per batch
+    :return: list of batches, each a list of frame names
+    """
+    batches, current, current_tokens, current_segment = [], [], 0, None
     for img_name in sorted(base64_img.keys()):
-        req_parts.append(base64_img.get(img_name, ''))
-        req_output = get_llm_response(req_parts, chat_model)
-        req_output_list.append({'title': img_name, 'explanation': req_output})
-        req_parts = [prompts.FRAME_EXTRACT_PROMPT]
+        segment_id = img_name.split('/')[0]
+        img_tokens = estimate_image_tokens(base64_img[img_name])
+        if current and (segment_id != current_segment or len(current) >= batch_size
+                        or current_tokens + img_tokens > token_budget):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(img_name)
+        current_tokens += img_tokens
+        current_segment = segment_id
+    if current:
+        batches.append(current)
+    return batches
+
+
+def get_batch_llm_response(batch: List[str], base64_img: Dict[str, str], chat_model: BaseChatModel) -> Dict[str, str]:
+    """
+    Generate transcripts for several frames with a single LLM request.
+    :param batch: frame names to be transcribed
+    :param base64_img: base64 encoded images keyed by frame name
+    :param chat_model: BaseChatModel
+    :return: Dict[str, str]: transcript of each frame found in the response, keyed by frame name
+    """
+    messages = [HumanMessage(content=get_batch_content(batch, base64_img))]
+
+    frame_transcript = invoke_llm(chat_model, messages, config=token_stage_config(Stage.FRAME_TRANSCRIPTS.value))
+    logger.debug(f"Generated batched frame transcript: {frame_transcript.content}")
+    return parse_batch_response(frame_transcript.content, batch)
+
+
+def get_batch_content(batch: List[str], base64_img: Dict[str, str]) -> list:
+    """
+    Content of the request transcribing several frames at once, each image is preceded by its frame name.
+    """
+    content = [{"type": "text", "text": prompts.FRAME_BATCH_EXTRACT_PROMPT}]
+    for img_name in batch:
+        content.append({"type": "text", "text": f"Frame: {img_name}"})
+        content.append({"type": "image_url", "image_url": f"data:image/jpg;base64,{base64_img[img_name]}"})
+    return content
+
 
-    return req_output_list
+def parse_batch_response(response: str, batch: List[str]) -> Dict[str, str]:
+    """
+    Parse the response of a request transcribing several frames, salvaging the frames of a broken response.
+    :param response: content of the LLM response
+    :param batch: frame names of the request
+    :return: Dict[str, str]: transcript of each frame found in the response, keyed by frame name
+    """
+    parser = FrameJsonOutputParser()
+    try:
+        partial = parser.parse_partial(response)
+    except ValueError as e:
+        logger.warning(f"Could not parse batched frame transcript, frames will be requested again: {e}")
+        return {}
+    parsed_output = partial.value
+    if isinstance(parsed_output, dict):
+        parsed_output = [parsed_output]
 
+    batch_output = {}
+    for item in parsed_output:
+        if not isinstance(item, dict) or item.get('frame') not in batch:
+            continue
+        frame_name = item.pop('frame')
+        batch_output[frame_name] = json.dumps(item)
+    if not partial.complete:
+        missing = [img_name for img_name in batch if img_name not in batch_output]
+        logger.warning(f"Salvaged {len(batch_output)} frames of a broken batched frame transcript, missing: {missing}")
+    return batch_output
 
 
 def get_llm_response(req_parts: List[Dict[str, str]], chat_model: BaseChatModel) -> list[dict]:
@@ -100,18 +287,11 @@ def get_llm_response(req_parts: List[Dict[str, str]], chat_model: BaseChatModel)
       :return: list[dict] : List of dictionaries containing the LLM response.
     """
     # Prepare prompts and messages
-    messages = [
-        HumanMessage(
-            content=[
-                {"type": "text", "text": req_parts[0]},
-                {"type": "image_url", "image_url": f"data:image/jpg;base64,{req_parts[1]}"}
-        ])
-    ]
+    messages = [HumanMessage(content=get_frame_content(req_parts[0], req_parts[1]))]
     # print("max_tokens = " + chat_model.model_fields["max_tokens"])
     # Generate the frame transcript
 
-    frame_transcript = chat_model.invoke(messages)
-    time.sleep(6)
+    frame_transcript = invoke_llm(chat_model, messages, config=token_stage_config(Stage.FRAME_TRANSCRIPTS.value))
     logger.debug(f"Generated frame transcript: {frame_transcript.content}")
     # Use the parser
     parser = FrameJsonOutputParser()
@@ -121,6 +301,16 @@ def get_llm_response(req_parts: List[Dict[str, str]], chat_model: BaseChatModel)
     return parsed_output
 
 
+def get_frame_content(prompt: str, img_base64: str) -> list:
+    """
+    Content of the request of a prompt with a single base64 encoded frame.
+    """
+    return [
+        {"type": "text", "text": prompt},
+        {"type": "image_url", "image_url": f"data:image/jpg;base64,{img_base64}"}
+    ]
+
+
 def get_img_content_list(base64_img : Dict[str,str]):
     img_list = []
     img_path_list = []
@@ -0,0 +1,429 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from dataclasses import asdict, dataclass, field
+from enum import Enum
+from typing import Dict, Iterator, List, Optional
+
+from agent.config.initialize_logger import logger
+from agent.config import constants as agent_constants
+from agent.utils.cancellation import CancellationToken, OperationCancelledError, cancellation_scope
+from agent.utils.token_utils import get_live_token_usage_report
+from ingestion import constants
+from ingestion.lease import ingestion_lease
+from ingestion.manifest import IngestionManifest, Stage, read_manifest
+from ingestion.predictor import estimate_ingestion, record_estimate, record_wall_time
+from ingestion.transcript_store import TranscriptStore
+from ingestion.video_utils import is_video_ingested
+
+
+class JobStatus(Enum):
+    """
+    Enumeration of the states of an ingestion job.
+
+    Attributes:
+        QUEUED: Submitted, waiting for a worker.
+        RUNNING: Being ingested by a worker.
+        DONE: Ingested, the transcript is available.
+        FAILED: The ingestion raised an error.
+        CANCELLED: Cancelled by its sessions, it resumes from its manifest when submitted again.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+@dataclass
+class Job:
+    job_id: str
+    video_path: str
+    output_dir: str
+    segment_duration: int
+    consider_audio: bool = True
+    consider_video: bool = True
+    status: str = JobStatus.QUEUED.value
+    error: str = ""
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    predicted_seconds: Optional[float] = None
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (JobStatus.QUEUED.value, JobStatus.RUNNING.value)
+
+
+@dataclass
+class JobProgress:
+    """
+    Progress of an ingestion job, read from the files of its output folder.
+    """
+    status: str
+    stage: str = ""
+    frames_extracted: int = 0
+    frames_transcribed: int = 0
+    audio_chunks_transcribed: int = 0
+    segments_total: int = 0
+    segments_transcribed: int = 0
+    tokens_used: int = 0
+    elapsed_seconds: float = 0.0
+    eta_seconds: Optional[float] = None
+    partial_available: bool = False
+    error: str = ""
+    predicted_seconds: Optional[float] = None
+
+
+class JobStore:
+    """
+    Persistent table of the ingestion jobs, stored in a local SQLite file.
+    """
+    COLUMNS = [name for name in Job.__dataclass_fields__]
+
+    def __init__(self, path: str = constants.JOB_DB_PATH):
+        """
+        Initializes the JobStore.
+        :param path: Path of the SQLite file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " video_path TEXT NOT NULL,"
+                " output_dir TEXT NOT NULL,"
+                " segment_duration INTEGER NOT NULL,"
+                " consider_audio INTEGER NOT NULL,"
+                " consider_video INTEGER NOT NULL,"
+                " status TEXT NOT NULL,"
+                " error TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " started REAL,"
+                " finished REAL,"
+                " predicted_seconds REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_output_dir ON jobs (output_dir)")
+            # Job tables created before the predictor
+            if "predicted_seconds" not in [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]:
+                conn.execute("ALTER TABLE jobs ADD COLUMN predicted_seconds REAL")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Connection to the SQLite file for one transaction, committed (or rolled back) and closed on exit.
+        """
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn, conn:
+            yield conn
+
+    def _to_job(self, row: tuple) -> Job:
+        job = Job(**dict(zip(self.COLUMNS, row)))
+        job.consider_audio, job.consider_video = bool(job.consider_audio), bool(job.consider_video)
+        return job
+
+    def put(self, job: Job) -> None:
+        values = asdict(job)
+        with self._lock, self._connect() as conn:
+            conn.execute(f"INSERT OR REPLACE INTO jobs ({', '.join(self.COLUMNS)}) "
+                         f"VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                         [values[name] for name in self.COLUMNS])
+
+    def update(self, job_id: str, **values) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in values)} WHERE job_id = ?",
+                         [*values.values(), job_id])
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock, self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return None if row is None else self._to_job(row)
+
+    def find_active(self, output_dir: str) -> Optional[Job]:
+        """
+        Returns the queued or running job of an output folder, if any.
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE output_dir = ? AND status IN (?, ?)"
+                               f" ORDER BY created DESC LIMIT 1",
+                               (output_dir, JobStatus.QUEUED.value, JobStatus.RUNNING.value)).fetchone()
+        return None if row is None else self._to_job(row)
+
+    def list_active(self) -> List[Job]:
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE status IN (?, ?) ORDER BY created",
+                                (JobStatus.QUEUED.value, JobStatus.RUNNING.value)).fetchall()
+        return [self._to_job(row) for row in rows]
+
+
+class JobManager:
+    """
+    In-process pool of ingestion workers shared by every UI session. Jobs are recorded in a persistent
+    JobStore; jobs left queued or running by a previous process are resubmitted when the manager starts
+    and resume from their manifest. A free worker runs the queued job with the shortest predicted ingestion
+    time first, so that short videos are not stuck behind long ones.
+    A job submitted by UI sessions is followed by them (its watchers): it is cancelled when its last watcher
+    releases it (Reset, Cancel) or stops polling its progress for JOB_ABANDON_SECONDS (closed tab).
+    """
+
+    def __init__(self, store: JobStore = None, max_workers: int = constants.JOB_WORKERS):
+        """
+        Initializes the JobManager.
+        :param store: JobStore of the jobs.
+        :param max_workers: Number of videos ingested in parallel.
+        """
+        self.store = store or JobStore()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ingestion-job")
+        self._submit_lock = threading.RLock()
+        self._tokens: Dict[str, CancellationToken] = {}
+        # job id -> predicted seconds of the queued jobs
+        self._queued: Dict[str, float] = {}
+        # job id -> watcher -> last progress poll, None for a watcher not polling (using the partial transcript)
+        self._watchers: Dict[str, Dict[str, Optional[float]]] = {}
+        self._watchdog = threading.Thread(target=self._reap_abandoned_jobs, name="ingestion-job-watchdog", daemon=True)
+        self._watchdog.start()
+        for job in self.store.list_active():
+            logger.info(f"Resubmitting interrupted ingestion job {job.job_id} of {job.video_path}")
+            self.store.update(job.job_id, status=JobStatus.QUEUED.value)
+            self._tokens[job.job_id] = CancellationToken()
+            self._enqueue(job)
+
+    def submit(self, video_path: str, output_dir: str, segment_duration: int, consider_audio: bool = True,
+               consider_video: bool = True, watcher: str = None) -> str:
+        """
+        Queue the ingestion of a video. A video already queued or running in the same output folder (e.g.
+        uploaded by another session) is not queued again, its job is returned instead.
+        :param watcher: Optional id of the session following the job, see watch.
+        :return: str: the job id
+        """
+        # Probing the video takes seconds, it must not hold up the other sessions submitting or polling jobs
+        predicted_seconds = predict_seconds(video_path, output_dir, segment_duration, consider_audio, consider_video)
+        with self._submit_lock:
+            active = self.store.find_active(output_dir)
+            if active is not None and not self._tokens.get(active.job_id, CancellationToken()).is_cancelled:
+                logger.info(f"Ingestion of {output_dir} already submitted as job {active.job_id}")
+                if watcher is not None:
+                    self.watch(active.job_id, watcher)
+                return active.job_id
+            job = Job(job_id=uuid.uuid4().hex, video_path=video_path, output_dir=output_dir,
+                      segment_duration=segment_duration, consider_audio=consider_audio,
+                      consider_video=consider_video, predicted_seconds=predicted_seconds)
+            self.store.put(job)
+            self._tokens[job.job_id] = CancellationToken()
+            if watcher is not None:
+                self.watch(job.job_id, watcher)
+            self._enqueue(job)
+        logger.info(f"Submitted ingestion job {job.job_id} of {video_path}, predicted {job.predicted_seconds}s")
+        return job.job_id
+
+    def _enqueue(self, job: Job) -> None:
+        with self._submit_lock:
+            self._queued[job.job_id] = job.predicted_seconds if job.predicted_seconds is not None else float("inf")
+        self._executor.submit(self._run_next)
+
+    def _run_next(self) -> None:
+        # Every enqueued job submits one _run_next, which runs the shortest queued job at that time
+        with self._submit_lock:
+            if not self._queued:
+                return
+            job_id = min(self._queued, key=self._queued.get)
+            del self._queued[job_id]
+        self._run(job_id)
+
+    def watch(self, job_id: str, watcher: str, polling: bool = True) -> None:
+        """
+        Record that a session follows a job.
+        :param watcher: Id of the session.
+        :param polling: True while the session polls the progress of the job, it must then call watch on every
+            poll; False for a session not polling anymore (e.g. working on the partial transcript) that still
+            wants the job to finish.
+        Jobs that are not queued or running anymore have no watchers, watching them is a no-op.
+        """
+        with self._submit_lock:
+            # The tokens of the finished jobs are dropped with their watchers, see _run
+            if job_id not in self._tokens:
+                return
+            self._watchers.setdefault(job_id, {})[watcher] = time.time() if polling else None
+
+    def unwatch(self, job_id: str, watcher: str) -> None:
+        """
+        Record that a session does not follow a job anymore, cancelling the job if it was its last watcher.
+        """
+        with self._submit_lock:
+            watchers = self._watchers.get(job_id, {})
+            watchers.pop(watcher, None)
+            abandoned = not watchers
+        if abandoned:
+            self.cancel(job_id, f"released by session {watcher}")
+
+    def cancel(self, job_id: str, reason: str = "cancelled") -> None:
+        """
+        Cancel a job. A queued job never starts, a running one stops at its next cancellation point: no new LLM
+        request is started, in-flight ones are abandoned and ffmpeg is killed. Completed units stay in the
+        manifest, so the ingestion resumes from them when the video is submitted again.
+        """
+        with self._submit_lock:
+            self._watchers.pop(job_id, None)
+            token = self._tokens.get(job_id)
+        if token is not None:
+            token.cancel(f"ingestion job {job_id} {reason}")
+
+    def _reap_abandoned_jobs(self) -> None:
+        while True:
+            time.sleep(constants.JOB_POLL_SECONDS)
+            abandoned = []
+            with self._submit_lock:
+                deadline = time.time() - constants.JOB_ABANDON_SECONDS
+                for job_id, watchers in self._watchers.items():
+                    for watcher, last_poll in list(watchers.items()):
+                        if last_poll is not None and last_poll < deadline:
+                            logger.info(f"Session {watcher} stopped following ingestion job {job_id}")
+                            del watchers[watcher]
+                    if not watchers:
+                        abandoned.append(job_id)
+            for job_id in abandoned:
+                self.cancel(job_id, "abandoned by its sessions")
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        return self.store.get(job_id)
+
+    def get_progress(self, job_id: str) -> Optional[JobProgress]:
+        job = self.store.get(job_id)
+        return None if job is None else get_job_progress(job)
+
+    def _run(self, job_id: str) -> None:
+        # Imported here, the ingestion modules import the job manager's dependencies
+        from ingestion.combined_text_transcriptor import generate_transcript
+        from ingestion.pipelined_transcriptor import generate_transcript_pipelined
+
+        job = self.store.get(job_id)
+        token = self._tokens[job_id]
+        if token.is_cancelled:
+            logger.info(f"Ingestion job {job_id} cancelled before it started")
+            self.store.update(job_id, status=JobStatus.CANCELLED.value, finished=time.time())
+            with self._submit_lock:
+                self._watchers.pop(job_id, None)
+                self._tokens.pop(job_id, None)
+            return
+        self.store.update(job_id, status=JobStatus.RUNNING.value, started=time.time())
+        try:
+            os.makedirs(job.output_dir, exist_ok=True)
+            with cancellation_scope(token), ingestion_lease(job.output_dir):
+                if not is_video_ingested(job.output_dir):
+                    started = time.time()
+                    if constants.PIPELINED_INGESTION:
+                        generate_transcript_pipelined(job.video_path, job.output_dir, job.segment_duration,
+                                                      consider_audio=job.consider_audio,
+                                                      consider_video=job.consider_video)
+                    else:
+                        generate_transcript(job.video_path, job.output_dir, job.segment_duration,
+                                            job.consider_audio, job.consider_video)
+                    # Calibrates the predictions of the next videos
+                    record_wall_time(job.output_dir, time.time() - started)
+            self.store.update(job_id, status=JobStatus.DONE.value, finished=time.time())
+            logger.info(f"Ingestion job {job_id} done")
+        except OperationCancelledError:
+            logger.info(f"Ingestion job {job_id} cancelled")
+            self.store.update(job_id, status=JobStatus.CANCELLED.value, finished=time.time())
+        except Exception as e:
+            logger.exception(f"Ingestion job {job_id} failed: {e}")
+            self.store.update(job_id, status=JobStatus.FAILED.value, error=str(e), finished=time.time())
+        finally:
+            with self._submit_lock:
+                self._watchers.pop(job_id, None)
+                self._tokens.pop(job_id, None)
+
+
+def get_job_progress(job: Job) -> JobProgress:
+    """
+    Per-stage progress of a job: frames extracted and transcribed, audio chunks and segments transcribed,
+    tokens used so far and an ETA extrapolated from the segments transcribed.
+    """
+    progress = JobProgress(status=job.status, error=job.error, predicted_seconds=job.predicted_seconds)
+    if job.started is not None:
+        progress.elapsed_seconds = (job.finished or time.time()) - job.started
+    frame_directory = os.path.join(job.output_dir, 'frames')
+    if os.path.isdir(frame_directory):
+        progress.frames_extracted = sum(len(files) for _, _, files in os.walk(frame_directory))
+
+    stages = {}
+    manifest_path = os.path.join(job.output_dir, IngestionManifest.FILE_NAME)
+    if os.path.isfile(manifest_path):
+        try:
+            stages = read_manifest(job.output_dir).get("stages", {})
+        except ValueError:
+            logger.debug(f"Manifest {manifest_path} is being written, progress read on next poll")
+    progress.frames_transcribed = len(stages.get(Stage.FRAME_TRANSCRIPTS.value, {}).get("units", {}))
+    progress.audio_chunks_transcribed = len(stages.get(Stage.AUDIO_TRANSCRIPT.value, {}).get("units", {}))
+    progress.stage = next((stage.value for stage in Stage if not stages.get(stage.value, {}).get("complete")),
+                          Stage.COMBINED.value)
+    plan = stages.get(Stage.SEGMENTED.value, {}).get("units", {}).get("plan")
+    if plan:
+        if plan.get("boundaries") is not None:
+            progress.segments_total = len(plan["boundaries"]) + 1
+        elif plan.get("duration"):
+            progress.segments_total = math.ceil(plan["duration"] / job.segment_duration)
+
+    if os.path.isfile(os.path.join(job.output_dir, TranscriptStore.FILE_NAME)):
+        store = TranscriptStore(job.output_dir)
+        progress.segments_transcribed = store.count_segments()
+        document = store.get_document()
+        progress.partial_available = document is not None
+
+    report = get_live_token_usage_report(job.output_dir)
+    if report is not None:
+        total = report.total()
+        progress.tokens_used = (total.input_tokens or total.estimated_input_tokens) + total.output_tokens
+    else:
+        usage_path = os.path.join(job.output_dir, agent_constants.TOKEN_USAGE_FILE)
+        if os.path.isfile(usage_path):
+            with open(usage_path) as f:
+                total = json.load(f).get("total", {})
+            progress.tokens_used = (total.get("input_tokens") or total.get("estimated_input_tokens", 0)) \
+                + total.get("output_tokens", 0)
+
+    if job.status == JobStatus.RUNNING.value and progress.segments_total and progress.segments_transcribed:
+        done = min(1.0, progress.segments_transcribed / progress.segments_total)
+        progress.eta_seconds = progress.elapsed_seconds * (1 - done) / done
+    elif job.is_active and job.predicted_seconds is not None:
+        # Nothing transcribed yet, the prediction made at submission is the best guess
+        progress.eta_seconds = max(0.0, job.predicted_seconds - progress.elapsed_seconds)
+    return progress
+
+
+def predict_seconds(video_path: str, output_dir: str, segment_duration: int, consider_audio: bool = True,
+                    consider_video: bool = True) -> Optional[float]:
+    """
+    Predicted wall time of an ingestion, its raw estimate is recorded in output_dir for the calibration of
+    later predictions. None if the video cannot be probed.
+    """
+    try:
+        if not os.path.isfile(os.path.join(output_dir, constants.ESTIMATE_FILE)):
+            record_estimate(output_dir, video_path, segment_duration, consider_audio, consider_video)
+        return estimate_ingestion(video_path, segment_duration, consider_audio, consider_video).wall_seconds
+    except Exception as e:
+        logger.warning(f"Could not predict the ingestion time of {video_path}: {e}")
+        return None
+
+
+_job_manager: Optional[JobManager] = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """
+    Returns the process-wide job manager, shared by every UI session.
+    """
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager()
+        return _job_manager
@@ -0,0 +1,176 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterator, Optional
+
+from agent.config.initialize_logger import logger
+from agent.utils.cancellation import CancellationToken, cancellation_scope, check_cancelled, get_cancellation_token
+from ingestion import constants
+
+
+class LeaseTimeoutError(TimeoutError):
+    """
+    Raised when a lease held by another ingestion is not released in time.
+    """
+
+
+class IngestionLease:
+    """
+    Exclusive lease on the output folder of a video, so that a single ingestion of a video runs at a time.
+    The lease is a file created exclusively in the output folder, whose modification time is refreshed by a
+    heartbeat thread every LEASE_HEARTBEAT_SECONDS. A lease not refreshed for LEASE_TTL_SECONDS (its holder
+    crashed or was killed) is stale and taken over. A holder whose lease is lost anyway (e.g. its heartbeat stalled
+    past the TTL) has the cancellation token of its ingestion cancelled.
+    """
+    FILE_NAME = "ingestion.lease"
+
+    def __init__(self, output_dir: str, ttl: float = constants.LEASE_TTL_SECONDS,
+                 heartbeat: float = constants.LEASE_HEARTBEAT_SECONDS):
+        """
+        Initializes the IngestionLease.
+        :param output_dir: Output folder of the ingestion, the lease file is created in it.
+        :param ttl: Seconds without heartbeat after which the lease is stale.
+        :param heartbeat: Seconds between two heartbeats of the holder.
+        """
+        self.path = os.path.join(output_dir, self.FILE_NAME)
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.token = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        self._cancellation_token: Optional[CancellationToken] = None
+
+    def _read_token(self, path: Optional[str] = None) -> Optional[str]:
+        try:
+            with open(path or self.path) as f:
+                return json.load(f).get("token")
+        except (OSError, ValueError):
+            return None
+
+    def _is_stale(self, path: Optional[str] = None) -> bool:
+        try:
+            return time.time() - os.path.getmtime(path or self.path) > self.ttl
+        except FileNotFoundError:
+            return False
+
+    def _take_over_stale(self) -> None:
+        """
+        Remove the lease file if it is stale. Several waiters may see the same stale lease: the file is atomically
+        renamed aside first, so that a single waiter takes it over, and a waiter that renamed the fresh lease of
+        the winner instead (its token differs from the stale one) puts it back.
+        """
+        stale_token = self._read_token()
+        if not self._is_stale():
+            return
+        aside_path = f"{self.path}.{self.token}"
+        try:
+            os.rename(self.path, aside_path)
+        except FileNotFoundError:
+            return
+        if self._read_token(aside_path) == stale_token and self._is_stale(aside_path):
+            logger.warning(f"Taking over stale ingestion lease {self.path}")
+            os.remove(aside_path)
+            return
+        # Link instead of rename never overwrites a lease created meanwhile
+        try:
+            os.link(aside_path, self.path)
+        except FileExistsError:
+            logger.error(f"Could not restore ingestion lease {self.path} renamed during a takeover")
+        os.remove(aside_path)
+
+    def try_acquire(self) -> bool:
+        """
+        Acquire the lease if it is free or stale, without waiting.
+        :return: True if the lease is now held by this instance
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._take_over_stale()
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"token": self.token, "host": socket.gethostname(), "pid": os.getpid(),
+                       "acquired": time.time()}, f)
+        self._stop.clear()
+        self._cancellation_token = get_cancellation_token()
+        self._heartbeat_thread = threading.Thread(target=self._beat, name="lease-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+        logger.info(f"Acquired ingestion lease {self.path}")
+        return True
+
+    def acquire(self, timeout: float = constants.LEASE_WAIT_TIMEOUT_SECONDS,
+                on_wait: Callable[[], None] = None) -> None:
+        """
+        Acquire the lease, waiting for the current holder to release it (or to stop its heartbeat).
+        :param timeout: Maximum seconds to wait.
+        :param on_wait: Optional callback, called once if the lease is held by another ingestion.
+        :raises LeaseTimeoutError: if the lease is not acquired within timeout
+        :raises OperationCancelledError: if the ingestion is cancelled while waiting
+        """
+        deadline = time.monotonic() + timeout
+        waiting = False
+        while not self.try_acquire():
+            if not waiting:
+                waiting = True
+                logger.info(f"Ingestion lease {self.path} is held by another ingestion, waiting for it")
+                if on_wait is not None:
+                    on_wait()
+            if time.monotonic() > deadline:
+                raise LeaseTimeoutError(f"Ingestion lease {self.path} not released after {timeout}s")
+            time.sleep(constants.LEASE_POLL_SECONDS)
+            check_cancelled()
+
+    def _beat(self) -> None:
+        missing = False
+        while not self._stop.wait(self.heartbeat):
+            token = self._read_token()
+            if token is None and not missing:
+                # The lease file may be renamed aside for an instant by a waiter checking for a takeover
+                missing = True
+                continue
+            missing = False
+            if token != self.token:
+                logger.error(f"Ingestion lease {self.path} was taken over by another ingestion")
+                if self._cancellation_token is not None:
+                    self._cancellation_token.cancel("ingestion lease lost")
+                return
+            try:
+                os.utime(self.path)
+            except OSError as e:
+                logger.warning(f"Could not refresh ingestion lease {self.path}: {e}")
+
+    def release(self) -> None:
+        """
+        Stop the heartbeat and remove the lease file if it is still held by this instance.
+        """
+        self._stop.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+        if self._read_token() == self.token:
+            os.remove(self.path)
+            logger.info(f"Released ingestion lease {self.path}")
+
+
+@contextmanager
+def ingestion_lease(output_dir: str, timeout: float = constants.LEASE_WAIT_TIMEOUT_SECONDS,
+                    on_wait: Callable[[], None] = None) -> Iterator[IngestionLease]:
+    """
+    Hold the ingestion lease of an output folder. A second requester of the same video waits for the first
+    ingestion to finish; it should then check whether the video is ingested before starting its own ingestion.
+    Without a cancellation token in the current context, the context gets its own one, so that the ingestion
+    holding the lease stops at its next cancellation point if the lease is lost.
+    """
+    scope = cancellation_scope(CancellationToken()) if get_cancellation_token() is None else nullcontext()
+    with scope:
+        lease = IngestionLease(output_dir)
+        lease.acquire(timeout, on_wait)
+        try:
+            yield lease
+        finally:
+            lease.release()
@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import threading
+from enum import Enum
+from typing import Any
+
+from agent.config.initialize_logger import logger
+
+
+class Stage(Enum):
+    """
+    Enumeration of the checkpointed ingestion stages, in pipeline order.
+
+    Attributes:
+        SEGMENTED: Segment boundaries of the video (see segmenter.SegmentPlan).
+        FRAMES_EXTRACTED: Frames of every segment are persisted in the frames folder.
+        AUDIO_CHUNKED: Audio chunks of every segment are persisted in the audio_segments folder.
+        AUDIO_TRANSCRIPT: Transcript of every audio chunk, one unit per chunk.
+        FRAME_TRANSCRIPTS: Transcript of every frame, one unit per frame.
+        COMBINED: Combined transcript of the whole video.
+    """
+    SEGMENTED = "segmented"
+    FRAMES_EXTRACTED = "frames_extracted"
+    AUDIO_CHUNKED = "audio_chunked"
+    AUDIO_TRANSCRIPT = "audio_transcript"
+    FRAME_TRANSCRIPTS = "frame_transcripts"
+    COMBINED = "combined"
+
+
+class IngestionManifest:
+    """
+    Records the completed stages and units (segments, frames) of an ingestion in the output folder,
+    so that a rerun after a failure resumes from the first incomplete unit instead of starting over.
+
+    Completed units are appended to a journal next to the manifest, which is only rewritten (with the journal
+    folded in) when a stage completes, so that recording a unit costs the same whatever the number of units.
+    """
+    FILE_NAME = "manifest.json"
+    JOURNAL_FILE_NAME = "manifest.journal"
+    # Folders of the extracted segments, read back by counting their files
+    SEGMENT_FOLDERS = ("frames", "audio_segments")
+
+    def __init__(self, output_dir: str, params: dict):
+        """
+        Initializes the IngestionManifest, loading the existing manifest of output_dir if any.
+        :param output_dir: Output folder of the ingestion, the manifest is stored in it.
+        :param params: Parameters the recorded results depend on (e.g. segment duration). A manifest
+            recorded with different parameters is discarded, with the segments extracted for it.
+        """
+        self.path = os.path.join(output_dir, self.FILE_NAME)
+        self.journal_path = os.path.join(output_dir, self.JOURNAL_FILE_NAME)
+        self.params = params
+        self._lock = threading.RLock()
+        self._data = {"params": params, "stages": {}}
+        # The journal only applies to the manifest it follows, a new manifest is written before its first unit
+        self._saved = False
+        data = None
+        if os.path.exists(self.path):
+            try:
+                data = read_manifest(output_dir)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read manifest {self.path}, starting over: {e}")
+                self._discard_segments(output_dir)
+        if data is not None and data.get("params") == params:
+            self._data = data
+            # Folds the journal in, dropping the partially written entry an interrupted ingestion may have left
+            self._save()
+            logger.info(f"Resuming ingestion from manifest {self.path}")
+        elif data is not None:
+            logger.info(f"Ingestion parameters changed, discarding manifest {self.path}")
+            self._discard_segments(output_dir)
+
+    def _discard_segments(self, output_dir: str) -> None:
+        """
+        Deletes the segment folders of a discarded manifest, so that segments of the previous segmentation
+        (e.g. a segment past the last one of a longer segment duration) are not read as segments of this one.
+        """
+        for folder in self.SEGMENT_FOLDERS:
+            path = os.path.join(output_dir, folder)
+            if os.path.isdir(path):
+                logger.info(f"Deleting segments {path} of the discarded manifest")
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _stage(self, stage: Stage) -> dict:
+        return self._data["stages"].setdefault(stage.value, {"complete": False, "units": {}})
+
+    def _save(self) -> None:
+        """
+        Rewrites the manifest with the units of the journal, then empties the journal.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._data, f)
+        os.replace(tmp_path, self.path)
+        # Replaying a journal already folded in the manifest is harmless if the process stops in between
+        open(self.journal_path, 'w').close()
+        self._saved = True
+
+    def is_stage_complete(self, stage: Stage) -> bool:
+        with self._lock:
+            return self._stage(stage)["complete"]
+
+    def complete_stage(self, stage: Stage) -> None:
+        with self._lock:
+            self._stage(stage)["complete"] = True
+            self._save()
+        logger.info(f"Ingestion stage {stage.value} completed")
+
+    def has_unit(self, stage: Stage, unit_id: str) -> bool:
+        with self._lock:
+            return unit_id in self._stage(stage)["units"]
+
+    def get_unit(self, stage: Stage, unit_id: str) -> Any:
+        with self._lock:
+            return self._stage(stage)["units"].get(unit_id)
+
+    def get_units(self, stage: Stage) -> dict:
+        """
+        Returns a copy of the recorded units of a stage keyed by unit id.
+        """
+        with self._lock:
+            return dict(self._stage(stage)["units"])
+
+    def record_unit(self, stage: Stage, unit_id: str, result: Any) -> None:
+        """
+        Records the result of a completed unit and appends it to the journal of the manifest.
+        :param stage: Stage the unit belongs to.
+        :param unit_id: Identifier of the unit (e.g. audio chunk or frame name).
+        :param result: JSON serializable result of the unit.
+        """
+        with self._lock:
+            self._stage(stage)["units"][unit_id] = result
+            if not self._saved:
+                self._save()
+                return
+            with open(self.journal_path, 'a') as f:
+                f.write(json.dumps({"stage": stage.value, "unit": unit_id, "result": result}) + "\n")
+
+
+def read_manifest(output_dir: str) -> dict:
+    """
+    Reads the manifest of an output folder with the units recorded in its journal since the last completed stage.
+    A partially written last line of the journal (the ingestion stopped, or is writing it) is ignored.
+    :param output_dir: Output folder of the ingestion.
+    :return: Dictionary with the params and the stages of the manifest.
+    :raises OSError: if the manifest cannot be read.
+    :raises ValueError: if the manifest is not valid JSON.
+    """
+    with open(os.path.join(output_dir, IngestionManifest.FILE_NAME), 'r') as f:
+        data = json.load(f)
+    journal_path = os.path.join(output_dir, IngestionManifest.JOURNAL_FILE_NAME)
+    if os.path.exists(journal_path):
+        with open(journal_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.debug(f"Skipping partially written entry of manifest journal {journal_path}")
+                    continue
+                stage = data["stages"].setdefault(entry["stage"], {"complete": False, "units": {}})
+                stage["units"][entry["unit"]] = entry["result"]
+    return data
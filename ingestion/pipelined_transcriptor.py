@@ -0,0 +1,233 @@
+import base64
+import contextvars
+import os
+import queue
+import threading
+from typing import Dict, Iterator, List
+
+from agent.config.assistant_config import AssistantConfiguration
+from agent.config.initialize_logger import logger
+from agent.utils.cancellation import OperationCancelledError
+from agent.utils.rate_limiter import get_rate_limiter
+from agent.utils.token_utils import TokenUsageReport, token_usage_report
+from ingestion import constants
+from ingestion.audio_extractor import VideoAudioProcessor
+from ingestion.audio_transcript_generator import transcribe_audio_chunk
+from ingestion.combined_text_transcriptor import (check_modalities, combine_and_write_transcript, get_manifest,
+                                                  publish_partial_transcript, resolve_segment_duration)
+from ingestion.frame_extractor import FrameExtractor
+from ingestion.frame_transcript_generator import transcribe_frames
+from ingestion.manifest import IngestionManifest, Stage
+from ingestion.segment_cache import segment_cache_stats
+from ingestion.segmenter import get_segment_plan
+from ingestion.transcript_store import TranscriptStore
+from ingestion.video_utils import extraction_slot
+
+# Pushed once per consumer on the segment queue when extraction is over
+_END_OF_SEGMENTS = None
+
+
+def generate_transcript_pipelined(video_path: str, output_dir: str, segment_duration: int,
+                                  queue_size: int = constants.PIPELINE_QUEUE_SIZE, consider_audio: bool = True,
+                                  consider_video: bool = True) -> tuple[str, str]:
+    """
+    Pipelined version of combined_text_transcriptor.generate_transcript.
+    Extraction pushes every finished segment (frames + audio chunk) onto a bounded queue while transcription workers
+    pull segments from it, so that segment k is transcribed while segment k+1 is extracted. The end-to-end latency
+    approaches max(extraction, transcription) instead of their sum, and the queue bound caps how far extraction
+    runs ahead of transcription.
+
+    :param video_path: Path to the input video file.
+    :param output_dir: Path to the output directory where segments will be stored.
+    :param segment_duration: Each segment's duration in seconds(input by user), constants.SEGMENT_DURATION_AUTO to
+        choose it from the video.
+    :param queue_size: Maximum number of extracted segments waiting for transcription.
+    :param consider_audio: False to skip the audio extraction and transcription
+    :param consider_video: False to skip the frame extraction and transcription
+    A partial transcript is published every constants.PARTIAL_TRANSCRIPT_EVERY transcribed segments.
+    :return: tuple[str, str]: the transcript.json content and the output directory
+    """
+    try:
+        check_modalities(consider_audio, consider_video)
+        logger.info("---GENERATE PIPELINED SEGMENT TRANSCRIPT FOR INGESTION---")
+        configuration = AssistantConfiguration()
+        chat_model = configuration.get_model(configuration.default_llm_model)
+        rate_limiter = get_rate_limiter(configuration.default_llm_model)
+        auto_duration = segment_duration == constants.SEGMENT_DURATION_AUTO
+        segment_duration = resolve_segment_duration(video_path, segment_duration, consider_audio, consider_video)
+        manifest = get_manifest(video_path, output_dir, segment_duration, consider_audio, consider_video, auto_duration)
+
+        audio_directory = os.path.join(output_dir, 'audio_segments')
+        segment_queue = queue.Queue(maxsize=max(1, queue_size))
+        store = TranscriptStore(output_dir)
+        segment_transcripts = {}
+        errors = []
+        failed = threading.Event()
+        publish_lock = threading.Lock()
+        num_workers = rate_limiter.max_concurrency
+
+        def produce():
+            try:
+                for segment in iter_extracted_segments(video_path, output_dir, segment_duration, manifest,
+                                                       consider_audio, consider_video):
+                    if failed.is_set():
+                        break
+                    segment_queue.put(segment)
+            except OperationCancelledError as e:
+                logger.info("Segment extraction cancelled")
+                errors.append(e)
+                failed.set()
+            except Exception as e:
+                logger.exception(f"Exception while extracting segments: {e}")
+                errors.append(e)
+                failed.set()
+            finally:
+                for _ in range(num_workers):
+                    segment_queue.put(_END_OF_SEGMENTS)
+
+        def consume():
+            while True:
+                segment = segment_queue.get()
+                if segment is _END_OF_SEGMENTS:
+                    return
+                if failed.is_set():
+                    # Keep draining so that the producer is never blocked on a full queue
+                    continue
+                segment_id, frame_files, span = segment
+                try:
+                    segment_transcript = transcribe_segment(
+                        chat_model, segment_id, frame_files, audio_directory, manifest, consider_audio)
+                    logger.info(f"Segment {segment_id} transcribed")
+                    store.put_segment(segment_id, segment_transcript, *span)
+                    with publish_lock:
+                        segment_transcripts[segment_id] = segment_transcript
+                        if len(segment_transcripts) % max(1, constants.PARTIAL_TRANSCRIPT_EVERY) == 0:
+                            publish_partial_transcript(output_dir, segment_transcripts)
+                except OperationCancelledError as e:
+                    logger.info(f"Transcription of segment {segment_id} cancelled")
+                    errors.append(e)
+                    failed.set()
+                except Exception as e:
+                    logger.exception(f"Exception while transcribing segment {segment_id}: {e}")
+                    errors.append(e)
+                    failed.set()
+
+        with token_usage_report(TokenUsageReport(output_dir)), segment_cache_stats(output_dir):
+            # Workers run in a copy of this context to be accounted in the token usage report and cache stats
+            workers = [threading.Thread(target=contextvars.copy_context().run, args=(consume,),
+                                        name=f"transcriber-{idx}", daemon=True) for idx in range(num_workers)]
+            for worker in workers:
+                worker.start()
+            produce()
+            for worker in workers:
+                worker.join()
+            if errors:
+                raise errors[0]
+
+            manifest.complete_stage(Stage.AUDIO_TRANSCRIPT)
+            manifest.complete_stage(Stage.FRAME_TRANSCRIPTS)
+            logger.info("Segment processing completed")
+
+            ordered_transcripts = {segment_id: segment_transcripts[segment_id] for segment_id in sorted(segment_transcripts)}
+            json_str = combine_and_write_transcript(chat_model, ordered_transcripts, output_dir, manifest,
+                                                    consider_audio, consider_video)
+    except OperationCancelledError:
+        logger.info(f"Pipelined ingestion of {video_path} cancelled, it resumes from its manifest when rerun")
+        raise
+    except Exception as exc:
+        logger.exception(f"Exception in creating pipelined transcription of segments: {exc}")
+        raise
+    return json_str, output_dir
+
+
+def iter_extracted_segments(video_path: str, output_dir: str, segment_duration: int,
+                            manifest: IngestionManifest, consider_audio: bool = True,
+                            consider_video: bool = True) -> Iterator[tuple[str, List[str], tuple]]:
+    """
+    Extract the audio chunks, then the frames segment by segment, yielding each segment as soon as it is on disk.
+    Extraction stages already completed in the manifest are not redone. Without consider_video, the segments
+    of the audio chunks are yielded without frames.
+    :return: Iterator of (segment id, list of the segment's frame file paths, (start, end) of the segment)
+    """
+    audio_directory = os.path.join(output_dir, 'audio_segments')
+    frame_directory = os.path.join(output_dir, 'frames')
+    with extraction_slot():
+        plan = get_segment_plan(video_path, segment_duration, manifest, consider_audio, consider_video)
+
+    # Audio chunking is a single fast ffmpeg pass, the chunks are ready before the first segment's frames
+    if consider_audio and not manifest.is_stage_complete(Stage.AUDIO_TRANSCRIPT) and (
+            not manifest.is_stage_complete(Stage.AUDIO_CHUNKED) or not os.path.isdir(audio_directory)):
+        with extraction_slot():
+            VideoAudioProcessor(input_path=video_path, output_path=audio_directory,
+                                interval_s=segment_duration, persist=True,
+                                segment_times=plan.boundaries).extractor()
+        manifest.complete_stage(Stage.AUDIO_CHUNKED)
+
+    if not consider_video:
+        if os.path.isdir(audio_directory):
+            audio_f_names = set(entry.name for entry in os.scandir(audio_directory) if entry.is_file())
+        else:
+            audio_f_names = set()
+        audio_f_names.update(manifest.get_units(Stage.AUDIO_TRANSCRIPT).keys())
+        for audio_f_name in sorted(audio_f_names):
+            segment_id = os.path.splitext(audio_f_name)[0].rsplit('_', 1)[-1]
+            yield segment_id, [], plan.get_span(int(segment_id), segment_duration)
+        return
+
+    if manifest.is_stage_complete(Stage.FRAMES_EXTRACTED):
+        for segment_id in sorted(entry.name for entry in os.scandir(frame_directory) if entry.is_dir()):
+            segment_directory = os.path.join(frame_directory, segment_id)
+            yield (segment_id, sorted(os.path.join(segment_directory, name) for name in os.listdir(segment_directory)),
+                   plan.get_span(int(segment_id), segment_duration))
+        return
+
+    frame_extractor = FrameExtractor(video_path=video_path, persist=True,
+                                     segment_duration_seconds=segment_duration,
+                                     max_frames_per_segment=constants.MAX_FRAMES_PER_SEGMENT,
+                                     scene_detection_threshold=constants.SCENE_DETECTION_THRESHOLD,
+                                     frame_path=frame_directory,
+                                     segment_boundaries=plan.boundaries,
+                                     scene_frames=plan.scene_frames)
+    segments = frame_extractor.iter_segmented_frames()
+    while True:
+        # The extraction slot is held per segment, not while the segment waits in the queue
+        with extraction_slot():
+            segment = next(segments, None)
+        if segment is None:
+            break
+        segment_idx, segment_frames = segment
+        yield (f"{segment_idx:03d}", [frame_file for _, frame_file in segment_frames],
+               plan.get_span(segment_idx, segment_duration))
+    manifest.complete_stage(Stage.FRAMES_EXTRACTED)
+
+
+def transcribe_segment(chat_model, segment_id: str, frame_files: List[str], audio_directory: str,
+                       manifest: IngestionManifest, consider_audio: bool = True) -> Dict[str, dict]:
+    """
+    Transcribe the audio chunk (if consider_audio) and the frames of a single segment.
+    :return: Dict[str, dict]: the segment entry of transcript.json (audio_transcript and frame_transcript)
+    """
+    audio_path = os.path.join(audio_directory, f"total_audio_{segment_id}.wav")
+    audio_f_name = os.path.basename(audio_path)
+    if not consider_audio:
+        audio_transcript = {}
+    elif os.path.isfile(audio_path) or manifest.has_unit(Stage.AUDIO_TRANSCRIPT, audio_f_name):
+        audio_transcript = transcribe_audio_chunk(chat_model, audio_path, manifest)
+    else:
+        logger.warning(f"No audio chunk for segment {segment_id}")
+        audio_transcript = {}
+
+    base64_img = {}
+    for frame_file in frame_files:
+        with open(frame_file, "rb") as imagefile:
+            base64_img[f"{segment_id}/{os.path.basename(frame_file)}"] = base64.b64encode(imagefile.read()).decode('utf-8')
+    frame_outputs = transcribe_frames(chat_model, base64_img, manifest=manifest)
+
+    frame_transcript = {}
+    if frame_outputs:
+        titles = sorted(frame_outputs.keys())
+        frame_transcript = {'title': titles, 'details': [frame_outputs[title] for title in titles]}
+    return {
+        "audio_transcript": audio_transcript,
+        "frame_transcript": frame_transcript
+    }
@@ -0,0 +1,341 @@
+import base64
+import json
+import math
+import os
+import statistics
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from agent.config import constants as agent_constants
+from agent.config.initialize_logger import logger
+from agent.utils.cancellation import run_subprocess
+from agent.utils.token_utils import estimate_image_tokens, estimate_text_tokens, get_max_input_tokens
+from ingestion import constants, prompts
+from ingestion.manifest import Stage, read_manifest
+
+
+@dataclass
+class VideoProbe:
+    """
+    What the predictor knows of a video: its container metadata and a quick low resolution probe.
+
+    Attributes:
+        duration: Duration in seconds.
+        fps: Frames per second.
+        width: Width in pixels.
+        height: Height in pixels.
+        has_audio: True if the container has an audio stream.
+        cuts_per_second: Hard cuts per second between the probed frames.
+        change_ratio: Fraction of consecutive probed frames that differ visually, 0 for a static video.
+        frame_tokens: Estimated input tokens of a single frame request.
+    """
+    duration: float
+    fps: float
+    width: int
+    height: int
+    has_audio: bool
+    cuts_per_second: float = 0.0
+    change_ratio: float = 1.0
+    frame_tokens: int = agent_constants.IMAGE_TOKENS_PER_TILE
+
+
+@dataclass
+class IngestionEstimate:
+    """
+    Predicted size, cost and wall time of an ingestion.
+    """
+    segments: int = 0
+    frames: float = 0.0
+    audio_chunks: float = 0.0
+    requests: float = 0.0
+    input_tokens: float = 0.0
+    output_tokens: float = 0.0
+    wall_seconds: float = 0.0
+    cost: Optional[float] = None
+    calibration_runs: int = 0
+
+    def scaled(self, factors: Dict[str, float]) -> 'IngestionEstimate':
+        values = asdict(self)
+        for name, factor in factors.items():
+            values[name] = values[name] * factor
+        return IngestionEstimate(**values)
+
+
+# Fields of IngestionEstimate calibrated from past runs
+CALIBRATED_FIELDS = ["frames", "audio_chunks", "requests", "input_tokens", "output_tokens", "wall_seconds"]
+
+
+def has_audio_stream(video_path: str, ffmpeg_path: str = "ffmpeg") -> bool:
+    """
+    True if the container of the video has an audio stream, read from the stream list ffmpeg prints without
+    decoding anything. Assumed when ffmpeg is not available.
+    """
+    try:
+        completed = run_subprocess([ffmpeg_path, "-hide_banner", "-i", video_path], text=True)
+    except FileNotFoundError:
+        logger.warning("ffmpeg not found, the video is assumed to have an audio track")
+        return True
+    return "Audio:" in completed.stderr
+
+
+@lru_cache(maxsize=64)
+def probe_video(video_path: str) -> VideoProbe:
+    """
+    Read the container metadata of a video and sample PREDICTOR_PROBE_SAMPLES frames at low resolution to
+    measure its scene density, without decoding the whole video.
+    Videos are stored under their content hash, so the probe of a path is cached.
+    """
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise FileNotFoundError(f"Could not open video file: {video_path}")
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+        total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        probe = VideoProbe(duration=total_frames / fps if fps > 0 else 0.0, fps=fps,
+                           width=int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                           height=int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                           has_audio=has_audio_stream(video_path))
+        samples = min(constants.PREDICTOR_PROBE_SAMPLES, total_frames)
+        thumbnails, full_frame = [], None
+        for frame_number in np.linspace(0, total_frames - 1, samples).astype(int) if samples > 1 else []:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, int(frame_number))
+            ret, frame = capture.read()
+            if not ret:
+                continue
+            if full_frame is None:
+                full_frame = frame
+            thumbnail = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (32, 18), interpolation=cv2.INTER_AREA)
+            thumbnails.append(thumbnail.astype(np.float32))
+    finally:
+        capture.release()
+
+    if len(thumbnails) > 1:
+        differences = np.array([np.mean(np.abs(b - a)) for a, b in zip(thumbnails, thumbnails[1:])])
+        probed_seconds = probe.duration * (len(thumbnails) - 1) / max(1, samples - 1)
+        probe.change_ratio = float(np.mean(differences > constants.PREDICTOR_CHANGE_THRESHOLD))
+        probe.cuts_per_second = float(np.sum(differences > constants.PREDICTOR_CUT_THRESHOLD)) / max(probed_seconds, 1e-6)
+    if full_frame is not None:
+        success, buffer = cv2.imencode('.jpg', full_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if success:
+            probe.frame_tokens = estimate_image_tokens(base64.b64encode(buffer).decode('utf-8'))
+    logger.info(f"Probed {video_path}: {probe}")
+    return probe
+
+
+def auto_segment_duration(probe: VideoProbe, consider_audio: bool = True, consider_video: bool = True) -> int:
+    """
+    Longest segment duration of a video within the per-request limits:
+    - the audio chunk of a segment fits the input token budget and the payload size of a request, and its
+      transcript fits the output tokens of the model,
+    - every scene of a segment keeps a frame within the MAX_FRAMES_PER_SEGMENT frames of the segment.
+    Content-defined segments last up to SEGMENT_MAX_FACTOR times the segment duration, the limits hold for them.
+    :return: int: segment duration in seconds, between AUTO_SEGMENT_MIN_SECONDS and AUTO_SEGMENT_MAX_SECONDS
+    """
+    limits = {"max": constants.AUTO_SEGMENT_MAX_SECONDS}
+    if consider_audio and probe.has_audio:
+        prompt_tokens = estimate_text_tokens(prompts.AUDIO_EXTRACT_PROMPT)
+        limits["audio_input_tokens"] = (get_max_input_tokens(agent_constants.PROVIDER, agent_constants.MODEL_NAME)
+                                        - prompt_tokens) \
+            / agent_constants.AUDIO_TOKENS_PER_SECOND
+        # Base64 encoded 16kHz mono 16 bit wav
+        limits["audio_payload"] = constants.MAX_PAYLOAD_BYTES * 3 / 4 / (16000 * 2)
+        limits["audio_output_tokens"] = agent_constants.MAX_OUTPUT_TOKENS \
+            / constants.PREDICTOR_OUTPUT_TOKENS_PER_AUDIO_SECOND
+    if consider_video and probe.cuts_per_second > 0:
+        limits["scenes"] = constants.MAX_FRAMES_PER_SEGMENT / probe.cuts_per_second
+    duration = min(limits.values())
+    if constants.SEGMENTATION_MODE == "content":
+        duration /= constants.SEGMENT_MAX_FACTOR
+    if probe.duration:
+        # A single segment for a short video
+        duration = min(duration, math.ceil(probe.duration))
+    logger.debug(f"Segment duration limits: {limits}")
+    return int(max(constants.AUTO_SEGMENT_MIN_SECONDS, duration))
+
+
+def estimate_raw(probe: VideoProbe, segment_duration: int, consider_audio: bool = True,
+                 consider_video: bool = True) -> IngestionEstimate:
+    """
+    Uncalibrated estimate of an ingestion from the probe of its video and the ingestion parameters.
+    """
+    if segment_duration == constants.SEGMENT_DURATION_AUTO:
+        segment_duration = auto_segment_duration(probe, consider_audio, consider_video)
+    segments = max(1, math.ceil(probe.duration / segment_duration)) if probe.duration else 1
+    estimate = IngestionEstimate(segments=segments)
+    frame_requests, frame_output_tokens = 0.0, 0.0
+    if consider_video:
+        # Scene candidates first, then uniform samples deduplicated on their perceptual hash: a static video
+        # keeps a frame per segment, a busy one reaches the cap
+        cap = constants.MAX_FRAMES_PER_SEGMENT
+        per_segment = probe.cuts_per_second * segment_duration + cap * probe.change_ratio
+        estimate.frames = segments * min(cap, max(1.0, per_segment))
+        frame_requests = segments * math.ceil(estimate.frames / segments / max(1, constants.FRAME_BATCH_SIZE))
+        frame_output_tokens = estimate.frames * constants.PREDICTOR_OUTPUT_TOKENS_PER_FRAME
+        estimate.input_tokens += estimate.frames * probe.frame_tokens \
+            + frame_requests * estimate_text_tokens(prompts.FRAME_EXTRACT_PROMPT)
+    audio_output_tokens = 0.0
+    if consider_audio and probe.has_audio:
+        estimate.audio_chunks = segments
+        audio_output_tokens = probe.duration * constants.PREDICTOR_OUTPUT_TOKENS_PER_AUDIO_SECOND
+        estimate.input_tokens += probe.duration * agent_constants.AUDIO_TOKENS_PER_SECOND \
+            + segments * estimate_text_tokens(prompts.AUDIO_EXTRACT_PROMPT)
+
+    # The combination reads every segment transcript, in a single request or in map_reduce groups
+    combine_input = frame_output_tokens + audio_output_tokens
+    combine_requests = 1
+    if constants.COMBINE_MODE == "map_reduce" or combine_input > constants.COMBINE_MAX_INPUT_TOKENS:
+        combine_requests = math.ceil(combine_input / constants.COMBINE_GROUP_TOKEN_BUDGET) + 1
+    estimate.input_tokens += combine_input * (2 if combine_requests > 1 else 1)
+    estimate.requests = frame_requests + estimate.audio_chunks + combine_requests
+    estimate.output_tokens = frame_output_tokens + audio_output_tokens \
+        + combine_requests * constants.PREDICTOR_OUTPUT_TOKENS_PER_COMBINE
+
+    # Requests are bounded both by the concurrency and by the requests per minute of the model
+    request_seconds = estimate.requests * constants.PREDICTOR_REQUEST_SECONDS / max(1, agent_constants.MAX_CONCURRENT_REQUESTS)
+    if agent_constants.REQUESTS_PER_MINUTE > 0:
+        request_seconds = max(request_seconds, estimate.requests * 60.0 / agent_constants.REQUESTS_PER_MINUTE)
+    estimate.wall_seconds = probe.duration * constants.PREDICTOR_EXTRACTION_SECONDS_PER_SECOND + request_seconds
+    return estimate
+
+
+def get_actuals(output_dir: str) -> Optional[Dict[str, float]]:
+    """
+    Recorded stats of a completed ingestion: frames and audio chunks transcribed (manifest), requests and
+    tokens (token usage report) and wall time (estimate record).
+    Ingestions resumed after an interruption, or partly served by the LLM or segment caches, did not do the work
+    the raw estimate predicts in the recorded wall time, they are left out of the calibration.
+    :return: actual value of every calibrated field, None if the ingestion is not complete or not calibrating
+    """
+    try:
+        stages = read_manifest(output_dir).get("stages", {})
+        with open(os.path.join(output_dir, agent_constants.TOKEN_USAGE_FILE)) as f:
+            usage = json.load(f)
+        with open(os.path.join(output_dir, constants.ESTIMATE_FILE)) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not stages.get(Stage.COMBINED.value, {}).get("complete"):
+        return None
+    if usage.get("runs", 1) > 1 or usage.get("cached_requests", 0) or get_segment_cache_hits(output_dir):
+        logger.debug(f"Ingestion of {output_dir} resumed or served from the caches, not used for calibration")
+        return None
+    total = usage.get("total", {})
+    actuals = {
+        "frames": len(stages.get(Stage.FRAME_TRANSCRIPTS.value, {}).get("units", {})),
+        "audio_chunks": len(stages.get(Stage.AUDIO_TRANSCRIPT.value, {}).get("units", {})),
+        "requests": total.get("requests", 0),
+        "input_tokens": total.get("input_tokens") or total.get("estimated_input_tokens", 0),
+        "output_tokens": total.get("output_tokens", 0),
+    }
+    if record.get("wall_seconds"):
+        actuals["wall_seconds"] = record["wall_seconds"]
+    return actuals
+
+
+def get_segment_cache_hits(output_dir: str) -> int:
+    """
+    Frames and audio chunks of an ingestion whose transcript was reused from the segment cache.
+    """
+    try:
+        with open(os.path.join(output_dir, constants.SEGMENT_CACHE_STATS_FILE)) as f:
+            return sum(counts.get("hits", 0) for counts in json.load(f).values())
+    except (OSError, ValueError):
+        return 0
+
+
+@lru_cache(maxsize=1)
+def _load_calibration(docs_dir: str, mtime_key: tuple) -> tuple[Dict[str, float], int]:
+    ratios: Dict[str, List[float]] = {name: [] for name in CALIBRATED_FIELDS}
+    runs = 0
+    for _, output_dir in sorted(mtime_key, reverse=True)[:constants.PREDICTOR_CALIBRATION_RUNS]:
+        actuals = get_actuals(output_dir)
+        if actuals is None:
+            continue
+        with open(os.path.join(output_dir, constants.ESTIMATE_FILE)) as f:
+            raw = json.load(f).get("raw", {})
+        runs += 1
+        for name, actual in actuals.items():
+            if raw.get(name):
+                ratios[name].append(actual / raw[name])
+    return {name: statistics.median(values) for name, values in ratios.items() if values}, runs
+
+
+def load_calibration(docs_dir: str = constants.PREDICTOR_DOCS_DIR) -> tuple[Dict[str, float], int]:
+    """
+    Calibration factors of the raw estimates: median ratio of the actual to the raw estimated value of
+    every field, over the last PREDICTOR_CALIBRATION_RUNS completed ingestions of docs_dir.
+    :return: tuple[Dict[str, float], int]: factor of every calibrated field and number of runs used
+    """
+    records = []
+    if os.path.isdir(docs_dir):
+        for name in os.listdir(docs_dir):
+            path = os.path.join(docs_dir, name, constants.ESTIMATE_FILE)
+            if os.path.isfile(path):
+                records.append((os.path.getmtime(path), os.path.join(docs_dir, name)))
+    # Recomputed only when an estimate record changes
+    return _load_calibration(docs_dir, tuple(records))
+
+
+def estimate_ingestion(video_path: str, segment_duration: int, consider_audio: bool = True,
+                       consider_video: bool = True, docs_dir: str = constants.PREDICTOR_DOCS_DIR) -> IngestionEstimate:
+    """
+    Predict the frames, audio chunks, LLM requests, tokens, cost and wall time of the ingestion of a video,
+    from its metadata and a quick probe, calibrated on the past ingestions of docs_dir.
+    """
+    raw = estimate_raw(probe_video(video_path), segment_duration, consider_audio, consider_video)
+    factors, runs = load_calibration(docs_dir)
+    estimate = raw.scaled(factors)
+    estimate.calibration_runs = runs
+    if constants.PRICE_PER_MILLION_INPUT_TOKENS or constants.PRICE_PER_MILLION_OUTPUT_TOKENS:
+        estimate.cost = (estimate.input_tokens * constants.PRICE_PER_MILLION_INPUT_TOKENS
+                         + estimate.output_tokens * constants.PRICE_PER_MILLION_OUTPUT_TOKENS) / 1e6
+    return estimate
+
+
+def record_estimate(output_dir: str, video_path: str, segment_duration: int, consider_audio: bool = True,
+                    consider_video: bool = True) -> None:
+    """
+    Record the raw estimate of an ingestion in its output folder, for the calibration of later predictions.
+    """
+    raw = estimate_raw(probe_video(video_path), segment_duration, consider_audio, consider_video)
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, constants.ESTIMATE_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({"raw": asdict(raw), "wall_seconds": None}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def record_wall_time(output_dir: str, wall_seconds: float) -> None:
+    """
+    Record the wall time of a completed ingestion next to its raw estimate.
+    """
+    path = os.path.join(output_dir, constants.ESTIMATE_FILE)
+    try:
+        with open(path) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return
+    record["wall_seconds"] = wall_seconds
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def format_estimate(estimate: IngestionEstimate) -> str:
+    """
+    One line summary of an estimate for the users.
+    """
+    duration = f"{estimate.wall_seconds / 60:.0f} min" if estimate.wall_seconds >= 60 else f"{estimate.wall_seconds:.0f} s"
+    summary = (f"~{duration}, {estimate.requests:.0f} LLM requests, "
+               f"~{(estimate.input_tokens + estimate.output_tokens) / 1000:.0f}k tokens")
+    if estimate.cost is not None:
+        summary += f", ~${estimate.cost:.2f}"
+    if not estimate.calibration_runs:
+        summary += " (not calibrated yet)"
+    return summary
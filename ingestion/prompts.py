@@ -22,6 +22,35 @@ FRAME_EXTRACT_PROMPT = """
 
 """
 
+FRAME_BATCH_EXTRACT_PROMPT = """
+        You are a technical expert and presenter.
+
+        You will be given multiple images from the same part of a video (e.g., slides, manuals, whitepapers, design specs, code, graph etc).
+        Each image is preceded by a text line of the form "Frame: <frame name>". For every image:
+        1. Generate a **transcript** that explains the image in a clear, concise manner.
+        2. Extract the **raw text exactly as it appears in the image**, preserving formatting, labels, and code blocks.
+        3. Extract and explain the key technical content (e.g., diagrams, code, architecture, tables, flowcharts).
+        4. If there are double quotes in the image, add a backward slash before them for example \"text\".
+        5. Be very thorough in your explanations and ensure that the transcript reads naturally as if a presenter is explaining the slide in a talk.
+        6. Donot add any additional information than what is present in the image.
+        7. Donot add any content that is not utf-8 supported like illegal endline characters, emojis etc..
+        8. Donot add any other keys apart from the four keys mentioned in the sample output below.
+        9. Return exactly one item per image, using the frame name given before that image.
+
+
+        Please return the output as a **valid JSON array** in the following format:
+
+      [
+        {
+          "frame": "The frame name given before the image.",
+          "raw_text": "All visible text extracted from the image, exactly as it appears.",
+          "explanation": "A detailed explanation of the contents of the image including diagrams, code, or other elements.",
+          "transcript": "A natural-sounding transcript as if a presenter is explaining the slide in a talk."
+        }
+      ]
+
+"""
+
 AUDIO_EXTRACT_PROMPT = """
     System:
     You will be given a single base 64 encoded audio segment.
@@ -57,6 +86,32 @@ AUDIO_EXTRACT_PROMPT = """
 
 """
 
+AUDIO_CONTINUE_PROMPT = """
+    System:
+    You will be given a single base 64 encoded audio segment and the last speaker turns of a transcript of it that was cut off.
+
+    Your task is to transcribe the rest of the audio segment, starting right after the last turn below.
+    Follow the same rules as the original transcription: attribute lines to "Speaker 1", "Speaker 2", etc. (or "Unknown"),
+    keep the same speaker labels as the turns below, and do not add any information that is not in the audio segment.
+    Do not repeat the turns below. If nothing follows them, return an empty transcript list.
+
+    Last transcribed turns:
+    {last_turns}
+
+    Return the result as valid JSON using the structure below.
+
+    ```json
+    {
+      "transcript": [
+            {
+              "speaker": "Speaker 1",
+              "text": "..."
+            }
+          ]
+    }
+
+"""
+
 COMBINED_EXTRACT_PROMPT = """
 You will receive a JSON object containing multiple segments, each identified by a string key such as "000", "001", etc. Each of these segments 
 are small chunks of a larget video of equal length, and they are coherent in chronological order which means 000 is the first segment, 001 is the second, and so on.
@@ -83,6 +138,35 @@ Your task is to:
 
 """
 
+COMBINED_AUDIO_ONLY_NOTE = """
+Note: only the audio of this video was transcribed. The segments contain an `audio_transcript` but no `frame_transcript`,
+build the combined transcript from the audio alone and do not describe any visual content.
+"""
+
+COMBINED_VIDEO_ONLY_NOTE = """
+Note: only the frames of this video were transcribed. The segments contain a `frame_transcript` but no `audio_transcript`,
+build the combined transcript from the visual content alone and do not attribute any speech to speakers.
+"""
+
+COMBINED_REDUCE_PROMPT = """
+You will receive a JSON object containing multiple partial transcripts, each identified by a string key such as "000", "001", etc.
+Each partial transcript is a detailed explanation of a consecutive part of a larger video, generated from the audio and image content of
+that part, and they are in chronological order which means 000 is the first part, 001 is the second, and so on.
+
+Your task is to:
+1. Merge the partial transcripts into a single coherent narrative of the entire video, keeping their chronological order.
+2. Remove repetitions across the boundaries of the parts but keep every detail, the combined transcript should be very detailed and thorough.
+3. Donot add any additional information than what is present in the partial transcripts.
+4. Donot add any non utf-8 characters like emojis, illegal endline characters etc.
+5. Return your result as a JSON object in the format below:
+
+```json
+{
+    'combined_transcript': ' A detailed coherent explanation of the entire video generated from the partial transcripts.'
+}
+
+"""
+
 FINAL_PROMPT = """
 You will be given one audio segment and multiple images.
 
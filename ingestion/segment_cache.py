@@ -0,0 +1,231 @@
+import base64
+import contextvars
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import wave
+from contextlib import closing, contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import imagehash
+import numpy as np
+from PIL import Image
+
+from agent.config.initialize_logger import logger
+from ingestion import constants
+
+
+class SegmentCache:
+    """
+    Cross-video store of frame and audio chunk transcripts, stored in a local SQLite file.
+    Frames are keyed by their perceptual hash and audio chunks by a fingerprint of their loudness envelope,
+    so a title slide or a jingle seen in a previous video reuses its transcript instead of calling the LLM.
+    A frame entry also stores the thumbnail of the frame, the content check of the frames sharing its hash.
+    Keys are namespaced by the model and prompt that produced the transcript.
+    """
+
+    def __init__(self, path: str = constants.SEGMENT_CACHE_PATH):
+        """
+        Initializes the SegmentCache.
+        :param path: Path of the SQLite file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS segment_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " thumbnail BLOB)"
+            )
+            if "thumbnail" not in [row[1] for row in conn.execute("PRAGMA table_info(segment_cache)")]:
+                conn.execute("ALTER TABLE segment_cache ADD COLUMN thumbnail BLOB")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Connection to the SQLite file for one transaction, committed (or rolled back) and closed on exit.
+        """
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn, conn:
+            yield conn
+
+    def get(self, key: str) -> Optional[tuple[Any, Optional[bytes]]]:
+        """
+        :return: the value and the thumbnail stored under key, None if there is none
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value, thumbnail FROM segment_cache WHERE key = ?", (key,)).fetchone()
+        return None if row is None else (json.loads(row[0]), row[1])
+
+    def put(self, key: str, value: Any, thumbnail: Optional[bytes] = None) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO segment_cache (key, value, created, thumbnail) VALUES (?, ?, ?, ?)",
+                         (key, json.dumps(value), time.time(), thumbnail))
+
+
+def get_namespace(model: dict, prompt: str) -> str:
+    """
+    Namespace of the transcripts produced by a model for a prompt.
+    """
+    payload = json.dumps([model['provider'], model['model_name'], prompt])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def get_frame_key(img_base64: str) -> str:
+    """
+    Perceptual hash of a frame, identical for the same slide re-encoded in another video.
+    """
+    image = Image.open(io.BytesIO(base64.b64decode(img_base64)))
+    return f"frame:{imagehash.phash(image, hash_size=constants.FRAME_PHASH_SIZE)}"
+
+
+def get_frame_thumbnail(img_base64: str) -> bytes:
+    """
+    Grayscale FRAME_THUMBNAIL_SIZE thumbnail of a frame, compared by frames_match.
+    """
+    image = Image.open(io.BytesIO(base64.b64decode(img_base64))).convert('L')
+    return image.resize(constants.FRAME_THUMBNAIL_SIZE, Image.Resampling.BOX).tobytes()
+
+
+def frames_match(thumbnail: bytes, other: bytes) -> bool:
+    """
+    Whether two frame thumbnails show the same content: the mean difference of every FRAME_DIFF_BLOCK_SIZE
+    pixels square is within FRAME_MAX_BLOCK_DIFF gray levels.
+    """
+    if len(thumbnail) != len(other):
+        return False
+    width, height = constants.FRAME_THUMBNAIL_SIZE
+    block = constants.FRAME_DIFF_BLOCK_SIZE
+    difference = np.abs(np.frombuffer(thumbnail, dtype=np.uint8).astype(np.float32)
+                        - np.frombuffer(other, dtype=np.uint8).astype(np.float32)).reshape(height, width)
+    difference = difference[:height // block * block, :width // block * block]
+    blocks = difference.reshape(height // block, block, width // block, block).mean(axis=(1, 3))
+    return float(blocks.max()) <= constants.FRAME_MAX_BLOCK_DIFF
+
+
+def get_audio_key(audio_path: str) -> str:
+    """
+    Fingerprint of an audio chunk: its loudness envelope over AUDIO_FINGERPRINT_WINDOW_MS windows, quantized
+    in AUDIO_FINGERPRINT_LEVELS log levels, so that the same audio re-encoded in another video matches.
+    Chunks only match when they start at the same point of the audio (e.g. a shared intro).
+    """
+    with wave.open(audio_path) as wav:
+        frame_rate = wav.getframerate()
+        channels = wav.getnchannels()
+        sample_width = wav.getsampwidth()
+        frames = wav.readframes(wav.getnframes())
+    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[sample_width]
+    samples = np.frombuffer(frames, dtype=dtype).astype(np.float64)
+    if sample_width == 1:
+        samples -= 128
+    samples = samples.reshape(-1, channels).mean(axis=1) / float(2 ** (8 * sample_width - 1))
+    window = max(1, frame_rate * constants.AUDIO_FINGERPRINT_WINDOW_MS // 1000)
+    usable = len(samples) // window * window
+    rms = np.sqrt(np.mean(samples[:usable].reshape(-1, window) ** 2, axis=1)) if usable else np.zeros(0)
+    quantized = quantize_loudness(20 * np.log10(rms + 1e-9))
+    return f"audio:{hashlib.sha256(quantized.tobytes()).hexdigest()}"
+
+
+def quantize_loudness(db: np.ndarray) -> np.ndarray:
+    """
+    Quantize loudness values in dBFS, clipped to [-60, 0], in AUDIO_FINGERPRINT_LEVELS levels.
+    """
+    levels = np.clip((db + 60) / 60, 0, 1)
+    return np.round(levels * (constants.AUDIO_FINGERPRINT_LEVELS - 1)).astype(np.uint8)
+
+
+class SegmentCacheStats:
+    """
+    Hits and misses of the segment cache during an ingestion, safe to share between threads.
+    """
+
+    def __init__(self):
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, hit: bool) -> None:
+        with self._lock:
+            counts = self.counts.setdefault(kind, {"hits": 0, "misses": 0})
+            counts["hits" if hit else "misses"] += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {kind: {**counts, "hit_rate": round(counts["hits"] / max(1, counts["hits"] + counts["misses"]), 3)}
+                    for kind, counts in self.counts.items()}
+
+
+_segment_cache: Optional[SegmentCache] = None
+_segment_cache_lock = threading.Lock()
+_current_stats: contextvars.ContextVar[Optional[SegmentCacheStats]] = contextvars.ContextVar(
+    'segment_cache_stats', default=None)
+
+
+def get_segment_cache() -> Optional[SegmentCache]:
+    """
+    Returns the process-wide segment cache, or None if it is disabled.
+    """
+    global _segment_cache
+    if not constants.SEGMENT_CACHE_ENABLED:
+        return None
+    with _segment_cache_lock:
+        if _segment_cache is None:
+            _segment_cache = SegmentCache()
+        return _segment_cache
+
+
+@contextmanager
+def segment_cache_stats(output_dir: str) -> Iterator[SegmentCacheStats]:
+    """
+    Record the segment cache hits of this context (and of threads started with a copy of it).
+    The hit rates are logged and written as SEGMENT_CACHE_STATS_FILE in output_dir when the context exits.
+    """
+    stats = SegmentCacheStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+        if stats.counts:
+            logger.info(f"Segment cache hit rates: {stats.to_dict()}")
+            stats_path = os.path.join(output_dir, constants.SEGMENT_CACHE_STATS_FILE)
+            with open(stats_path + '.tmp', 'w') as f:
+                json.dump(stats.to_dict(), f, indent=2)
+            os.replace(stats_path + '.tmp', stats_path)
+
+
+def lookup(key: str, namespace: str, thumbnail: Optional[bytes] = None) -> Optional[Any]:
+    """
+    Returns the stored transcript of a frame or audio key, recording the hit or miss in the current stats.
+    :param thumbnail: thumbnail of the frame (see get_frame_thumbnail), the stored frame must match it
+    """
+    cache = get_segment_cache()
+    if cache is None:
+        return None
+    entry = cache.get(f"{namespace}:{key}")
+    value = None
+    if entry is not None:
+        value, stored_thumbnail = entry
+        if thumbnail is not None and (stored_thumbnail is None or not frames_match(thumbnail, stored_thumbnail)):
+            logger.debug(f"Segment cache entry {key} is another frame with the same perceptual hash")
+            value = None
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(key.split(':', 1)[0], value is not None)
+    return value
+
+
+def store(key: str, namespace: str, value: Any, thumbnail: Optional[bytes] = None) -> None:
+    """
+    Store the transcript of a frame or audio key.
+    :param thumbnail: thumbnail of the frame, see lookup
+    """
+    cache = get_segment_cache()
+    if cache is not None:
+        cache.put(f"{namespace}:{key}", value, thumbnail)
@@ -0,0 +1,239 @@
+import hashlib
+import subprocess
+import tempfile
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+import cv2
+import numpy as np
+from scenedetect import SceneManager, open_video
+from scenedetect.detectors import ContentDetector
+
+from agent.config.initialize_logger import logger
+from agent.utils.cancellation import OperationCancelledError, get_cancellation_token, open_subprocess
+from ingestion import constants
+from ingestion.manifest import IngestionManifest, Stage
+from ingestion.segment_cache import quantize_loudness
+
+
+@dataclass
+class SegmentPlan:
+    """
+    Segmentation of a video.
+
+    Attributes:
+        boundaries: Start time in seconds of every segment but the first, None for fixed-duration segments.
+        scene_frames: (start frame, end frame) of every scene detected in the video, None if not detected yet.
+        duration: Duration of the video in seconds, None if unknown.
+    """
+    boundaries: Optional[List[float]] = None
+    scene_frames: Optional[List[List[int]]] = None
+    duration: Optional[float] = None
+
+    def get_span(self, segment_idx: int, segment_duration: int) -> tuple[float, Optional[float]]:
+        """
+        Start and end time in seconds of a segment, the end is None when unknown.
+        """
+        if self.boundaries is None:
+            start, end = float(segment_idx * segment_duration), float((segment_idx + 1) * segment_duration)
+        else:
+            starts = [0.0] + self.boundaries
+            start = starts[min(segment_idx, len(starts) - 1)]
+            end = starts[segment_idx + 1] if segment_idx + 1 < len(starts) else self.duration
+        if end is not None and self.duration is not None:
+            end = min(end, self.duration)
+        return start, end
+
+
+def detect_scene_frames(video_path: str, threshold: float = constants.SCENE_DETECTION_THRESHOLD) -> List[List[int]]:
+    """
+    Global scene detection of a video, the same the FrameExtractor runs before picking frames.
+    :return: (start frame, end frame) of every scene, empty if the detection failed
+    """
+    try:
+        scene_manager = SceneManager()
+        scene_manager.add_detector(ContentDetector(threshold=threshold))
+        detect_scenes(scene_manager, video_path)
+        scenes = scene_manager.get_scene_list(start_in_scene=True)
+        logger.debug(f"Scene detection completed. Total scenes detected: {len(scenes)}")
+        return [[scene[0].get_frames(), scene[1].get_frames()] for scene in scenes]
+    except OperationCancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Warning: Error during scene detection, segments are cut on silences only: {e}")
+        return []
+
+
+def detect_scenes(scene_manager: SceneManager, video_path: str) -> None:
+    """
+    scene_manager.detect_scenes on a video, stopped as soon as the ingestion is cancelled.
+    :raises OperationCancelledError: if the ingestion is cancelled during the detection
+    """
+    token = get_cancellation_token()
+    if token is None:
+        scene_manager.detect_scenes(video=open_video(video_path))
+        return
+    with token.on_cancel(scene_manager.stop):
+        scene_manager.detect_scenes(video=open_video(video_path))
+    token.raise_if_cancelled()
+
+
+def get_loudness_envelope(video_path: str, ffmpeg_path: str = "ffmpeg") -> np.ndarray:
+    """
+    Loudness in dBFS of the audio track over SEGMENT_ENVELOPE_WINDOW_MS windows. The decoded audio is streamed
+    SEGMENT_ENVELOPE_CHUNK_WINDOWS windows at a time, only the envelope is kept in memory.
+    :return: one value per window, empty if the video has no readable audio track
+    """
+    cmd = [ffmpeg_path, "-v", "error", "-i", video_path, "-vn", "-ac", "1",
+           "-ar", str(constants.SEGMENT_ENVELOPE_SAMPLE_RATE), "-f", "s16le", "-"]
+    window = constants.SEGMENT_ENVELOPE_SAMPLE_RATE * constants.SEGMENT_ENVELOPE_WINDOW_MS // 1000
+    window_bytes = window * 2
+    rms_chunks = []
+    with tempfile.TemporaryFile() as stderr:
+        with open_subprocess(cmd, stdout=subprocess.PIPE, stderr=stderr) as process:
+            pending = b""
+            while chunk := process.stdout.read(window_bytes * constants.SEGMENT_ENVELOPE_CHUNK_WINDOWS):
+                pending += chunk
+                usable = len(pending) // window_bytes * window_bytes
+                if usable:
+                    samples = np.frombuffer(pending[:usable], dtype=np.int16).astype(np.float32) / 32768.0
+                    rms_chunks.append(np.sqrt(np.mean(samples.reshape(-1, window) ** 2, axis=1)))
+                    pending = pending[usable:]
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            stderr.seek(0)
+            logger.warning(f"Could not read the audio of {video_path}, segments are cut on scenes only: "
+                           f"{stderr.read().decode(errors='replace').strip()}")
+            return np.zeros(0)
+    if not rms_chunks:
+        return np.zeros(0)
+    return 20 * np.log10(np.concatenate(rms_chunks).astype(np.float64) + 1e-9)
+
+
+def find_silence_points(envelope: np.ndarray) -> List[float]:
+    """
+    Middle, in seconds, of every run of windows quieter than SILENCE_THRESHOLD_DB lasting at least SILENCE_MIN_MS.
+    """
+    window_s = constants.SEGMENT_ENVELOPE_WINDOW_MS / 1000
+    min_windows = max(1, constants.SILENCE_MIN_MS // constants.SEGMENT_ENVELOPE_WINDOW_MS)
+    points, run_start = [], None
+    for idx, silent in enumerate(np.append(envelope < constants.SILENCE_THRESHOLD_DB, False)):
+        if silent and run_start is None:
+            run_start = idx
+        elif not silent and run_start is not None:
+            if idx - run_start >= min_windows:
+                points.append((run_start + idx) / 2 * window_s)
+            run_start = None
+    return points
+
+
+def get_candidate_hash(envelope: np.ndarray, time_s: float, scene_starts: Optional[List[float]] = None
+                       ) -> Optional[int]:
+    """
+    Hash of the content following a candidate boundary, it only depends on the content around the candidate and
+    not on its position in the video: the quantized loudness of the next SEGMENT_HASH_WINDOW_MS or, when the audio
+    does not cover that window or is flat over it, the offsets of the next SEGMENT_HASH_SCENES scene cuts.
+    :param envelope: loudness envelope of the video (see get_loudness_envelope), empty without audio
+    :param time_s: time of the candidate in seconds
+    :param scene_starts: start time in seconds of the scenes of the video, None without scene detection
+    :return: the hash, None when no content after the candidate can tell it apart from another candidate
+    """
+    window_ms = constants.SEGMENT_ENVELOPE_WINDOW_MS
+    start = int(round(time_s * 1000 / window_ms))
+    length = constants.SEGMENT_HASH_WINDOW_MS // window_ms
+    if start + length <= len(envelope):
+        levels = quantize_loudness(envelope[start:start + length])
+        if levels.min() != levels.max():
+            return int.from_bytes(hashlib.sha256(levels.tobytes()).digest()[:8], 'big')
+    offsets = [round((scene_start - time_s) * 1000 / window_ms) for scene_start in sorted(scene_starts or [])
+               if scene_start - time_s >= window_ms / 1000][:constants.SEGMENT_HASH_SCENES]
+    if not offsets:
+        return None
+    return int.from_bytes(hashlib.sha256(np.array(offsets, dtype=np.int64).tobytes()).digest()[:8], 'big')
+
+
+def select_boundaries(candidates: List[float], envelope: np.ndarray, duration: float, min_s: float,
+                      target_s: float, max_s: float, scene_starts: Optional[List[float]] = None) -> List[float]:
+    """
+    Choose segment boundaries among the candidate cut points (scene cuts and silences) with a content-defined
+    chunking rule. Past min_s since the last boundary, a candidate is a boundary when its content hash is a
+    multiple of SEGMENT_BOUNDARY_DIVISOR; past target_s, any candidate is; past max_s without any candidate,
+    the segment is cut at max_s.
+    As each boundary only depends on the content around it and on the previous boundary, the boundaries of an
+    edited video fall back in step with those of the original a segment or two after each edit.
+    Candidates without a content hash (see get_candidate_hash), or all hashing alike (e.g. a flat audio track and
+    evenly spaced cuts), only become boundaries past target_s, like fixed-duration segments cut on candidates.
+    :param scene_starts: start time in seconds of the scenes, hashed for the candidates the audio does not cover
+    :return: sorted boundaries in seconds, strictly between 0 and duration
+    """
+    candidates = sorted(candidates)
+    hashes = {candidate: get_candidate_hash(envelope, candidate, scene_starts) for candidate in candidates}
+    if len(set(hashes.values()) - {None}) < 2:
+        hashes = dict.fromkeys(candidates)
+    boundaries, last = [], 0.0
+    for candidate in candidates + [duration]:
+        while candidate - last > max_s:
+            last += max_s
+            boundaries.append(last)
+        elapsed = candidate - last
+        if candidate >= duration or elapsed < min_s:
+            continue
+        candidate_hash = hashes[candidate]
+        if elapsed >= target_s or (candidate_hash is not None
+                                   and candidate_hash % constants.SEGMENT_BOUNDARY_DIVISOR == 0):
+            boundaries.append(candidate)
+            last = candidate
+    # A last segment shorter than min_s is merged into the previous one
+    if boundaries and duration - boundaries[-1] < min_s:
+        boundaries.pop()
+    return [round(boundary, 3) for boundary in boundaries]
+
+
+def plan_segments(video_path: str, segment_duration: int, mode: str = constants.SEGMENTATION_MODE,
+                  consider_audio: bool = True, consider_video: bool = True) -> SegmentPlan:
+    """
+    Segment a video in fixed-duration windows ("fixed") or at content-defined boundaries ("content") anchored
+    to scene cuts and silences, around segment_duration seconds long.
+    :param video_path: Path to the input video file.
+    :param segment_duration: Target segment duration in seconds.
+    :param mode: "fixed" or "content" (see constants.SEGMENTATION_MODE)
+    :param consider_audio: False to cut on scenes only, without reading the audio
+    :param consider_video: False to cut on silences only, without scene detection
+    :return: SegmentPlan
+    """
+    capture = cv2.VideoCapture(video_path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        duration = capture.get(cv2.CAP_PROP_FRAME_COUNT) / fps if fps > 0 else 0.0
+    finally:
+        capture.release()
+    if mode == "fixed":
+        return SegmentPlan(duration=duration)
+    scene_frames = detect_scene_frames(video_path) if consider_video else None
+    # Without audio, candidates are told apart by the scene cuts following them (see get_candidate_hash)
+    envelope = get_loudness_envelope(video_path) if consider_audio else np.zeros(0)
+    scene_starts = [round(start / fps, 3) for start, _ in (scene_frames or [])[1:] if fps > 0]
+    candidates = sorted(set(scene_starts + [round(point, 3) for point in find_silence_points(envelope)]))
+    boundaries = select_boundaries(candidates, envelope, duration,
+                                   min_s=segment_duration * constants.SEGMENT_MIN_FACTOR,
+                                   target_s=segment_duration,
+                                   max_s=segment_duration * constants.SEGMENT_MAX_FACTOR,
+                                   scene_starts=scene_starts)
+    logger.info(f"Content-defined segmentation of {video_path}: {len(boundaries) + 1} segments "
+                f"from {len(candidates)} candidate cuts, boundaries {boundaries}")
+    return SegmentPlan(boundaries=boundaries, scene_frames=scene_frames, duration=duration)
+
+
+def get_segment_plan(video_path: str, segment_duration: int, manifest: IngestionManifest = None,
+                     consider_audio: bool = True, consider_video: bool = True) -> SegmentPlan:
+    """
+    Segment plan of an ingestion, recorded in the manifest so that a resumed ingestion keeps the same segments.
+    """
+    if manifest is not None and manifest.is_stage_complete(Stage.SEGMENTED):
+        return SegmentPlan(**manifest.get_unit(Stage.SEGMENTED, 'plan'))
+    plan = plan_segments(video_path, segment_duration, consider_audio=consider_audio, consider_video=consider_video)
+    if manifest is not None:
+        manifest.record_unit(Stage.SEGMENTED, 'plan', asdict(plan))
+        manifest.complete_stage(Stage.SEGMENTED)
+    return plan
@@ -0,0 +1,168 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from typing import Iterator, List, Optional
+
+from agent.config.initialize_logger import logger
+
+
+class TranscriptStore:
+    """
+    Indexed store of the transcript of a video, a SQLite file in the ingestion output folder.
+    Every segment is a row with its start/end time and its audio and frame transcripts, appended as soon as the
+    segment is transcribed (a row only holding the transcript of one modality of two is not complete yet); the
+    combined transcript and the metadata are a separate document record, so that
+    callers only needing the combined transcript never read the segments.
+    """
+    FILE_NAME = "transcript.sqlite"
+
+    def __init__(self, output_dir: str):
+        """
+        Initializes the TranscriptStore, creating the store of output_dir if needed.
+        :param output_dir: Output folder of the ingestion, the store is stored in it.
+        """
+        self.path = os.path.join(output_dir, self.FILE_NAME)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS segments ("
+                " segment_id TEXT PRIMARY KEY,"
+                " start REAL,"
+                " end REAL,"
+                " audio_transcript TEXT NOT NULL,"
+                " frame_transcript TEXT NOT NULL,"
+                " complete INTEGER NOT NULL DEFAULT 1)"
+            )
+            # Stores written before segments had a completion flag only hold complete segments
+            if "complete" not in [row[1] for row in conn.execute("PRAGMA table_info(segments)")]:
+                conn.execute("ALTER TABLE segments ADD COLUMN complete INTEGER NOT NULL DEFAULT 1")
+            conn.execute("CREATE INDEX IF NOT EXISTS segments_start ON segments (start)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " name TEXT PRIMARY KEY,"
+                " content TEXT NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Connection to the SQLite file for one transaction, committed (or rolled back) and closed on exit.
+        """
+        with closing(sqlite3.connect(self.path, timeout=30)) as conn, conn:
+            yield conn
+
+    def put_segment(self, segment_id: str, segment: dict, start: float = None, end: float = None,
+                    complete: bool = True) -> None:
+        """
+        Insert or replace the transcript of a segment.
+        :param segment_id: Identifier of the segment (e.g. "003").
+        :param segment: audio_transcript and frame_transcript of the segment.
+        :param start: Start time of the segment in seconds.
+        :param end: End time of the segment in seconds.
+        :param complete: False for a segment still missing the transcript of a considered modality.
+        """
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO segments"
+                " (segment_id, start, end, audio_transcript, frame_transcript, complete) VALUES (?, ?, ?, ?, ?, ?)",
+                (segment_id, start, end, json.dumps(segment.get("audio_transcript", {})),
+                 json.dumps(segment.get("frame_transcript", {})), int(complete))
+            )
+
+    def get_segment(self, segment_id: str) -> Optional[dict]:
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT audio_transcript, frame_transcript FROM segments WHERE segment_id = ?",
+                               (segment_id,)).fetchone()
+        return None if row is None else {"audio_transcript": json.loads(row[0]), "frame_transcript": json.loads(row[1])}
+
+    def count_segments(self) -> int:
+        """
+        Number of completely transcribed segments.
+        """
+        with self._lock, self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM segments WHERE complete").fetchone()[0]
+
+    def iter_segments(self, start: float = None, end: float = None) -> Iterator[tuple[str, float, float, dict]]:
+        """
+        Iterate over the segments in time order, optionally only those overlapping [start, end).
+        :return: Iterator of (segment id, start, end, segment transcript)
+        """
+        query = "SELECT segment_id, start, end, audio_transcript, frame_transcript FROM segments"
+        conditions, params = [], []
+        if end is not None:
+            conditions.append("start < ?")
+            params.append(end)
+        if start is not None:
+            conditions.append("(end IS NULL OR end > ?)")
+            params.append(start)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(query + " ORDER BY segment_id", params).fetchall()
+        for segment_id, seg_start, seg_end, audio, frames in rows:
+            yield segment_id, seg_start, seg_end, {"audio_transcript": json.loads(audio),
+                                                   "frame_transcript": json.loads(frames)}
+
+    def put_document(self, combined_transcript: dict, metadata: dict, segment_ids: List[str] = None) -> None:
+        """
+        Write the combined transcript and the metadata of the video.
+        :param combined_transcript: combined transcript, {"combined_transcript": text}
+        :param metadata: metadata of the transcript (partial, segments_completed...)
+        :param segment_ids: Optional ids of the segments of the final transcript, any other stored segment
+            (left over from a previous ingestion with other segments) is deleted.
+        """
+        with self._lock, self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO documents (name, content) VALUES (?, ?)",
+                             [("combined_transcript", json.dumps(combined_transcript)),
+                              ("metadata", json.dumps(metadata))])
+            if segment_ids is not None:
+                stale = [row[0] for row in conn.execute("SELECT segment_id FROM segments")
+                         if row[0] not in set(segment_ids)]
+                conn.executemany("DELETE FROM segments WHERE segment_id = ?", [(segment_id,) for segment_id in stale])
+
+    def get_document(self) -> Optional[dict]:
+        """
+        Combined transcript and metadata, in the transcript.json layout, without reading any segment.
+        :return: {"combined_transcript": [combined transcript], "metadata": metadata}, None if not written yet
+        """
+        with self._lock, self._connect() as conn:
+            rows = dict(conn.execute("SELECT name, content FROM documents").fetchall())
+        if "combined_transcript" not in rows:
+            return None
+        return {"combined_transcript": [json.loads(rows["combined_transcript"])],
+                "metadata": json.loads(rows.get("metadata", "{}"))}
+
+    def to_dict(self) -> dict:
+        """
+        Whole transcript in the transcript.json layout.
+        """
+        transcript = {segment_id: segment for segment_id, _, _, segment in self.iter_segments()}
+        transcript.update(self.get_document() or {})
+        return transcript
+
+
+def load_transcript_document(output_dir: str) -> Optional[dict]:
+    """
+    Combined transcript and metadata of an ingestion output folder, read from its transcript store, or from
+    the transcript.json of ingestions made before the store existed.
+    :return: {"combined_transcript": [combined transcript], "metadata": metadata}, None if there is none
+    """
+    if os.path.isfile(os.path.join(output_dir, TranscriptStore.FILE_NAME)):
+        document = TranscriptStore(output_dir).get_document()
+        if document is not None:
+            return document
+    transcript_path = os.path.join(output_dir, 'transcript.json')
+    if not os.path.isfile(transcript_path):
+        return None
+    try:
+        with open(transcript_path) as f:
+            transcript = json.load(f)
+    except ValueError:
+        logger.warning(f"Unreadable transcript {transcript_path}")
+        return None
+    if not isinstance(transcript, dict) or "combined_transcript" not in transcript:
+        return None
+    return {"combined_transcript": transcript["combined_transcript"], "metadata": transcript.get("metadata", {})}
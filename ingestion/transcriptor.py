@@ -1,3 +1,4 @@
+import contextvars
 import json
 
 import cv2
@@ -14,10 +15,13 @@ import shutil
 import os
 import cv2
 import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Union
 from ingestion import prompts
 from ingestion import constants
-
+from agent.utils.rate_limiter import get_rate_limiter
+from agent.utils.request_executor import invoke_llm
+from agent.utils.token_utils import TokenUsageReport, token_stage_config, token_usage_report
 
 from ingestion.audio_extractor import VideoAudioProcessor
 from ingestion.audio_transcript_generator import generate_audio_segment_transcript
@@ -53,10 +57,9 @@ def generate_transcript(video_path, path_to_folder, video_id) :
         chat_model = configuration.get_model(configuration.default_llm_model)
         # Extract segments from the video and audio
         extract_segments(video_path, path_to_folder, video_id)
-        output_list = llm_requests(chat_model, path_to_folder)
-        json_str = json.dumps(output_list)
-        with open(os.path.join(path_to_folder, 'transcript.json'), 'w') as f:
-            f.write(json_str)
+        with token_usage_report(TokenUsageReport(path_to_folder)):
+            output_list = llm_requests(chat_model, path_to_folder, configuration.default_llm_model)
+        write_transcript(path_to_folder, output_list)
 
         # Clean up audio directory
         audio_directory = os.path.join(path_to_folder, "audio_segments")
@@ -124,7 +127,8 @@ def read_segments_from_folder(path_to_folder):
 def read_audio_segs_from_folder(path_to_folder) -> Dict[str, str]:
     directory = path_to_folder
     audio_base64 = []
-    for entry in os.scandir(directory):
+    # Sorted so that the n-th audio chunk lines up with the n-th frame segment
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
         if entry.is_file():  # check if it's a file
             logger.info(entry.name)
             audio_path = os.path.join(directory, entry.name)
@@ -133,26 +137,25 @@ def read_audio_segs_from_folder(path_to_folder) -> Dict[str, str]:
             audio_base64.append(f"{convert}")
     return audio_base64
 
-def llm_requests(chat_model, path_to_folder):
+def llm_requests(chat_model, path_to_folder, model_config: dict = None):
     """
     Create a list of LLM requests from the base64 encoded images.
+    Segments are independent, so they are requested concurrently under the provider rate limits
+    and every parsed segment is written to transcript.partial.json as soon as it completes.
 
     Returns:
         List[Dict[str, str]]: A list of dictionaries containing image data for LLM requests.
     """
-
-
+    if model_config is None:
+        model_config = AssistantConfiguration().default_llm_model
+    rate_limiter = get_rate_limiter(model_config)
 
     # Read frames from the folder and convert to base64
     base64_audio, base64_img = read_segments_from_folder(path_to_folder) #"../docs/frames"
-    req_output_list = []
 
-
-    idx = 0
+    segment_requests = []
     for audio_seg, image_seg_list in zip(base64_audio, base64_img):
         req_parts = [{"type": "text", "text": prompts.FINAL_PROMPT}]
-        logger.info("processing segment: %d", idx)
-        idx += 1
         req_parts.append(
             {
                 "type": "media",
@@ -169,12 +172,47 @@ def llm_requests(chat_model, path_to_folder):
                     "mime_type": "image/jpeg",
                 }
             )
-        req_output = get_llm_response(req_parts, chat_model)
-        req_output_list.append(req_output)
+        segment_requests.append(req_parts)
+
+    def process_segment(idx: int, req_parts: List[Dict[str, str]]):
+        logger.info("processing segment: %d", idx)
+        return get_llm_response(req_parts, chat_model)
+
+    req_output_list = [None] * len(segment_requests)
+    with ThreadPoolExecutor(max_workers=rate_limiter.max_concurrency) as executor:
+        futures = {executor.submit(contextvars.copy_context().run, process_segment, idx, req_parts): idx
+                   for idx, req_parts in enumerate(segment_requests)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            req_output_list[idx] = future.result()
+            logger.info("segment %d completed", idx)
+            # Pending segments are kept as null so that every result stays at its segment index, transcript.json
+            # itself is only written once every segment is transcribed
+            if any(output is None for output in req_output_list):
+                write_transcript(path_to_folder, req_output_list, partial=True)
 
     return req_output_list
 
 
+def write_transcript(path_to_folder: str, output_list: list, partial: bool = False):
+    """
+    Atomically write the list of segment transcripts to transcript.json, or to transcript.partial.json while
+    segments are pending, so that a transcript.json left by an interrupted ingestion is never incomplete.
+    :param path_to_folder: folder path where transcript.json is stored
+    :param output_list: segment transcripts ordered by segment index, null for the pending segments
+    :param partial: True while segments are pending
+    """
+    transcript_path = os.path.join(path_to_folder, 'transcript.json')
+    partial_path = os.path.join(path_to_folder, constants.PARTIAL_TRANSCRIPT_FILE)
+    target_path = partial_path if partial else transcript_path
+    tmp_path = target_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(json.dumps(output_list))
+    os.replace(tmp_path, target_path)
+    if not partial and os.path.exists(partial_path):
+        os.remove(partial_path)
+
+
 
 def get_llm_response(req_parts: List[Dict[str, str]], chat_model: BaseChatModel) -> list[dict]:
     """
@@ -190,13 +228,13 @@ def get_llm_response(req_parts: List[Dict[str, str]], chat_model: BaseChatModel)
         ])
     ]
     # Generate the frame transcript
-    frame_transcript = chat_model.invoke(messages)
+    frame_transcript = invoke_llm(chat_model, messages, config=token_stage_config("segment_transcript"))
     logger.debug(f"Generated transcript: {frame_transcript.content}")
     print(f"Generated transcript: {frame_transcript.content}")
     # Use the parser
     parser = FrameJsonOutputParser()
 
-    parsed_output = parser.parse(frame_transcript.content)
+    parsed_output = parser.parse(frame_transcript.content, salvage=True)
 
     return parsed_output
 
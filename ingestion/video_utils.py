@@ -0,0 +1,131 @@
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+from agent.config.initialize_logger import logger
+from ingestion import constants
+from ingestion.transcript_store import load_transcript_document
+
+_extraction_slots = threading.BoundedSemaphore(constants.MAX_CONCURRENT_EXTRACTIONS)
+
+
+def compute_video_id(video_hash: str, length: int) -> str:
+    """
+    Compute a unique fingerprint for a video by hashing together:
+      1. The video's content hash (SHA-256 hex digest)
+      2. The video's length in bytes
+
+    Args:
+        video_hash (str): SHA-256 hex digest of the video content.
+        length (int): Length of the video file in bytes.
+
+    Returns:
+        str: SHA-256 hex digest of the concatenated input.
+    """
+    # Combine the two pieces of data in a canonical way
+    payload = f"{video_hash}:{length}"
+    # Compute and return the SHA-256 of that payload
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_output_id(video_id: str, consider_audio: bool = True, consider_video: bool = True) -> str:
+    """
+    Name of the output folder of a video ingested with the given modalities, the video id when both are
+    considered, so that a single-modality transcript is never served for another modality set.
+    """
+    if consider_audio and consider_video:
+        return video_id
+    return f"{video_id}_{'audio' if consider_audio else 'video'}"
+
+
+def compute_file_video_id(video_path: str) -> str:
+    """
+    Compute the video id of a video file, reading it in chunks.
+    :param video_path: Path to the video file.
+    :return: str: the same video id as the UI computes for an upload of that file
+    """
+    file_hash = hashlib.sha256()
+    with open(video_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(constants.HASH_CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+    return compute_video_id(file_hash.hexdigest(), os.path.getsize(video_path))
+
+
+def persist_upload(upload: BinaryIO, input_dir: str) -> tuple[str, str]:
+    """
+    Hash and persist an uploaded video in a single pass: the upload is read in HASH_CHUNK_SIZE chunks, each
+    chunk updates the hash and is written to a temporary file, which is renamed to <video_id>.mp4 once the
+    video id is known. Peak memory is one chunk whatever the size of the upload.
+    :param upload: File-like object of the upload, read from its current position.
+    :param input_dir: Folder the video is persisted in.
+    :return: tuple[str, str]: the video id and the path of the persisted video
+    """
+    os.makedirs(input_dir, exist_ok=True)
+    file_hash = hashlib.sha256()
+    length = 0
+    tmp_file = tempfile.NamedTemporaryFile(dir=input_dir, suffix='.part', delete=False)
+    try:
+        with tmp_file:
+            for chunk in iter(lambda: upload.read(constants.HASH_CHUNK_SIZE), b''):
+                file_hash.update(chunk)
+                tmp_file.write(chunk)
+                length += len(chunk)
+        video_id = compute_video_id(file_hash.hexdigest(), length)
+        video_path = os.path.join(input_dir, f'{video_id}.mp4')
+        if os.path.isfile(video_path) and os.path.getsize(video_path) == length:
+            # Same content already persisted by a previous upload
+            os.remove(tmp_file.name)
+        else:
+            os.replace(tmp_file.name, video_path)
+    except Exception:
+        if os.path.exists(tmp_file.name):
+            os.remove(tmp_file.name)
+        raise
+    return video_id, video_path
+
+
+def promote_upload(video_path: str, input_dir: str) -> str:
+    """
+    Move a video persisted by persist_upload in another folder (e.g. the pending uploads of a session) to
+    input_dir under the same name, without reading it again.
+    :param video_path: Path of the persisted video, named after its video id.
+    :param input_dir: Folder the video is moved to.
+    :return: str: the path of the video in input_dir
+    """
+    os.makedirs(input_dir, exist_ok=True)
+    target_path = os.path.join(input_dir, os.path.basename(video_path))
+    if os.path.isfile(target_path) and os.path.getsize(target_path) == os.path.getsize(video_path):
+        # Same content already persisted by a previous upload
+        os.remove(video_path)
+    else:
+        os.replace(video_path, target_path)
+    return target_path
+
+
+def is_video_ingested(output_dir: str) -> bool:
+    """
+    True when output_dir holds the final (not partial) transcript of an ingestion.
+    """
+    document = load_transcript_document(output_dir)
+    return document is not None and not document['metadata'].get('partial', False)
+
+
+def set_max_concurrent_extractions(max_extractions: int) -> None:
+    """
+    Change the process-wide cap on concurrent frame/audio extractions, before any ingestion starts.
+    """
+    global _extraction_slots
+    _extraction_slots = threading.BoundedSemaphore(max(1, max_extractions))
+
+
+@contextmanager
+def extraction_slot() -> Iterator[None]:
+    """
+    Hold one of the process-wide extraction slots, bounding the CPU used by concurrent ingestions.
+    """
+    slots = _extraction_slots
+    with slots:
+        yield
@@ -0,0 +1,31 @@
+import subprocess
+
+import pytest
+
+from agent.config import constants as agent_constants
+from ingestion import constants
+
+
+@pytest.fixture(scope="session")
+def video_path(tmp_path_factory) -> str:
+    """
+    20s test pattern video with a tone, changing scene every 5s.
+    """
+    path = str(tmp_path_factory.mktemp("video") / "video.mp4")
+    subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=duration=20:size=320x180:rate=10",
+                    "-f", "lavfi", "-i", "sine=frequency=440:duration=20", "-vf", "hue=h=t*18",
+                    "-shortest", "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac", path], check=True)
+    return path
+
+
+@pytest.fixture
+def offline(tmp_path, monkeypatch):
+    """
+    Ingestions answered by the fake provider, without the LLM and segment caches, batches and calibration
+    kept under tmp_path.
+    """
+    monkeypatch.setattr(agent_constants, 'PROVIDER', 'fake')
+    monkeypatch.setattr(agent_constants, 'MODEL_NAME', 'fake-ingestion')
+    monkeypatch.setattr(constants, 'SEGMENT_CACHE_ENABLED', False)
+    monkeypatch.setattr(constants, 'BATCH_DIR', str(tmp_path / 'batches'))
+    monkeypatch.setattr(constants, 'PREDICTOR_DOCS_DIR', str(tmp_path))
@@ -0,0 +1,40 @@
+import json
+import os
+
+from agent.config.assistant_config import AssistantConfiguration
+from ingestion import combined_text_transcriptor, constants
+from ingestion.batch_api import LocalBatchExecutor, complete_batch_job, submit_batch_job, wait_for_batch_job
+from ingestion.manifest import Stage, read_manifest
+from ingestion.transcript_store import load_transcript_document
+
+
+def test_batch_job_ingests_offline(offline, video_path, tmp_path, monkeypatch):
+    executor = LocalBatchExecutor(AssistantConfiguration().default_llm_model, root_dir=str(tmp_path / 'local'))
+    output_dir = str(tmp_path / 'out')
+    job = submit_batch_job([(video_path, output_dir)], constants.SEGMENT_DURATION_AUTO, executor=executor)
+    assert job.batch_id is not None and not job.errors
+    with open(os.path.join(job.job_dir, 'index.json')) as f:
+        index = json.load(f)
+    requests = {stage.value: sum(1 for entry in index.values() if entry["stage"] == stage.value)
+                for stage in (Stage.AUDIO_TRANSCRIPT, Stage.FRAME_TRANSCRIPTS)}
+    assert all(requests.values())
+    assert wait_for_batch_job(job, executor, poll_seconds=0.05).value == "done"
+
+    # The ingestion resumes the manifest of the segments extracted by the job, without choosing their duration again
+    def choose_segment_duration(*args):
+        raise AssertionError("segment duration chosen again")
+
+    monkeypatch.setattr(combined_text_transcriptor, 'choose_segment_duration', choose_segment_duration)
+    assert complete_batch_job(job, executor) == {}
+    stages = read_manifest(output_dir)["stages"]
+    for stage in requests:
+        assert stages[stage]["complete"]
+    assert sum(len(stages[stage]["units"]) for stage in requests) == \
+        sum(len(entry["units"]) for entry in index.values())
+    document = load_transcript_document(output_dir)
+    assert document is not None and not document['metadata'].get('partial', False)
+    # Only the combination is requested interactively, every frame and audio request was answered by the batch
+    with open(os.path.join(output_dir, 'token_usage.json')) as f:
+        usage = json.load(f)["stages"]
+    for stage, count in requests.items():
+        assert usage[stage]["requests"] == count
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from agent.utils.cancellation import CancellationToken, OperationCancelledError, cancellation_scope, run_subprocess
+
+
+def test_cancellation_kills_the_subprocess(monkeypatch):
+    processes = []
+
+    class RecordedPopen(subprocess.Popen):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            processes.append(self)
+
+    monkeypatch.setattr(subprocess, 'Popen', RecordedPopen)
+    token = CancellationToken()
+    threading.Timer(0.2, token.cancel).start()
+    started = time.monotonic()
+    with cancellation_scope(token), pytest.raises(OperationCancelledError):
+        run_subprocess([sys.executable, "-c", "import time; time.sleep(30)"])
+    assert time.monotonic() - started < 10
+    assert len(processes) == 1 and processes[0].returncode is not None
+
+
+def test_cancelled_token_does_not_start_the_subprocess(monkeypatch):
+    token = CancellationToken()
+    token.cancel()
+    monkeypatch.setattr(subprocess, 'Popen', lambda *args, **kwargs: pytest.fail("subprocess started"))
+    with cancellation_scope(token), pytest.raises(OperationCancelledError):
+        run_subprocess([sys.executable, "-c", "pass"])
+
+
+def test_subprocess_runs_without_a_token():
+    result = run_subprocess([sys.executable, "-c", "print('done')"], text=True)
+    assert result.returncode == 0 and result.stdout.strip() == "done"
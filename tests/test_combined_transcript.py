@@ -0,0 +1,20 @@
+import json
+
+from agent.config.offline_models import FakeChatModel
+from ingestion.combined_text_transcriptor import llm_requests
+
+SEGMENTS = {
+    f"{idx:03d}": {"audio_transcript": {"transcript": [{"speaker": "A", "text": f"part {idx}"}]},
+                   "frame_transcript": {"title": [f"{idx:03d}/frame.jpg"], "details": [f"slide {idx}"]}}
+    for idx in range(3)
+}
+
+
+def test_single_request_keeps_the_model_response():
+    transcript = llm_requests(FakeChatModel(), SEGMENTS, combine_mode="single")
+    assert json.loads(transcript["combined_transcript"]) == {"combined_transcript": "Fake combined transcript of the video."}
+
+
+def test_map_reduce_combination_is_plain_text():
+    transcript = llm_requests(FakeChatModel(), SEGMENTS, combine_mode="map_reduce")
+    assert transcript == {"combined_transcript": "Fake combined transcript of the video."}
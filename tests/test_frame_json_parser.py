@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from ingestion.frame_json_parser import FrameJsonOutputParser, IncrementalJsonParser
+
+FRAMES = [{"frame": f"000/{idx}.jpg", "transcript": f"Frame {idx} [slide] {{title}}"} for idx in range(3)]
+
+
+def test_complete_output_is_parsed_as_a_whole():
+    partial = FrameJsonOutputParser().parse_partial("```json\n" + json.dumps(FRAMES) + "\n```")
+    assert partial.complete and partial.value == FRAMES and partial.dropped == []
+
+
+def test_truncated_array_keeps_the_complete_items():
+    text = json.dumps(FRAMES)[:-20]
+    partial = FrameJsonOutputParser().parse_partial(text)
+    assert not partial.complete
+    assert partial.value == FRAMES[:2]
+    assert len(partial.dropped) == 1 and partial.dropped[0].startswith('{"frame": "000/2.jpg"')
+
+
+def test_truncated_object_keeps_the_complete_members_and_elements():
+    transcript = {"transcript": [{"speaker": "A", "text": "Hello."}, {"speaker": "B", "text": "How are"}]}
+    partial = FrameJsonOutputParser().parse_partial(json.dumps(transcript)[:-5])
+    assert partial.value == {"transcript": [{"speaker": "A", "text": "Hello."}]}
+    assert len(partial.dropped) == 1
+
+    partial = FrameJsonOutputParser().parse_partial('{"title": "Intro", "details": "Slides", "summ')
+    assert partial.value == {"title": "Intro", "details": "Slides"}
+    assert partial.dropped == ['"summ']
+
+
+def test_broken_item_among_good_items_is_dropped():
+    items = [json.dumps(frame) for frame in FRAMES]
+    items[1] = '{"frame": "000/1.jpg", "transcript": unquoted}'
+    partial = FrameJsonOutputParser().parse_partial("[" + ", ".join(items) + "]")
+    assert not partial.complete
+    assert partial.value == [FRAMES[0], FRAMES[2]]
+    assert partial.dropped == [items[1]]
+
+
+def test_salvage():
+    parser = FrameJsonOutputParser()
+    text = json.dumps(FRAMES)[:-20]
+    with pytest.raises(ValueError):
+        parser.parse(text)
+    assert parser.parse(text, salvage=True) == FRAMES[:2]
+    with pytest.raises(ValueError):
+        parser.parse_partial("No JSON in this output")
+
+
+def test_items_are_completed_as_chunks_are_fed():
+    text = "```json\n" + json.dumps(FRAMES) + "\n```"
+    parser = IncrementalJsonParser()
+    completed = []
+    for idx, char in enumerate(text):
+        items = parser.feed(char)
+        if items:
+            # An item is emitted by the character that ends it, not before
+            assert text[idx] in ",]"
+        completed.extend(items)
+    assert completed == FRAMES
+    assert parser.done
+    assert parser.result().value == FRAMES
+
+
+def test_brackets_and_quotes_inside_strings_do_not_end_items():
+    items = [{"text": 'He said "]}" then {"a": [1'}, {"text": "back\\slash ] } ["}]
+    parser = IncrementalJsonParser()
+    completed = []
+    for char in json.dumps(items):
+        completed.extend(parser.feed(char))
+    assert completed == items
+    assert parser.result().complete
+
+
+def test_dropped_counts_every_unrecovered_item():
+    text = '[{"a": 1}, {"b": oops}, {"c": 3}, {"d": nope}, {"e": 5'
+    partial = FrameJsonOutputParser().parse_partial(text)
+    assert partial.value == [{"a": 1}, {"c": 3}]
+    assert len(partial.dropped) == 3
+
+
+def test_invalid_escapes_are_fixed_without_breaking_escaped_backslashes():
+    assert FrameJsonOutputParser().parse(r'{"path": "C:\docs\\notes", "quote": "\"a\""}') == \
+        {"path": "C:\\docs\\notes", "quote": '"a"'}
@@ -0,0 +1,86 @@
+import json
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from ingestion.frame_transcript_generator import parse_batch_response, transcribe_frames
+from ingestion.manifest import IngestionManifest, Stage
+
+BATCH = ["000/a.jpg", "000/b.jpg", "000/c.jpg"]
+
+
+def frame_item(frame: str) -> dict:
+    return {"frame": frame, "raw_text": f"text of {frame}", "explanation": "", "transcript": f"transcript of {frame}"}
+
+
+def test_batch_response_is_mapped_back_to_its_frames():
+    response = "```json\n" + json.dumps([frame_item(frame) for frame in reversed(BATCH)]) + "\n```"
+    batch_output = parse_batch_response(response, BATCH)
+    assert sorted(batch_output) == BATCH
+    assert json.loads(batch_output["000/b.jpg"]) == {"raw_text": "text of 000/b.jpg", "explanation": "",
+                                                     "transcript": "transcript of 000/b.jpg"}
+
+
+def test_frames_not_in_the_batch_are_ignored():
+    response = json.dumps([frame_item("000/a.jpg"), frame_item("001/a.jpg"), {"raw_text": "no frame name"}])
+    assert list(parse_batch_response(response, BATCH)) == ["000/a.jpg"]
+    # A single frame answered with an object instead of an array
+    assert list(parse_batch_response(json.dumps(frame_item("000/c.jpg")), BATCH)) == ["000/c.jpg"]
+
+
+def test_frames_of_a_truncated_response_are_salvaged():
+    response = json.dumps([frame_item(frame) for frame in BATCH])
+    assert sorted(parse_batch_response(response[:-40], BATCH)) == BATCH[:2]
+    assert parse_batch_response("Sorry, I cannot describe these frames.", BATCH) == {}
+
+
+class ScriptedModel:
+    """
+    Chat model answering the batched requests with the frames of the script, and single frame requests with
+    the transcript of the frame.
+    """
+
+    def __init__(self, *batch_answers: list):
+        self.batch_answers = list(batch_answers)
+        self.requests = []
+
+    def __call__(self, messages) -> AIMessage:
+        frames = [block["text"][len("Frame: "):] for block in messages[0].content
+                  if block.get("type") == "text" and block["text"].startswith("Frame: ")]
+        if frames:
+            self.requests.append(frames)
+            answered = self.batch_answers.pop(0) if self.batch_answers else frames
+            return AIMessage(content=json.dumps([frame_item(frame) for frame in answered]))
+        image = messages[0].content[1]["image_url"]
+        frame = next(name for name in BATCH if image.endswith(name.encode().hex()))
+        self.requests.append(frame)
+        return AIMessage(content=json.dumps({"transcript": f"single transcript of {frame}"}))
+
+
+def transcribe(model: ScriptedModel, **kwargs) -> dict:
+    base64_img = {frame: frame.encode().hex() for frame in BATCH}
+    return transcribe_frames(RunnableLambda(model), base64_img, batch_size=4, token_budget=10 ** 6, **kwargs)
+
+
+def test_frame_missing_from_the_batch_falls_back_to_a_single_request(offline, tmp_path):
+    model = ScriptedModel(BATCH[:1] + BATCH[2:])
+    manifest = IngestionManifest(str(tmp_path), {})
+    frame_outputs = transcribe(model, manifest=manifest)
+    assert model.requests == [BATCH, "000/b.jpg"]
+    assert json.loads(frame_outputs["000/b.jpg"]) == {"transcript": "single transcript of 000/b.jpg"}
+    assert json.loads(frame_outputs["000/a.jpg"])["transcript"] == "transcript of 000/a.jpg"
+    assert manifest.get_units(Stage.FRAME_TRANSCRIPTS) == frame_outputs
+
+
+def test_missing_frames_are_batched_again_before_falling_back(offline):
+    model = ScriptedModel(BATCH[:1], BATCH[1:2])
+    frame_outputs = transcribe(model)
+    assert model.requests == [BATCH, BATCH[1:], "000/c.jpg"]
+    assert sorted(frame_outputs) == BATCH
+
+
+def test_every_frame_falls_back_to_a_single_request_on_an_empty_batch(offline):
+    model = ScriptedModel([])
+    frame_outputs = transcribe(model)
+    assert model.requests == [BATCH] + BATCH
+    assert all(json.loads(frame_outputs[frame]) == {"transcript": f"single transcript of {frame}"} for frame in BATCH)
@@ -0,0 +1,152 @@
+import threading
+import time
+
+import pytest
+
+from ingestion import combined_text_transcriptor, constants, job_manager
+from ingestion.job_manager import Job, JobManager, JobStatus, JobStore, get_job_progress
+from ingestion.manifest import IngestionManifest, Stage, read_manifest
+from ingestion.transcript_store import TranscriptStore
+
+
+class FakeIngestion:
+    """
+    Stand-in of generate_transcript recording the ingested videos, each blocking until it is released.
+    """
+
+    def __init__(self):
+        self.started = []
+        self.released = {}
+        self.lock = threading.Lock()
+
+    def release(self, video_path: str) -> None:
+        with self.lock:
+            self.released.setdefault(video_path, threading.Event()).set()
+
+    def __call__(self, video_path, output_dir, *args, **kwargs):
+        with self.lock:
+            self.started.append(video_path)
+            released = self.released.setdefault(video_path, threading.Event())
+        assert released.wait(timeout=10)
+        return "{}", output_dir
+
+
+@pytest.fixture
+def ingestion(monkeypatch):
+    fake = FakeIngestion()
+    monkeypatch.setattr(constants, 'PIPELINED_INGESTION', False)
+    monkeypatch.setattr(combined_text_transcriptor, 'generate_transcript', fake)
+    return fake
+
+
+@pytest.fixture
+def predictions(monkeypatch):
+    predicted = {}
+    monkeypatch.setattr(job_manager, 'predict_seconds', lambda video_path, *args: predicted.get(video_path))
+    return predicted
+
+
+def wait_for(condition, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+def test_finished_jobs_are_not_watched(tmp_path):
+    manager = JobManager(JobStore(str(tmp_path / "jobs.sqlite")), max_workers=1)
+    manager.watch("finished", "session")
+    assert manager._watchers == {}
+    manager.unwatch("finished", "session")
+    assert manager._watchers == {}
+
+
+def test_video_being_ingested_is_not_submitted_twice(tmp_path, ingestion, predictions):
+    manager = JobManager(JobStore(str(tmp_path / "jobs.sqlite")), max_workers=2)
+    output_dir = str(tmp_path / "video")
+    job_id = manager.submit("video.mp4", output_dir, 15, watcher="first session")
+    wait_for(lambda: ingestion.started == ["video.mp4"])
+    assert manager.submit("video.mp4", output_dir, 15, watcher="second session") == job_id
+    assert set(manager._watchers[job_id]) == {"first session", "second session"}
+    # Another modality set is another output folder, ingested separately
+    other_id = manager.submit("video.mp4", output_dir + "_audio", 15, consider_video=False)
+    assert other_id != job_id
+
+    ingestion.release("video.mp4")
+    wait_for(lambda: manager.get_job(job_id).status == JobStatus.DONE.value)
+    wait_for(lambda: manager.get_job(other_id).status == JobStatus.DONE.value)
+    # A finished video is submitted again as a new job (that finds its transcript)
+    assert manager.submit("video.mp4", output_dir, 15) != job_id
+
+
+def test_shortest_predicted_job_runs_first(tmp_path, ingestion, predictions):
+    manager = JobManager(JobStore(str(tmp_path / "jobs.sqlite")), max_workers=1)
+    predictions.update({"long.mp4": 100.0, "short.mp4": 1.0, "medium.mp4": 10.0})
+    manager.submit("running.mp4", str(tmp_path / "running"), 15)
+    wait_for(lambda: ingestion.started == ["running.mp4"])
+    for name in ("long", "unknown", "short", "medium"):
+        manager.submit(f"{name}.mp4", str(tmp_path / name), 15)
+    for name in ("running", "short", "medium", "long", "unknown"):
+        ingestion.release(f"{name}.mp4")
+    wait_for(lambda: len(ingestion.started) == 5)
+    # Videos that could not be predicted run last
+    assert ingestion.started == ["running.mp4", "short.mp4", "medium.mp4", "long.mp4", "unknown.mp4"]
+
+
+def test_progress_is_read_from_the_manifest_and_the_store(tmp_path):
+    output_dir = str(tmp_path)
+    manifest = IngestionManifest(output_dir, {"segment_duration": 15})
+    manifest.record_unit(Stage.SEGMENTED, "plan", {"boundaries": [15.0, 30.0, 45.0], "duration": 60.0})
+    manifest.complete_stage(Stage.SEGMENTED)
+    manifest.complete_stage(Stage.FRAMES_EXTRACTED)
+    manifest.complete_stage(Stage.AUDIO_CHUNKED)
+    for segment_id in ("000", "001"):
+        manifest.record_unit(Stage.AUDIO_TRANSCRIPT, f"{segment_id}.wav", {"transcript": []})
+        for frame in ("a", "b"):
+            (tmp_path / "frames" / segment_id).mkdir(parents=True, exist_ok=True)
+            (tmp_path / "frames" / segment_id / f"{frame}.jpg").write_bytes(b"jpg")
+    manifest.record_unit(Stage.FRAME_TRANSCRIPTS, "000/a.jpg", {"transcript": "a"})
+    store = TranscriptStore(output_dir)
+    store.put_segment("000", {"audio_transcript": {}, "frame_transcript": {}})
+    store.put_segment("001", {"audio_transcript": {}, "frame_transcript": {}}, complete=False)
+
+    job = Job(job_id="job", video_path="video.mp4", output_dir=output_dir, segment_duration=15,
+              status=JobStatus.RUNNING.value, started=time.time() - 30.0, predicted_seconds=200.0)
+    progress = get_job_progress(job)
+    assert progress.stage == Stage.AUDIO_TRANSCRIPT.value
+    assert progress.frames_extracted == 4
+    assert progress.frames_transcribed == 1
+    assert progress.audio_chunks_transcribed == 2
+    assert progress.segments_total == 4
+    assert progress.segments_transcribed == 1
+    assert not progress.partial_available
+    # Extrapolated from the segments transcribed in the elapsed time
+    assert progress.eta_seconds == pytest.approx(90.0, rel=0.05)
+
+
+def test_cancelled_job_stops_its_pending_segments(tmp_path, video_path, offline, monkeypatch):
+    from ingestion import audio_transcript_generator
+    from ingestion.video_utils import is_video_ingested
+
+    monkeypatch.setattr(constants, 'PIPELINED_INGESTION', False)
+    requested, cancelled = [], threading.Event()
+    invoke_audio_request = audio_transcript_generator.invoke_audio_request
+
+    def first_request_in_flight(prompt, audio_base64, chat_model):
+        requested.append(audio_base64)
+        assert cancelled.wait(timeout=10)
+        return invoke_audio_request(prompt, audio_base64, chat_model)
+
+    monkeypatch.setattr(audio_transcript_generator, 'invoke_audio_request', first_request_in_flight)
+    manager = JobManager(JobStore(str(tmp_path / "jobs.sqlite")), max_workers=1)
+    output_dir = str(tmp_path / "video")
+    job_id = manager.submit(video_path, output_dir, 5, consider_video=False)
+    wait_for(lambda: len(requested) == 1)
+    manager.cancel(job_id)
+    cancelled.set()
+
+    wait_for(lambda: manager.get_job(job_id).status == JobStatus.CANCELLED.value)
+    # The 3 other segments of the video are never requested
+    assert len(requested) == 1
+    assert read_manifest(output_dir)["stages"].get(Stage.AUDIO_TRANSCRIPT.value, {}).get("units", {}) == {}
+    assert not is_video_ingested(output_dir)
@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+
+from agent.utils.cancellation import CancellationToken, cancellation_scope, get_cancellation_token
+from ingestion.lease import IngestionLease, ingestion_lease
+
+
+def write_stale_lease(output_dir: str, token: str = "crashed") -> str:
+    path = os.path.join(output_dir, IngestionLease.FILE_NAME)
+    with open(path, 'w') as f:
+        json.dump({"token": token}, f)
+    aged = time.time() - 3600
+    os.utime(path, (aged, aged))
+    return path
+
+
+def read_lease_token(path: str) -> str:
+    with open(path) as f:
+        return json.load(f)["token"]
+
+
+def test_racing_acquirers_take_over_a_stale_lease_once(tmp_path):
+    for attempt in range(50):
+        output_dir = str(tmp_path / str(attempt))
+        os.makedirs(output_dir)
+        path = write_stale_lease(output_dir)
+        leases = [IngestionLease(output_dir, ttl=60, heartbeat=3600) for _ in range(4)]
+        barrier = threading.Barrier(len(leases))
+        acquired = [False] * len(leases)
+
+        def acquire(index: int) -> None:
+            barrier.wait()
+            acquired[index] = leases[index].try_acquire()
+
+        threads = [threading.Thread(target=acquire, args=(index,)) for index in range(len(leases))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert acquired.count(True) == 1
+        winner = leases[acquired.index(True)]
+        assert read_lease_token(path) == winner.token
+        assert os.listdir(output_dir) == [IngestionLease.FILE_NAME]
+        winner.release()
+
+
+def test_waiter_with_an_outdated_stale_view_restores_the_new_lease(tmp_path):
+    path = write_stale_lease(str(tmp_path))
+    winner = IngestionLease(str(tmp_path), ttl=60, heartbeat=3600)
+    loser = IngestionLease(str(tmp_path), ttl=60, heartbeat=3600)
+    is_stale = loser._is_stale
+
+    def stale_then_overtaken(stale_path: str = None) -> bool:
+        stale = is_stale(stale_path)
+        if stale_path is None:
+            # The winner takes the lease over between the staleness check and the rename of the loser
+            assert winner.try_acquire()
+        return stale
+
+    loser._is_stale = stale_then_overtaken
+    assert not loser.try_acquire()
+    assert read_lease_token(path) == winner.token
+    winner.release()
+    assert not os.path.exists(path)
+
+
+def test_lost_lease_cancels_the_holder(tmp_path):
+    token = CancellationToken()
+    with cancellation_scope(token):
+        lease = IngestionLease(str(tmp_path), ttl=60, heartbeat=0.05)
+        assert lease.try_acquire()
+    with open(lease.path, 'w') as f:
+        json.dump({"token": "other"}, f)
+    deadline = time.monotonic() + 5
+    while not token.is_cancelled and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert token.is_cancelled
+    lease.release()
+    assert read_lease_token(lease.path) == "other"
+
+
+def test_ingestion_lease_gives_the_holder_a_cancellation_token(tmp_path):
+    assert get_cancellation_token() is None
+    with ingestion_lease(str(tmp_path)):
+        assert get_cancellation_token() is not None
+    assert get_cancellation_token() is None
+    assert not os.listdir(tmp_path)
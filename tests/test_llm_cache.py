@@ -0,0 +1,117 @@
+import sqlite3
+import time
+
+import pytest
+from langchain_core.outputs import Generation
+
+from agent.config import constants, llm_cache
+from agent.config.llm_cache import LLMCacheMode, SQLiteLLMCache, get_llm_cache
+from agent.config.offline_models import FakeChatModel
+
+MODEL = {'provider': 'fake', 'model_name': 'test-cache', 'max_tokens': 1000}
+
+
+def make_cache(tmp_path, **kwargs) -> SQLiteLLMCache:
+    return SQLiteLLMCache({**MODEL, **kwargs.pop('model', {})}, path=str(tmp_path / "cache.sqlite"), **kwargs)
+
+
+def count_entries(cache: SQLiteLLMCache) -> int:
+    with cache._connect() as conn:
+        return conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+def test_hit_and_miss(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.lookup("prompt", "llm") is None
+    cache.update("prompt", "llm", [Generation(text="answer")])
+    assert [generation.text for generation in cache.lookup("prompt", "llm")] == ["answer"]
+    assert cache.lookup("other prompt", "llm") is None
+    cache.clear()
+    assert cache.lookup("prompt", "llm") is None
+
+
+def test_key_depends_on_the_model_and_the_request(tmp_path):
+    key = make_cache(tmp_path).cache_key("prompt", "llm")
+    assert make_cache(tmp_path).cache_key("prompt", "llm") == key
+    assert make_cache(tmp_path, model={'provider': 'openai'}).cache_key("prompt", "llm") != key
+    assert make_cache(tmp_path, model={'model_name': 'other'}).cache_key("prompt", "llm") != key
+    assert make_cache(tmp_path, model={'max_tokens': 10}).cache_key("prompt", "llm") != key
+    assert make_cache(tmp_path).cache_key("other prompt", "llm") != key
+    assert make_cache(tmp_path).cache_key("prompt", "temperature=1") != key
+
+
+def test_modes(tmp_path):
+    make_cache(tmp_path).update("recorded", "llm", [Generation(text="recorded answer")])
+
+    read_only = make_cache(tmp_path, mode=LLMCacheMode.READ_ONLY)
+    assert read_only.lookup("recorded", "llm")[0].text == "recorded answer"
+    read_only.update("new", "llm", [Generation(text="new answer")])
+    assert make_cache(tmp_path).lookup("new", "llm") is None
+
+    write_only = make_cache(tmp_path, mode=LLMCacheMode.WRITE_ONLY)
+    assert write_only.lookup("recorded", "llm") is None
+    write_only.update("recorded", "llm", [Generation(text="refreshed answer")])
+    assert make_cache(tmp_path).lookup("recorded", "llm")[0].text == "refreshed answer"
+
+    off = make_cache(tmp_path, mode=LLMCacheMode.OFF)
+    assert off.lookup("recorded", "llm") is None
+    off.update("off", "llm", [Generation(text="off answer")])
+    assert make_cache(tmp_path).lookup("off", "llm") is None
+
+
+def test_get_llm_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, '_llm_caches', {})
+    monkeypatch.setattr(constants, 'LLM_CACHE_PATH', str(tmp_path / "cache.sqlite"))
+    model = {'provider': 'fake', 'model_name': 'test-get'}
+    monkeypatch.setattr(constants, 'LLM_CACHE_MODE', 'off')
+    assert get_llm_cache(model) is None
+    monkeypatch.setattr(constants, 'LLM_CACHE_MODE', 'read_only')
+    assert get_llm_cache(model).mode == LLMCacheMode.READ_ONLY
+    assert get_llm_cache(model) is get_llm_cache(dict(model))
+    monkeypatch.setattr(constants, 'LLM_CACHE_BYPASS', True)
+    assert get_llm_cache(model) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=10 ** 6)
+    for prompt in ("a", "b", "c"):
+        cache.update(prompt, "llm", [Generation(text=prompt * 100)])
+        time.sleep(0.01)
+    cache.lookup("a", "llm")
+    time.sleep(0.01)
+    with cache._connect() as conn:
+        entry_size = conn.execute("SELECT MAX(size) FROM llm_cache").fetchone()[0]
+    cache.max_bytes = 3 * entry_size
+    cache.update("d", "llm", [Generation(text="d" * 100)])
+    assert count_entries(cache) == 3
+    # b is the least recently used entry, a was read after it
+    assert cache.lookup("b", "llm") is None
+    assert all(cache.lookup(prompt, "llm") is not None for prompt in ("a", "c", "d"))
+
+
+def test_model_responses_are_served_from_the_cache(tmp_path):
+    cache = make_cache(tmp_path)
+    llm = FakeChatModel(model_name=MODEL['model_name'], cache=cache)
+    first = llm.invoke("hello")
+    assert count_entries(cache) == 1
+    llm.error_rate = 1.0
+    # A provider error would be raised if the request was not served from the cache
+    assert llm.invoke("hello").content == first.content
+
+
+def test_connections_are_closed(tmp_path, monkeypatch):
+    connections = []
+    sqlite_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        connections.append(sqlite_connect(*args, **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr(llm_cache.sqlite3, 'connect', connect)
+    cache = SQLiteLLMCache({'provider': 'fake', 'model_name': 'test-close'}, path=str(tmp_path / "cache.sqlite"))
+    assert cache.lookup("prompt", "llm") is None
+    cache.clear()
+    assert len(connections) == 3
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
@@ -0,0 +1,69 @@
+import json
+import os
+
+from ingestion.manifest import IngestionManifest, Stage, read_manifest
+
+PARAMS = {"video_size": 1000, "segment_duration": 30}
+
+
+def read_file(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def test_units_are_journaled_until_the_stage_completes(tmp_path):
+    manifest = IngestionManifest(str(tmp_path), PARAMS)
+    manifest.record_unit(Stage.FRAME_TRANSCRIPTS, "000.jpg", {"title": "a"})
+    snapshot = read_file(manifest.path)
+    for index in range(1, 4):
+        manifest.record_unit(Stage.FRAME_TRANSCRIPTS, f"{index:03d}.jpg", {"title": "b"})
+    # Only the journal grows, the manifest is not rewritten
+    assert read_file(manifest.path) == snapshot
+    assert len(read_file(manifest.journal_path).splitlines()) == 3
+    assert len(read_manifest(str(tmp_path))["stages"][Stage.FRAME_TRANSCRIPTS.value]["units"]) == 4
+
+    manifest.complete_stage(Stage.FRAME_TRANSCRIPTS)
+    assert read_file(manifest.journal_path) == ""
+    with open(manifest.path) as f:
+        stage = json.load(f)["stages"][Stage.FRAME_TRANSCRIPTS.value]
+    assert stage["complete"] and len(stage["units"]) == 4
+
+
+def test_resume_replays_the_journal(tmp_path):
+    manifest = IngestionManifest(str(tmp_path), PARAMS)
+    manifest.record_unit(Stage.AUDIO_TRANSCRIPT, "000", {"text": "hello"})
+    manifest.record_unit(Stage.AUDIO_TRANSCRIPT, "001", {"text": "world"})
+    # An ingestion interrupted while appending a unit
+    with open(manifest.journal_path, 'a') as f:
+        f.write('{"stage": "audio_transcript", "unit": "00')
+
+    resumed = IngestionManifest(str(tmp_path), PARAMS)
+    assert resumed.get_units(Stage.AUDIO_TRANSCRIPT) == {"000": {"text": "hello"}, "001": {"text": "world"}}
+    resumed.record_unit(Stage.AUDIO_TRANSCRIPT, "002", {"text": "again"})
+    assert len(IngestionManifest(str(tmp_path), PARAMS).get_units(Stage.AUDIO_TRANSCRIPT)) == 3
+
+
+def test_journal_of_a_discarded_manifest_is_not_replayed(tmp_path):
+    manifest = IngestionManifest(str(tmp_path), PARAMS)
+    manifest.record_unit(Stage.AUDIO_TRANSCRIPT, "000", {"text": "hello"})
+    manifest.record_unit(Stage.AUDIO_TRANSCRIPT, "001", {"text": "world"})
+
+    changed = IngestionManifest(str(tmp_path), {**PARAMS, "segment_duration": 60})
+    assert changed.get_units(Stage.AUDIO_TRANSCRIPT) == {}
+    changed.record_unit(Stage.AUDIO_TRANSCRIPT, "000", {"text": "new"})
+    assert read_manifest(str(tmp_path))["stages"][Stage.AUDIO_TRANSCRIPT.value]["units"] == {"000": {"text": "new"}}
+    assert os.path.getsize(changed.journal_path) == 0
+
+
+def test_segments_of_a_discarded_manifest_are_deleted(tmp_path):
+    manifest = IngestionManifest(str(tmp_path), PARAMS)
+    for folder in IngestionManifest.SEGMENT_FOLDERS:
+        for segment_id in ("000", "001", "002"):
+            os.makedirs(tmp_path / folder / segment_id)
+    manifest.complete_stage(Stage.FRAMES_EXTRACTED)
+
+    IngestionManifest(str(tmp_path), PARAMS)
+    assert sorted(os.listdir(tmp_path / "frames")) == ["000", "001", "002"]
+    IngestionManifest(str(tmp_path), {**PARAMS, "segment_duration": 60})
+    for folder in IngestionManifest.SEGMENT_FOLDERS:
+        assert not os.path.exists(tmp_path / folder)
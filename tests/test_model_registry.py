@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from agent.config import model_registry
+from agent.config.assistant_config import AssistantConfiguration
+from agent.config.model_registry import clear_models, get_or_create_model, warmup_models
+from agent.config.offline_models import FakeChatModel
+
+MODEL = {"provider": "fake", "model_name": "fake-registry", "max_tokens": 1000}
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    clear_models()
+    yield
+    clear_models()
+
+
+class Factory:
+    """
+    Model factory counting the models it creates.
+    """
+
+    def __init__(self):
+        self.created = []
+
+    def __call__(self, model: dict, bypass_cache: bool) -> FakeChatModel:
+        chat_model = FakeChatModel(model_name=model["model_name"], latency_ms=0)
+        self.created.append((model, bypass_cache))
+        return chat_model
+
+
+def test_model_is_shared_per_key():
+    factory = Factory()
+    chat_model = get_or_create_model(MODEL, False, factory)
+    # Same fields in another dict (and order) are the same model
+    assert get_or_create_model(dict(reversed(list(MODEL.items()))), False, factory) is chat_model
+    assert get_or_create_model({**MODEL, "max_tokens": 2000}, False, factory) is not chat_model
+    assert get_or_create_model(MODEL, True, factory) is not chat_model
+    assert len(factory.created) == 3
+
+
+def test_concurrent_first_uses_create_one_model():
+    factory = Factory()
+    barrier = threading.Barrier(8)
+    models = []
+
+    def get_model():
+        barrier.wait()
+        models.append(get_or_create_model(MODEL, False, factory))
+
+    threads = [threading.Thread(target=get_model) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(factory.created) == 1
+    assert all(chat_model is models[0] for chat_model in models)
+
+
+def test_configuration_models_are_shared():
+    configuration = AssistantConfiguration()
+    chat_model = configuration.get_model(MODEL)
+    assert AssistantConfiguration().get_model(MODEL) is chat_model
+    assert len(model_registry._models) == 1
+    clear_models()
+    assert configuration.get_model(MODEL) is not chat_model
+
+
+def test_models_are_warmed_up_once():
+    factory = Factory()
+    warmup_models([MODEL], factory, mode="off")
+    assert factory.created == []
+    warmup_models([MODEL, {**MODEL, "model_name": "broken"}], lambda model, bypass_cache: (
+        factory(model, bypass_cache) if model["model_name"] != "broken" else FakeChatModel(error_rate=1.0)), "request")
+    assert len(factory.created) == 1
+    warmup_models([{**MODEL, "max_tokens": 2000}], factory, mode="init")
+    assert len(factory.created) == 1
+    # Warmed up models are the ones later requests get
+    assert get_or_create_model(MODEL, False, factory) is get_or_create_model(MODEL, False, Factory())
@@ -0,0 +1,31 @@
+import pytest
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration
+
+from agent.config.llm_cache import SQLiteLLMCache, get_request_hash
+from agent.config.offline_models import FakeChatModel, ReplayChatModel, ReplayMissError
+
+MODEL = {'provider': 'fake', 'model_name': 'recorded', 'max_tokens': 1000}
+
+
+def test_replay_serves_the_recorded_responses(tmp_path):
+    cache_path = str(tmp_path / "recordings.sqlite")
+    messages = [HumanMessage(content="Transcribe the frame")]
+    recordings = SQLiteLLMCache(MODEL, path=cache_path)
+    recordings.update(dumps(messages), "recorded llm string", [ChatGeneration(message=AIMessage(content="recorded"))])
+    assert recordings.lookup_request(get_request_hash(dumps(messages))) is not None
+
+    # Recorded by another model with other parameters, replayed from the messages only
+    replay = ReplayChatModel(cache_path=cache_path)
+    assert replay.invoke(messages).content == "recorded"
+    with pytest.raises(ReplayMissError):
+        replay.invoke([HumanMessage(content="Transcribe another frame")])
+
+
+def test_replay_serves_the_responses_of_a_recorded_run(tmp_path):
+    cache_path = str(tmp_path / "recordings.sqlite")
+    recorder = FakeChatModel(model_name=MODEL['model_name'], latency_ms=0, cache=SQLiteLLMCache(MODEL, path=cache_path))
+    recorded = recorder.invoke("Combine the transcripts")
+    assert ReplayChatModel(cache_path=cache_path).invoke("Combine the transcripts").content == recorded.content
+
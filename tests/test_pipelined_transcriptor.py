@@ -0,0 +1,114 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from ingestion import combined_text_transcriptor, constants, pipelined_transcriptor
+from ingestion.manifest import Stage, read_manifest
+from ingestion.pipelined_transcriptor import generate_transcript_pipelined
+from ingestion.transcript_store import load_transcript_document
+
+
+def run_with_timeout(function, timeout: float = 60.0):
+    """
+    Calls function in a thread, failing instead of hanging if it does not return within timeout seconds.
+    """
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = function()
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipelined ingestion did not return"
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    """
+    Number of transcription workers of the pipeline (the concurrency limit of the model).
+    """
+    def set_workers(count: int) -> None:
+        rate_limiter = SimpleNamespace(max_concurrency=count)
+        monkeypatch.setattr(pipelined_transcriptor, 'get_rate_limiter', lambda model: rate_limiter)
+    return set_workers
+
+
+def test_every_worker_stops_at_the_end_of_segments(offline, video_path, tmp_path, workers):
+    workers(3)
+    output_dir = str(tmp_path / "out")
+    os.makedirs(output_dir)
+    run_with_timeout(lambda: generate_transcript_pipelined(video_path, output_dir, 5, queue_size=1))
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("transcriber-")]
+    stages = read_manifest(output_dir)["stages"]
+    assert len(stages[Stage.AUDIO_TRANSCRIPT.value]["units"]) == 4
+    assert stages[Stage.FRAME_TRANSCRIPTS.value]["complete"]
+    document = load_transcript_document(output_dir)
+    assert document is not None and document['metadata']['segments_completed'] == 4
+
+
+def test_worker_error_is_raised_without_blocking_extraction(offline, video_path, tmp_path, workers, monkeypatch):
+    workers(2)
+    extracted = []
+
+    def iter_extracted_segments(*args):
+        for idx in range(10):
+            extracted.append(idx)
+            yield f"{idx:03d}", [], (idx * 5.0, idx * 5.0 + 5.0)
+
+    def transcribe_segment(chat_model, segment_id, *args):
+        if segment_id == "001":
+            raise ValueError("broken segment")
+        return {"audio_transcript": {}, "frame_transcript": {}}
+
+    monkeypatch.setattr(pipelined_transcriptor, 'iter_extracted_segments', iter_extracted_segments)
+    monkeypatch.setattr(pipelined_transcriptor, 'transcribe_segment', transcribe_segment)
+    output_dir = str(tmp_path / "out")
+    os.makedirs(output_dir)
+    with pytest.raises(ValueError, match="broken segment"):
+        run_with_timeout(lambda: generate_transcript_pipelined(video_path, output_dir, 5, queue_size=1))
+    # Extraction stops at the failure instead of running through the video
+    assert len(extracted) < 10
+    assert not os.path.exists(os.path.join(output_dir, "transcript.json"))
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("transcriber-")]
+
+
+def test_partial_transcript_is_published_every_few_segments(offline, video_path, tmp_path, workers, monkeypatch):
+    workers(1)
+    monkeypatch.setattr(constants, 'PARTIAL_TRANSCRIPT_EVERY', 2)
+    output_dir = str(tmp_path / "out")
+    os.makedirs(output_dir)
+    published = []
+
+    def iter_extracted_segments(*args):
+        for idx in range(5):
+            yield f"{idx:03d}", [], (idx * 5.0, idx * 5.0 + 5.0)
+
+    def transcribe_segment(chat_model, segment_id, *args):
+        return {"audio_transcript": {"transcript": [{"speaker": "Speaker 1", "text": f"text {segment_id}"}]},
+                "frame_transcript": {}}
+
+    def publish_partial_transcript(output_dir, segment_transcripts):
+        combined_text_transcriptor.publish_partial_transcript(output_dir, segment_transcripts)
+        published.append(load_transcript_document(output_dir))
+
+    monkeypatch.setattr(pipelined_transcriptor, 'iter_extracted_segments', iter_extracted_segments)
+    monkeypatch.setattr(pipelined_transcriptor, 'transcribe_segment', transcribe_segment)
+    monkeypatch.setattr(pipelined_transcriptor, 'publish_partial_transcript', publish_partial_transcript)
+    run_with_timeout(lambda: generate_transcript_pipelined(video_path, output_dir, 5))
+
+    assert [document['metadata']['segments_completed'] for document in published] == [2, 4]
+    assert all(document['metadata']['partial'] for document in published)
+    last_partial = str(published[-1]['combined_transcript'])
+    assert "text 003" in last_partial and "text 004" not in last_partial
+    # The combined document of every segment replaces the last partial one
+    document = load_transcript_document(output_dir)
+    assert not document['metadata'].get('partial', False) and document['metadata']['segments_completed'] == 5
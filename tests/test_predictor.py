@@ -0,0 +1,37 @@
+import json
+import os
+
+from agent.config import constants as agent_constants
+from ingestion import constants
+from ingestion.manifest import IngestionManifest, Stage
+from ingestion.predictor import get_actuals
+
+
+def write_ingestion(output_dir: str, runs: int = 1, cached_requests: int = 0, segment_cache_hits: int = 0) -> None:
+    files = {
+        IngestionManifest.FILE_NAME: {"stages": {Stage.COMBINED.value: {"complete": True}}},
+        agent_constants.TOKEN_USAGE_FILE: {"runs": runs, "cached_requests": cached_requests,
+                                           "total": {"requests": 10, "input_tokens": 1000, "output_tokens": 100}},
+        constants.ESTIMATE_FILE: {"raw": {}, "wall_seconds": 60.0},
+        constants.SEGMENT_CACHE_STATS_FILE: {"frame": {"hits": segment_cache_hits, "misses": 5}},
+    }
+    for name, content in files.items():
+        with open(os.path.join(output_dir, name), 'w') as f:
+            json.dump(content, f)
+
+
+def test_fresh_ingestion_calibrates(tmp_path):
+    write_ingestion(str(tmp_path))
+    assert get_actuals(str(tmp_path))["wall_seconds"] == 60.0
+
+
+def test_resumed_ingestion_does_not_calibrate(tmp_path):
+    write_ingestion(str(tmp_path), runs=2)
+    assert get_actuals(str(tmp_path)) is None
+
+
+def test_cached_ingestions_do_not_calibrate(tmp_path):
+    write_ingestion(str(tmp_path), cached_requests=3)
+    assert get_actuals(str(tmp_path)) is None
+    write_ingestion(str(tmp_path), segment_cache_hits=1)
+    assert get_actuals(str(tmp_path)) is None
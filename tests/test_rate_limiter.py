@@ -0,0 +1,205 @@
+import threading
+import time
+
+import pytest
+from langchain_core.caches import InMemoryCache
+from langchain_core.runnables import RunnableLambda
+
+from agent.config import constants
+from agent.config.offline_models import FakeChatModel
+from agent.utils.rate_limiter import (ConcurrencyCallbackHandler, RateLimiter, RequestBudget,
+                                      RequestDeadlineExceededError, is_overload_error, is_transient_error,
+                                      request_budget, set_rate_limits)
+from agent.utils.request_executor import invoke_llm, invoke_with_retries
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+def failing_runnable(errors: list) -> RunnableLambda:
+    """
+    Runnable raising the given errors in turn, then answering "ok".
+    """
+    calls = []
+
+    def invoke(_):
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "ok"
+
+    runnable = RunnableLambda(invoke)
+    runnable.calls = calls
+    return runnable
+
+
+def test_overload_errors():
+    assert is_overload_error(StatusError(429))
+    assert is_overload_error(StatusError(503))
+    assert is_overload_error(ResourceExhausted("quota"))
+    assert is_overload_error(RuntimeError("Error code: 429 - rate limit reached"))
+    assert not is_overload_error(StatusError(400))
+    assert not is_overload_error(ValueError("429 tokens"))
+
+
+def test_transient_errors():
+    assert is_transient_error(StatusError(429))
+    assert is_transient_error(StatusError(502))
+    assert is_transient_error(APIConnectionError("reset"))
+    assert not is_transient_error(StatusError(400))
+    assert not is_transient_error(ValueError("bad output"))
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(constants, 'REQUEST_RETRY_SECONDS', 0.0)
+    runnable = failing_runnable([StatusError(429), APIConnectionError("reset")])
+    assert invoke_with_retries(runnable, "hello") == "ok"
+    assert len(runnable.calls) == 3
+
+
+def test_other_errors_are_not_retried(monkeypatch):
+    monkeypatch.setattr(constants, 'REQUEST_RETRY_SECONDS', 0.0)
+    runnable = failing_runnable([ValueError("bad request")])
+    with pytest.raises(ValueError):
+        invoke_with_retries(runnable, "hello")
+    assert len(runnable.calls) == 1
+
+
+def test_retries_are_bounded(monkeypatch):
+    monkeypatch.setattr(constants, 'REQUEST_RETRY_SECONDS', 0.0)
+    monkeypatch.setattr(constants, 'REQUEST_RETRIES', 2)
+    runnable = failing_runnable([StatusError(429)] * 5)
+    with pytest.raises(StatusError):
+        invoke_with_retries(runnable, "hello")
+    assert len(runnable.calls) == 3
+
+
+def run_backlog(rate_limiter: RateLimiter, count: int, error: BaseException = None) -> None:
+    """
+    Completes count requests of a backlog through the limiter, which is kept full: every release lets the next
+    request of the backlog start. The requests of the last window are left in flight.
+    """
+    in_flight = []
+    for _ in range(count):
+        while len(in_flight) >= rate_limiter.limit:
+            rate_limiter.release(in_flight.pop(0), error=error)
+        in_flight.append(rate_limiter.acquire())
+    for slot in in_flight:
+        rate_limiter.release(slot, error=error)
+
+
+@pytest.fixture
+def no_latency_spikes(monkeypatch):
+    # Requests of a few microseconds make jittery latencies
+    monkeypatch.setattr(constants, 'AIMD_LATENCY_SPIKE_FACTOR', float('inf'))
+
+
+def test_limit_grows_up_to_the_ceiling_in_slow_start(monkeypatch, no_latency_spikes):
+    monkeypatch.setattr(constants, 'AIMD_INITIAL_CONCURRENCY', 2)
+    rate_limiter = RateLimiter(max_concurrency=16)
+    # One more request in flight per success
+    run_backlog(rate_limiter, 6)
+    assert rate_limiter.limit >= 6
+    run_backlog(rate_limiter, 20)
+    assert rate_limiter.limit == 16
+
+
+def test_limit_only_grows_while_the_requests_fill_it(monkeypatch, no_latency_spikes):
+    monkeypatch.setattr(constants, 'AIMD_INITIAL_CONCURRENCY', 4)
+    rate_limiter = RateLimiter(max_concurrency=16)
+    for _ in range(10):
+        rate_limiter.release(rate_limiter.acquire())
+    assert rate_limiter.limit == 4
+
+
+def test_overloads_of_a_window_cut_the_limit_once(monkeypatch, no_latency_spikes):
+    monkeypatch.setattr(constants, 'AIMD_INITIAL_CONCURRENCY', 8)
+    rate_limiter = RateLimiter(max_concurrency=16)
+    slots = [rate_limiter.acquire() for _ in range(8)]
+    for slot in slots:
+        rate_limiter.release(slot, error=StatusError(429))
+    assert rate_limiter.limit == 4
+    # Past the first cut, the limit grows by one per limit's worth of successes
+    run_backlog(rate_limiter, 40)
+    assert 5 <= rate_limiter.limit <= 9
+
+
+def test_other_errors_leave_the_limit_alone(monkeypatch):
+    monkeypatch.setattr(constants, 'AIMD_INITIAL_CONCURRENCY', 4)
+    rate_limiter = RateLimiter(max_concurrency=16)
+    run_backlog(rate_limiter, 20, ValueError("bad output"))
+    assert rate_limiter.limit == 4
+
+
+def test_latency_spike_cuts_the_limit(monkeypatch):
+    monkeypatch.setattr(constants, 'AIMD_INITIAL_CONCURRENCY', 4)
+    rate_limiter = RateLimiter(max_concurrency=4)
+    for _ in range(constants.AIMD_LATENCY_MIN_SAMPLES):
+        rate_limiter.release(rate_limiter.acquire(), stage='frames')
+    slot = rate_limiter.acquire()
+    slot.started -= 10.0
+    rate_limiter.release(slot, stage='frames')
+    assert rate_limiter.limit == 2
+
+
+def test_acquire_gives_up_at_the_deadline():
+    rate_limiter = RateLimiter(max_concurrency=1, adaptive=False)
+    held = rate_limiter.acquire()
+    started = time.monotonic()
+    with pytest.raises(RequestDeadlineExceededError):
+        rate_limiter.acquire(RequestBudget(deadline=started + 0.2))
+    assert time.monotonic() - started < 1.0
+    budget = RequestBudget()
+    budget.abandoned.set()
+    rate_limiter.release(held)
+    with pytest.raises(RequestDeadlineExceededError):
+        rate_limiter.acquire(budget)
+    assert rate_limiter.acquire(RequestBudget(deadline=time.monotonic() + 1.0)) is not None
+
+
+def test_cache_hits_do_not_wait_for_a_slot():
+    model = {'provider': 'fake', 'model_name': 'test-cache-hit'}
+    rate_limiter = set_rate_limits(model, max_concurrency=1, adaptive=False)
+    concurrency = ConcurrencyCallbackHandler(model)
+    llm = FakeChatModel(model_name=model['model_name'], cache=InMemoryCache(), callbacks=[concurrency],
+                        rate_limiter=concurrency)
+    expected = llm.invoke("hello")
+
+    held = rate_limiter.acquire()
+    answers = []
+    thread = threading.Thread(target=lambda: answers.append(llm.invoke("hello")), daemon=True)
+    thread.start()
+    thread.join(timeout=2.0)
+    assert [answer.content for answer in answers] == [expected.content]
+    # A cache miss still waits, and gives up at the deadline of its request
+    with request_budget(RequestBudget(deadline=time.monotonic() + 0.2)), pytest.raises(RequestDeadlineExceededError):
+        llm.invoke("another prompt")
+    rate_limiter.release(held)
+    assert rate_limiter._in_flight == 0
+
+
+def test_request_past_its_deadline_never_reaches_the_provider():
+    model = {'provider': 'fake', 'model_name': 'test-deadline'}
+    rate_limiter = set_rate_limits(model, max_concurrency=1, adaptive=False)
+    concurrency = ConcurrencyCallbackHandler(model)
+    calls = []
+    llm = FakeChatModel(model_name=model['model_name'], callbacks=[concurrency], rate_limiter=concurrency)
+    llm = llm.with_listeners(on_start=lambda run: calls.append(run))
+
+    held = rate_limiter.acquire()
+    with pytest.raises(RequestDeadlineExceededError):
+        invoke_llm(llm, "hello", timeout=0.2)
+    rate_limiter.release(held)
+    time.sleep(1.2)
+    assert rate_limiter._in_flight == 0
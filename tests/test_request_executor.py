@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from agent.utils.request_executor import RequestDeadlineExceededError, invoke_llm, with_deadline
+
+
+def stalled_runnable(stalls: int) -> RunnableLambda:
+    """
+    Runnable whose first stalls calls never answer, the next ones answer "ok".
+    """
+    calls = []
+    stalled = threading.Event()
+
+    def invoke(_):
+        calls.append(1)
+        if len(calls) <= stalls:
+            stalled.wait()
+        return "ok"
+
+    runnable = RunnableLambda(invoke)
+    runnable.calls = calls
+    return runnable
+
+
+def test_request_is_sent_again_after_its_timeout_within_the_run_deadline():
+    runnable = stalled_runnable(2)
+    started = time.monotonic()
+    assert invoke_llm(runnable, "hello", config=with_deadline({}, 5), timeout=0.2) == "ok"
+    assert len(runnable.calls) == 3
+    assert time.monotonic() - started < 2
+
+
+def test_request_fails_once_the_run_deadline_is_exhausted():
+    runnable = stalled_runnable(100)
+    started = time.monotonic()
+    with pytest.raises(RequestDeadlineExceededError):
+        invoke_llm(runnable, "hello", config=with_deadline({}, 0.5), timeout=0.2)
+    assert 0.5 <= time.monotonic() - started < 1.5
+    assert len(runnable.calls) >= 2
+
+
+def test_request_without_run_deadline_fails_at_its_timeout():
+    runnable = stalled_runnable(1)
+    with pytest.raises(RequestDeadlineExceededError):
+        invoke_llm(runnable, "hello", timeout=0.2)
+    assert len(runnable.calls) == 1
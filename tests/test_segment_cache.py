@@ -0,0 +1,46 @@
+import base64
+
+import cv2
+import numpy as np
+import pytest
+
+from ingestion import constants, segment_cache
+
+
+def slide(lines: list, quality: int = 95, scale: float = 1.0) -> str:
+    image = np.full((720, 1280, 3), 255, dtype=np.uint8)
+    cv2.putText(image, "Quarterly results", (80, 120), cv2.FONT_HERSHEY_SIMPLEX, 2.5, (0, 0, 0), 5)
+    for idx, line in enumerate(lines):
+        cv2.putText(image, line, (80, 260 + idx * 70), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (30, 30, 30), 2)
+    if scale != 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return base64.b64encode(buffer.tobytes()).decode('utf-8')
+
+
+LINES = ["Revenue grew 12% to 4.2M", "Costs were flat at 1.1M", "Headcount 42"]
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, 'SEGMENT_CACHE_ENABLED', True)
+    monkeypatch.setattr(segment_cache, '_segment_cache', segment_cache.SegmentCache(str(tmp_path / "cache.sqlite")))
+
+
+def test_reencoded_frame_reuses_the_transcript(cache):
+    original = slide(LINES)
+    segment_cache.store("frame:a", "ns", "transcript", segment_cache.get_frame_thumbnail(original))
+    for reencoded in (slide(LINES, quality=40), slide(LINES, quality=85, scale=0.5)):
+        assert segment_cache.lookup("frame:a", "ns", segment_cache.get_frame_thumbnail(reencoded)) == "transcript"
+
+
+def test_other_frame_with_the_same_key_is_a_miss(cache):
+    segment_cache.store("frame:a", "ns", "transcript", segment_cache.get_frame_thumbnail(slide(LINES)))
+    edited = slide(["Revenue grew 12% to 4.7M"] + LINES[1:])
+    assert segment_cache.lookup("frame:a", "ns", segment_cache.get_frame_thumbnail(edited)) is None
+
+
+def test_frame_entries_without_thumbnail_are_not_reused(cache):
+    segment_cache.store("frame:a", "ns", "transcript")
+    assert segment_cache.lookup("frame:a", "ns", segment_cache.get_frame_thumbnail(slide(LINES))) is None
+    assert segment_cache.lookup("frame:a", "ns") == "transcript"
@@ -0,0 +1,124 @@
+import random
+import subprocess
+
+import numpy as np
+import pytest
+
+from agent.utils.cancellation import CancellationToken, OperationCancelledError, cancellation_scope
+from ingestion.segmenter import (find_silence_points, get_candidate_hash, get_loudness_envelope, plan_segments,
+                                 select_boundaries)
+
+
+def segment_lengths(boundaries, duration):
+    return np.diff([0.0] + boundaries + [duration])
+
+
+def random_scene_starts(seed: int, duration: float) -> list:
+    rng = random.Random(seed)
+    starts, time_s = [], 0.0
+    while True:
+        time_s += rng.uniform(2, 12)
+        if time_s >= duration:
+            return starts
+        starts.append(round(time_s, 1))
+
+
+def test_without_content_candidates_are_cut_past_the_target_duration():
+    boundaries = select_boundaries(list(range(5, 300, 7)), np.zeros(0), 300, 15, 30, 60)
+    assert all(length >= 30 for length in segment_lengths(boundaries, 300)[:-1])
+    assert len(boundaries) + 1 <= 10
+
+
+def test_flat_audio_does_not_hash():
+    envelope = np.full(3000, -90.0)
+    assert get_candidate_hash(envelope, 12.0) is None
+    boundaries = select_boundaries(list(range(5, 300, 7)), envelope, 300, 15, 30, 60)
+    assert all(length >= 30 for length in segment_lengths(boundaries, 300)[:-1])
+
+
+def test_evenly_spaced_scene_cuts_are_cut_past_the_target_duration():
+    candidates = [float(time_s) for time_s in range(5, 300, 7)]
+    boundaries = select_boundaries(candidates, np.zeros(0), 300, 15, 30, 60, scene_starts=candidates)
+    assert all(length >= 30 for length in segment_lengths(boundaries, 300)[:-1])
+
+
+def test_loudness_hash_cuts_between_min_and_max_duration():
+    envelope = np.random.default_rng(0).uniform(-60, 0, 3000)
+    candidates = [float(time_s) for time_s in range(5, 300, 3)]
+    boundaries = select_boundaries(candidates, envelope, 300, 15, 30, 60)
+    lengths = segment_lengths(boundaries, 300)
+    assert all(15 <= length <= 60 for length in lengths)
+    # Content-defined: some segments are cut before the target duration
+    assert any(length < 30 for length in lengths)
+
+
+def test_scene_cut_boundaries_fall_back_in_step_after_an_edit():
+    duration, inserted_at, inserted = 600.0, 50.0, 20.0
+    original = random_scene_starts(1, duration)
+    edited = ([start for start in original if start < inserted_at]
+              + [inserted_at + offset for offset in (4.0, 9.5, 15.0)]
+              + [round(start + inserted, 1) for start in original if start >= inserted_at])
+    original_boundaries = select_boundaries(original, np.zeros(0), duration, 15, 30, 60, scene_starts=original)
+    edited_boundaries = select_boundaries(edited, np.zeros(0), duration + inserted, 15, 30, 60, scene_starts=edited)
+
+    lengths = segment_lengths(original_boundaries, duration)
+    assert all(15 <= length <= 60 for length in lengths)
+    assert any(length < 30 for length in lengths)
+    shifted = {round(boundary + inserted, 1) for boundary in original_boundaries if boundary > 200}
+    assert shifted <= {round(boundary, 1) for boundary in edited_boundaries}
+
+
+def test_hash_ignores_the_position_in_the_video():
+    scene_starts = [10.0, 13.5, 20.0, 31.0]
+    shifted = [start + 100 for start in scene_starts]
+    assert get_candidate_hash(np.zeros(0), 10.0, scene_starts) == get_candidate_hash(np.zeros(0), 110.0, shifted)
+    assert get_candidate_hash(np.zeros(0), 31.0, scene_starts) is None
+
+
+def write_scenes_video(path: str, scene_starts: list, duration: float, fps: int = 5) -> None:
+    import cv2
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (64, 64))
+    rng = random.Random(0)
+    color, starts = None, set(round(start * fps) for start in scene_starts)
+    for frame_idx in range(int(duration * fps)):
+        if color is None or frame_idx in starts:
+            color = [rng.randrange(256) for _ in range(3)]
+        writer.write(np.full((64, 64, 3), color, dtype=np.uint8))
+    writer.release()
+
+
+def test_video_only_content_segmentation_hashes_scene_cuts(tmp_path):
+    duration = 300.0
+    scene_starts = random_scene_starts(2, duration)
+    video_path = str(tmp_path / "scenes.mp4")
+    write_scenes_video(video_path, scene_starts, duration)
+
+    plan = plan_segments(video_path, 30, mode="content", consider_audio=False)
+    lengths = segment_lengths(plan.boundaries, plan.duration)
+    assert len(plan.scene_frames) > 20
+    assert all(15 <= length <= 60 for length in lengths)
+    # Neither every cut past min_s nor fixed-duration segments
+    assert 7 <= len(lengths) <= 13
+
+
+def test_loudness_envelope_is_streamed_window_by_window(tmp_path):
+    audio_path = str(tmp_path / "tone.wav")
+    # 70 s tone with a 1 s silence at 65 s, longer than a chunk of SEGMENT_ENVELOPE_CHUNK_WINDOWS windows
+    subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "sine=frequency=440:duration=70",
+                    "-af", "volume=enable='between(t,65,66)':volume=0", audio_path], check=True)
+    envelope = get_loudness_envelope(audio_path)
+    assert len(envelope) == 700
+    assert envelope[:600].min() > -30
+    assert find_silence_points(envelope) == [pytest.approx(65.5, abs=0.1)]
+
+
+def test_loudness_envelope_of_an_unreadable_video_is_empty(tmp_path):
+    assert len(get_loudness_envelope(str(tmp_path / "missing.mp4"))) == 0
+
+
+def test_loudness_envelope_stops_on_cancellation(tmp_path):
+    token = CancellationToken()
+    token.cancel()
+    with cancellation_scope(token), pytest.raises(OperationCancelledError):
+        get_loudness_envelope(str(tmp_path / "missing.mp4"))
@@ -0,0 +1,16 @@
+from agent.config import constants
+from agent.utils.token_utils import get_max_input_tokens
+
+
+def test_input_budget_is_the_context_window_of_the_model(monkeypatch):
+    monkeypatch.setattr(constants, 'MAX_INPUT_TOKENS', 0)
+    assert get_max_input_tokens('openai', 'gpt-4o-mini') == 128000
+    assert get_max_input_tokens('openai', 'gpt-4.1-nano') == 1047576
+    assert get_max_input_tokens('google_genai', 'gemini-1.5-pro-002') == 2097152
+    assert get_max_input_tokens('azure_openai', 'my-deployment') == 128000
+    assert get_max_input_tokens('other') == constants.DEFAULT_CONTEXT_WINDOW
+
+
+def test_configured_input_budget_wins(monkeypatch):
+    monkeypatch.setattr(constants, 'MAX_INPUT_TOKENS', 50000)
+    assert get_max_input_tokens('google_genai', 'gemini-2.0-flash') == 50000
@@ -0,0 +1,22 @@
+import sqlite3
+
+from ingestion.transcript_store import TranscriptStore
+
+
+def test_only_complete_segments_are_counted(tmp_path):
+    store = TranscriptStore(str(tmp_path))
+    for segment_id in ("000", "001", "002"):
+        store.put_segment(segment_id, {"audio_transcript": {"text": "hello"}}, complete=False)
+    assert store.count_segments() == 0
+    store.put_segment("000", {"audio_transcript": {"text": "hello"}, "frame_transcript": {"title": ["000/a.jpg"]}})
+    assert store.count_segments() == 1
+
+
+def test_segments_of_a_store_without_completion_flag_are_complete(tmp_path):
+    path = str(tmp_path / TranscriptStore.FILE_NAME)
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE segments (segment_id TEXT PRIMARY KEY, start REAL, end REAL,"
+                     " audio_transcript TEXT NOT NULL, frame_transcript TEXT NOT NULL)")
+        conn.execute("INSERT INTO segments VALUES ('000', 0, 30, '{}', '{}')")
+    conn.close()
+    assert TranscriptStore(str(tmp_path)).count_segments() == 1
@@ -0,0 +1,59 @@
+import base64
+import json
+import os
+import threading
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from ingestion import constants
+from ingestion.transcriptor import llm_requests, write_transcript
+
+SEGMENTS = 4
+MODEL = {'provider': 'fake', 'model_name': 'test-transcriptor'}
+
+
+def write_segments(path_to_folder) -> None:
+    for idx in range(SEGMENTS):
+        os.makedirs(path_to_folder / "frames" / f"{idx:03d}")
+        (path_to_folder / "frames" / f"{idx:03d}" / "frame.jpg").write_bytes(f"frame {idx}".encode())
+    os.makedirs(path_to_folder / "audio_segments")
+    for idx in range(SEGMENTS):
+        (path_to_folder / "audio_segments" / f"{idx:03d}.wav").write_bytes(f"{idx}".encode())
+
+
+def test_segments_are_requested_concurrently_and_kept_in_order(tmp_path):
+    write_segments(tmp_path)
+    # Every segment is in flight at once before any completes
+    in_flight = threading.Barrier(SEGMENTS, timeout=5)
+    partial_path = tmp_path / constants.PARTIAL_TRANSCRIPT_FILE
+
+    def invoke(messages):
+        idx = int(base64.b64decode(messages[0].content[1]["data"]))
+        in_flight.wait()
+        if idx == 0:
+            # The last segment to complete sees the others in the partial transcript, not in transcript.json
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                if partial_path.exists() and json.loads(partial_path.read_text())[1:] == \
+                        [{"segment": i} for i in range(1, SEGMENTS)]:
+                    break
+                time.sleep(0.01)
+            assert json.loads(partial_path.read_text())[0] is None
+            assert not (tmp_path / "transcript.json").exists()
+        else:
+            time.sleep(0.05 * (SEGMENTS - idx))
+        return AIMessage(content=json.dumps({"segment": idx}))
+
+    outputs = llm_requests(RunnableLambda(invoke), str(tmp_path), MODEL)
+    assert outputs == [{"segment": idx} for idx in range(SEGMENTS)]
+    assert not (tmp_path / "transcript.json").exists()
+
+
+def test_final_transcript_replaces_the_partial_one(tmp_path):
+    write_transcript(str(tmp_path), [{"segment": 0}, None], partial=True)
+    assert not (tmp_path / "transcript.json").exists()
+    write_transcript(str(tmp_path), [{"segment": 0}, {"segment": 1}])
+    assert json.loads((tmp_path / "transcript.json").read_text()) == [{"segment": 0}, {"segment": 1}]
+    assert not (tmp_path / constants.PARTIAL_TRANSCRIPT_FILE).exists()
@@ -0,0 +1,21 @@
+import io
+import os
+
+from ingestion.video_utils import compute_file_video_id, persist_upload, promote_upload
+
+
+def test_upload_is_moved_without_being_read_again(tmp_path):
+    content = os.urandom(4096)
+    video_id, pending_path = persist_upload(io.BytesIO(content), str(tmp_path / "pending"))
+    assert video_id == compute_file_video_id(pending_path)
+
+    video_path = promote_upload(pending_path, str(tmp_path / "input"))
+    assert video_path == str(tmp_path / "input" / f"{video_id}.mp4")
+    assert not os.path.exists(pending_path)
+    with open(video_path, 'rb') as f:
+        assert f.read() == content
+
+    # The same content uploaded again is not moved over the persisted video
+    _, pending_path = persist_upload(io.BytesIO(content), str(tmp_path / "pending"))
+    assert promote_upload(pending_path, str(tmp_path / "input")) == video_path
+    assert os.listdir(tmp_path / "pending") == []